@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+""" benchmark-codecs
+    compares the read/write throughput and compression ratio of the
+    eWRT.util.codec codecs on sample cache payloads """
+
+from __future__ import print_function
+
+from json import dumps
+from time import time
+from eWRT.util.codec import get_codec, available_codecs, decode
+
+ROUNDS = 2000
+
+SAMPLE_PAYLOADS = {
+    'small json': dumps({'term': 'climate change', 'count': 12,
+                         'related': ['global warming', 'co2']}),
+    'term list': ['term-%d' % x for x in range(500)],
+    'document': " ".join(["The extensible Web Retrieval Toolkit retrieves "
+                          "social data from Web sources."] * 200),
+}
+
+CODEC_CONFIGURATIONS = [('pickle', None), ('zlib', 1), ('zlib', 6),
+                        ('gzip', 9), ('zstd', 3), ('lz4', 0)]
+
+
+def benchmark(codec, payload):
+    """ returns the write and read throughput (MB/s) and the compression
+        ratio of the given codec """
+    start = time()
+    for _ in range(ROUNDS):
+        data = codec.dumps(payload)
+    write_time = time() - start
+
+    start = time()
+    for _ in range(ROUNDS):
+        decode(data)
+    read_time = time() - start
+
+    raw_size = len(get_codec("pickle").dumps(payload))
+    mb = ROUNDS * raw_size / 1024. / 1024.
+    return mb / write_time, mb / read_time, float(len(data)) / raw_size
+
+
+if __name__ == '__main__':
+    print("%-12s %-10s %12s %12s %8s" % ("payload", "codec", "write MB/s",
+                                         "read MB/s", "ratio"))
+    for payload_name, payload in sorted(SAMPLE_PAYLOADS.items()):
+        for name, level in CODEC_CONFIGURATIONS:
+            if name not in available_codecs():
+                continue
+            codec = get_codec(name, level)
+            write, read, ratio = benchmark(codec, payload)
+            print("%-12s %-10s %12.1f %12.1f %8.3f" % (
+                payload_name, "%s:%s" % (name, level), write, read, ratio))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+""" benchmark-keys
+    compares the legacy cache key computation (sha1 of the key's repr) with
+    the canonical eWRT.util.cache.KeyEncoder """
+
+from __future__ import print_function
+
+from time import time
+from eWRT.util.cache import Cache, KeyEncoder
+
+ROUNDS = 2000
+
+SAMPLE_ARGUMENTS = {
+    'small': ((12, 'climate change'), {'lang': 'en'}),
+    'term list': ((['term-%d' % x for x in range(1000)], ), {}),
+    'document': ((u"The extensible Web Retrieval Toolkit retrieves social "
+                  u"data from Web sources. " * 2000, ), {'lang': 'en'}),
+}
+
+
+def legacy_object_id(args, kargs):
+    return Cache.getObjectId(Cache.getKey(*args, **kargs))
+
+
+def benchmark(object_id, args, kargs):
+    """ returns the number of object ids computed per second """
+    start = time()
+    for _ in range(ROUNDS):
+        object_id(args, kargs)
+    return ROUNDS / (time() - start)
+
+
+if __name__ == '__main__':
+    methods = (('sha1(repr)', legacy_object_id),
+               ('KeyEncoder', KeyEncoder().getCallObjectId),
+               ('KeyEncoder(fast)', KeyEncoder(fast=True).getCallObjectId))
+
+    print("%-10s %-18s %14s" % ("arguments", "method", "keys/s"))
+    for name, (args, kargs) in sorted(SAMPLE_ARGUMENTS.items()):
+        for method_name, object_id in methods:
+            print("%-10s %-18s %14.0f" % (name, method_name,
+                                          benchmark(object_id, args, kargs)))
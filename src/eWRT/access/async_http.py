@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.async_http
+    retrieves resources concurrently using asyncio (python 3.7+ only)
+
+    usage:
+      async def crawl(urls):
+          async with AsyncRetrieve("crawler", max_host_concurrency=2) as r:
+              async for url, content in r.open_many(urls):
+                  if not isinstance(content, Exception):
+                      ...
+
+    @remarks
+    Requests are performed by eWRT.access.http.Retrieve in a thread pool,
+    i.e. AsyncRetrieve supports the same features (authentication,
+    compression, retries, user agent, keep-alive connections). Throttling
+    and the concurrency limits are enforced within the event loop, so
+    waiting requests do not occupy threads.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weblyzard.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from eWRT.config import USER_AGENT, DEFAULT_WEB_REQUEST_SLEEP_TIME
+from eWRT.access.http import (Retrieve, DEFAULT_TIMEOUT, CONNECTION_POOL,
+                              THROTTLE_REGISTRY)
+
+# maximum number of concurrent requests
+DEFAULT_MAX_CONCURRENCY = 20
+# maximum number of concurrent requests per host
+DEFAULT_MAX_HOST_CONCURRENCY = 4
+
+
+class AsyncRetrieve(object):
+    ''' @class AsyncRetrieve
+        retrieves URLs concurrently with a global and a per host limit on
+        the number of concurrent requests
+
+        @remarks
+        The limits apply per event loop, i.e. an AsyncRetrieve object may
+        be used by several (consecutive or concurrent) event loops.
+    '''
+
+    def __init__(self, module, sleep_time=DEFAULT_WEB_REQUEST_SLEEP_TIME,
+                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_host_concurrency=DEFAULT_MAX_HOST_CONCURRENCY,
+                 connection_pool=CONNECTION_POOL,
+                 throttle_registry=THROTTLE_REGISTRY):
+        ''' ::param module: the module name used in the user agent
+            ::param sleep_time: seconds to wait between two requests to the
+                                same host (see Retrieve)
+            ::param user_agent: the user agent
+            ::param default_timeout: the read timeout of requests
+            ::param max_concurrency: maximum number of concurrent requests
+            ::param max_host_concurrency: maximum number of concurrent
+                                          requests per host
+            ::param connection_pool: the ConnectionPool used for persistent
+                                     connections
+            ::param throttle_registry: the ThrottleRegistry shared with other
+                                       (Async)Retrieve objects
+        '''
+        self.sleep_time = sleep_time
+        self.max_concurrency = max_concurrency
+        self.max_host_concurrency = max_host_concurrency
+        self.throttle_registry = throttle_registry
+        # requests are throttled by the event loop
+        self.retrieve = Retrieve(module, sleep_time=0, user_agent=user_agent,
+                                 default_timeout=default_timeout,
+                                 connection_pool=connection_pool)
+        self._executor = ThreadPoolExecutor(max_concurrency)
+        # event loop -> (global semaphore, host -> semaphore)
+        self._semaphores = WeakKeyDictionary()
+
+    def _get_semaphores(self, url):
+        ''' returns the running event loop's global and host semaphore '''
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = self._semaphores[loop] = \
+                (asyncio.Semaphore(self.max_concurrency), {})
+        semaphore, host_semaphores = semaphores
+
+        host = (urlsplit(url).hostname or "").lower()
+        host_semaphore = host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = host_semaphores[host] = \
+                asyncio.Semaphore(self.max_host_concurrency)
+        return semaphore, host_semaphore
+
+    def _fetch(self, url, kargs):
+        ''' retrieves the url's content (called in the thread pool) '''
+        f = self.retrieve.open(url, **kargs)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    async def open(self, url, **kargs):
+        ''' retrieves the given url
+            ::param url: the url to retrieve
+            ::param kargs: optional arguments of Retrieve.open (data,
+                           headers, user, pwd, retry, ...)
+            ::returns: the (uncompressed) content
+        '''
+        semaphore, host_semaphore = self._get_semaphores(url)
+        async with host_semaphore:
+            wait = self.throttle_registry.reserve(url, self.sleep_time)
+            if wait:
+                await asyncio.sleep(wait)
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._executor, partial(self._fetch, url, kargs))
+
+    async def _open_tagged(self, url, kargs):
+        try:
+            return url, await self.open(url, **kargs)
+        except Exception as e:
+            return url, e
+
+    async def open_many(self, urls, **kargs):
+        ''' retrieves the given urls concurrently
+            ::param urls: the urls to retrieve
+            ::param kargs: optional arguments of Retrieve.open
+            ::returns: an asynchronous iterator of (url, content) tuples in
+                       the order of completion; content is the exception
+                       raised by failed requests
+        '''
+        tasks = [asyncio.ensure_future(self._open_tagged(url, kargs))
+                 for url in urls]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        ''' shuts down the thread pool '''
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
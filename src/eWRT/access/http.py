@@ -23,6 +23,10 @@ try:
     import urllib.request as urllib2
 except:
     import urllib2  # python2
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib  # python2
 
 from eWRT.config import (USER_AGENT, DEFAULT_WEB_REQUEST_SLEEP_TIME,
                          PROXY_SERVER)
@@ -37,27 +41,829 @@ except:
     from urlparse import urlsplit, urlunsplit  # python2
 
 import time
-import io
+import zlib
 
-from gzip import GzipFile
 from time import sleep
-from random import randint
+from random import uniform
+from email.utils import parsedate_tz, mktime_tz
+from os import getpid, open as os_open, close, read, write, lseek, \
+    O_RDWR, O_CREAT, SEEK_SET
+from struct import Struct
+from threading import Lock, BoundedSemaphore
+from collections import defaultdict
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from socket import error as SocketError, timeout as SocketTimeout, \
+    getdefaulttimeout, _GLOBAL_DEFAULT_TIMEOUT
+try:
+    from socket import _fileobject     # python 2
+except ImportError:
+    _fileobject = None
+
+try:
+    from fcntl import flock, LOCK_EX
+except ImportError:
+    flock = None  # windows
 
 # logging
 import logging
 log = logging.getLogger(__name__)
 
-RETRY_WAIT_TIME_RANGE = (2, 10)              # in seconds
+# exponential backoff between retries (in seconds)
+DEFAULT_BACKOFF_BASE = 1.
+DEFAULT_BACKOFF_FACTOR = 2.
+DEFAULT_BACKOFF_MAX = 60.
+# longer Retry-After periods are not waited for
+DEFAULT_MAX_RETRY_AFTER = 120.
 # error codes which might trigger a retry:
-HTTP_TEMPORARY_ERROR_CODES = (500, 503, 504)
+HTTP_TEMPORARY_ERROR_CODES = (429, 500, 502, 503, 504)
+# error codes which indicate a failing host (see CircuitBreaker)
+HTTP_SERVER_ERROR_CODES = (500, 502, 503, 504)
+
+# number of consecutive failures after which a host's circuit opens
+DEFAULT_FAILURE_THRESHOLD = 5
+# seconds after which an open circuit lets a probe request pass
+DEFAULT_RESET_TIMEOUT = 30.
 
-# set default socket timeout (otherwise urllib might hang!)
-from socket import setdefaulttimeout
+# default read timeout of requests in seconds (otherwise urllib might hang!)
 DEFAULT_TIMEOUT = 60
+# default timeout for establishing connections (None: use the read timeout)
+DEFAULT_CONNECT_TIMEOUT = None
+
+# number of threads and concurrent requests per host used by fetch_many
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_HOST_CONCURRENCY = 4
+
+# number of compressed bytes read from the socket at once
+DECOMPRESSION_CHUNK_SIZE = 1 << 16
+# content encodings handled by DecompressingStream
+SUPPORTED_CONTENT_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# state of a FileTokenBucket: available tokens, time of the last update
+_BUCKET_STATE = Struct("<dd")
+
+# maximum number of idle connections kept per host
+DEFAULT_POOL_SIZE = 10
+# seconds after which idle connections are closed
+DEFAULT_POOL_IDLE_TIMEOUT = 30
 
 getHostName = lambda x: "://".join(urlsplit(x)[:2])
 
 
+class ConnectionPool(object):
+    ''' @class ConnectionPool
+        keeps persistent HTTP/1.1 connections per host
+
+        @remarks
+        Connections are checked out for a single request and returned to
+        the pool, once the response has been read completely (see
+        PooledResponse). Pools are not shared with forked processes.
+    '''
+
+    def __init__(self, max_connections=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT):
+        ''' ::param max_connections: maximum number of idle connections
+                                     kept per host
+            ::param idle_timeout: seconds after which idle connections are
+                                  closed
+        '''
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._idle = {}     # (scheme, host) -> [(connection, release time)]
+        self._lock = Lock()
+        self._pid = getpid()
+
+    def get(self, key):
+        ''' checks out an idle connection to the given host
+            ::param key: the tuple (scheme, host)
+            ::returns: the connection or None
+        '''
+        expired = []
+        connection = None
+        with self._lock:
+            if self._pid != getpid():
+                self._idle = {}
+                self._pid = getpid()
+            idle = self._idle.get(key)
+            now = time.time()
+            while idle:
+                candidate, released = idle.pop()
+                if now - released < self.idle_timeout:
+                    connection = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        return connection
+
+    def put(self, key, connection):
+        ''' returns the connection to the pool '''
+        with self._lock:
+            if self._pid == getpid():
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_connections:
+                    idle.append((connection, time.time()))
+                    return
+        connection.close()
+
+    def release(self, key, connection, reusable):
+        ''' returns reusable connections to the pool and closes all others
+        '''
+        if reusable:
+            self.put(key, connection)
+        else:
+            connection.close()
+
+    def clear(self):
+        ''' closes all idle connections '''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+    def __len__(self):
+        ''' returns the number of idle connections '''
+        return sum(len(connections) for connections in self._idle.values())
+
+
+class PooledResponse(object):
+    ''' @class PooledResponse
+        wraps a response and returns its connection to the pool once the
+        response has been read completely
+    '''
+
+    def __init__(self, response, release, url=None):
+        ''' ::param response: the HTTPResponse
+            ::param release: function called with a flag indicating whether
+                             the connection can be reused
+            ::param url: the requested url
+        '''
+        self._response = response
+        self._release = release
+        if hasattr(response, 'readline'):
+            self._fp = response
+        else:
+            # python 2: HTTPResponse only supports read() (see
+            # urllib2.AbstractHTTPHandler.do_open)
+            response.recv = response.read
+            self._fp = _fileobject(response, close=True)
+        # the interface of urllib2's responses
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self._check_complete()
+        return data
+
+    def readline(self, *args):
+        line = self._fp.readline(*args)
+        self._check_complete()
+        return line
+
+    def readlines(self, *args):
+        lines = self._fp.readlines(*args)
+        self._check_complete()
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def _check_complete(self):
+        response = self._response
+        if self._release is None:
+            return
+        # readline() does not close responses read completely
+        if response.length == 0 and not response.isclosed():
+            response.close()
+        if response.isclosed():
+            self._release(not response.will_close)
+            self._release = None
+
+    def close(self):
+        ''' closes the response; connections of partially read responses
+            are not reused '''
+        response = self._response
+        complete = response.isclosed() or response.length == 0
+        response.close()
+        if self._release is not None:
+            self._release(complete and not response.will_close)
+            self._release = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# the connection pool used by default
+CONNECTION_POOL = ConnectionPool()
+
+
+def _is_stream_end(d):
+    ''' returns whether the decompressobj d has reached the end of the
+        compressed stream '''
+    if d.unused_data or getattr(d, 'eof', False):
+        return True
+    if hasattr(d, 'eof'):
+        return False
+    # python 2 does not provide eof => data following the end of the stream
+    # ends up in unused_data
+    try:
+        d.decompress(b"\x00")
+    except zlib.error:
+        return False
+    return d.unused_data == b"\x00"
+
+
+class DecompressingStream(object):
+    ''' @class DecompressingStream
+        a file object which decompresses gzip or deflate encoded streams
+        while reading them
+
+        @remarks
+        Compressed data is read in chunks of chunk_size bytes and only
+        decompressed as far as required by the caller, i.e. the memory use
+        does not depend on the size of the response (except for read()
+        without size). Attributes such as headers, code or geturl() are
+        delegated to the wrapped response.
+    '''
+
+    def __init__(self, fileobj, encoding='gzip',
+                 chunk_size=DECOMPRESSION_CHUNK_SIZE):
+        ''' ::param fileobj: the compressed stream
+            ::param encoding: the content encoding ('gzip' or 'deflate')
+            ::param chunk_size: number of compressed bytes read at once
+        '''
+        self.fileobj = fileobj
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self._decompressor = self._get_decompressor()
+        self._buffer = b""
+        self._eof = False
+        self._first = True
+
+    def _get_decompressor(self, wbits=None):
+        if wbits is None:
+            # wbits=31 decodes gzip, 15 zlib (deflate) streams
+            wbits = 15 if self.encoding == 'deflate' else 31
+        return zlib.decompressobj(wbits)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+    def _fill(self, max_length):
+        ''' decompresses up to max_length bytes into the buffer '''
+        d = self._decompressor
+        data = d.unconsumed_tail
+        if not data:
+            data = self.fileobj.read(self.chunk_size)
+            if not data:
+                self._eof = True
+                if not (self._first or _is_stream_end(d)):
+                    raise EOFError("Compressed file ended before the "
+                                   "end-of-stream marker was reached")
+                out = self._decompress_members(d, d.flush(), 0)
+                self._buffer += out + self._decompressor.flush()
+                return
+
+        try:
+            out = d.decompress(data, max_length)
+        except zlib.error:
+            # some servers send raw deflate streams without zlib header
+            if not (self._first and self.encoding == 'deflate'):
+                raise
+            d = self._decompressor = self._get_decompressor(-15)
+            out = d.decompress(data, max_length)
+        self._first = False
+        self._buffer += self._decompress_members(d, out, max_length)
+
+    def _decompress_members(self, d, out, max_length):
+        ''' decompresses the gzip members following the one completed by
+            the decompressor d (gzip files may consist of multiple members)
+        '''
+        while d.unused_data.startswith(_GZIP_MAGIC):
+            unused_data = d.unused_data
+            d = self._decompressor = self._get_decompressor()
+            out += d.decompress(unused_data, max_length)
+        return out
+
+    def read(self, size=-1):
+        ''' reads up to size uncompressed bytes (or all remaining bytes,
+            if size is negative) '''
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            self._buffer = b""
+            while not self._eof:
+                self._fill(0)
+                chunks.append(self._buffer)
+                self._buffer = b""
+            return b"".join(chunks)
+
+        while len(self._buffer) < size and not self._eof:
+            self._fill(max(size - len(self._buffer), self.chunk_size))
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        ''' reads the next line (including the newline) '''
+        pos = self._buffer.find(b"\n")
+        while pos < 0 and not self._eof and \
+                (size is None or size < 0 or len(self._buffer) < size):
+            start = len(self._buffer)
+            self._fill(self.chunk_size)
+            pos = self._buffer.find(b"\n", start)
+
+        end = pos + 1 if pos >= 0 else len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def next(self):
+        ''' Python 2 compatibility '''
+        return self.__next__()
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TokenBucket(object):
+    ''' @class TokenBucket
+        limits the request rate to a host
+
+        @remarks
+        Every request consumes one token; tokens are refilled with the given
+        rate up to burst tokens. Requests reserve their token immediately
+        and wait outside of the lock, i.e. concurrent threads are spaced
+        evenly rather than woken at the same time.
+    '''
+
+    def __init__(self, rate, burst=1):
+        ''' ::param rate: number of requests per second
+            ::param burst: maximum number of requests sent without delay
+        '''
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_update = time.time()
+        self._lock = Lock()
+
+    def _reserve(self, tokens, last_update, now):
+        ''' consumes a token
+            ::returns: the tuple (remaining tokens, seconds to wait)
+        '''
+        tokens = min(self.burst,
+                     tokens + max(now - last_update, 0.) * self.rate) - 1
+        return tokens, -tokens / self.rate if tokens < 0 else 0.
+
+    def reserve(self):
+        ''' reserves the next request
+            ::returns: the number of seconds to wait before sending it
+        '''
+        with self._lock:
+            now = time.time()
+            self._tokens, wait = self._reserve(self._tokens,
+                                               self._last_update, now)
+            self._last_update = now
+        return wait
+
+    def acquire(self):
+        ''' waits until the next request may be sent
+            ::returns: the number of seconds waited
+        '''
+        wait = self.reserve()
+        if wait:
+            sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    ''' @class FileTokenBucket
+        a TokenBucket, whose state is stored in a file and, therefore,
+        shared by all processes using the same state_file
+
+        @remarks
+        Updates are serialized with fcntl file locks (if available).
+    '''
+
+    def __init__(self, rate, burst=1, state_file=None):
+        ''' ::param rate: number of requests per second
+            ::param burst: maximum number of requests sent without delay
+            ::param state_file: the file shared by the processes
+        '''
+        TokenBucket.__init__(self, rate, burst)
+        self.state_file = state_file
+
+    def reserve(self):
+        with self._lock:
+            fd = os_open(self.state_file, O_RDWR | O_CREAT, 0o644)
+            try:
+                if flock is not None:
+                    flock(fd, LOCK_EX)
+                data = read(fd, _BUCKET_STATE.size)
+                tokens, last_update = _BUCKET_STATE.unpack(data) \
+                    if len(data) == _BUCKET_STATE.size \
+                    else (float(self.burst), 0.)
+                now = time.time()
+                tokens, wait = self._reserve(tokens, last_update, now)
+                lseek(fd, 0, SEEK_SET)
+                write(fd, _BUCKET_STATE.pack(tokens, now))
+            finally:
+                # closing the file releases the lock
+                close(fd)
+        return wait
+
+
+class ThrottleRegistry(object):
+    ''' @class ThrottleRegistry
+        keeps the TokenBuckets of all hosts
+
+        usage:
+          THROTTLE_REGISTRY.configure("api.example.com", rate=10, burst=20)
+          # share the budget of all *.example.org hosts between processes
+          THROTTLE_REGISTRY.configure("example.org", rate=1,
+                                      state_file="/tmp/example.org.bucket")
+
+        @remarks
+        Configured domains apply to their subdomains as well (which share
+        the domain's bucket, regardless of the interval requested by the
+        caller). Other hosts receive one bucket per requested interval,
+        i.e. callers using different intervals for the same host are
+        throttled independently of each other.
+    '''
+
+    def __init__(self):
+        self._buckets = {}      # (host, interval) -> TokenBucket
+        self._domains = {}      # configured domain -> TokenBucket
+        self._lock = Lock()
+
+    def configure(self, domain, rate, burst=1, state_file=None):
+        ''' sets the request rate for the given domain
+            ::param domain: the domain or host name (e.g. 'example.com')
+            ::param rate: number of requests per second
+            ::param burst: maximum number of requests sent without delay
+            ::param state_file: optional file for sharing the budget with
+                                other processes (see FileTokenBucket)
+        '''
+        bucket = FileTokenBucket(rate, burst, state_file) if state_file \
+            else TokenBucket(rate, burst)
+        with self._lock:
+            self._domains[domain.lower()] = bucket
+            self._buckets = {}
+
+    def get(self, host, interval=DEFAULT_WEB_REQUEST_SLEEP_TIME):
+        ''' returns the bucket responsible for the given host
+            ::param host: the host name
+            ::param interval: seconds between two requests to hosts without
+                              configured rate
+        '''
+        key = (host.lower(), interval)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            return bucket
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._get_domain_bucket(key[0]) or \
+                    TokenBucket(1. / interval)
+                self._buckets[key] = bucket
+        return bucket
+
+    def _get_domain_bucket(self, host):
+        ''' returns the bucket of the most specific configured domain '''
+        parts = host.split(".")
+        for i in range(len(parts)):
+            bucket = self._domains.get(".".join(parts[i:]))
+            if bucket is not None:
+                return bucket
+
+    def reserve(self, url, interval=DEFAULT_WEB_REQUEST_SLEEP_TIME):
+        ''' reserves a request to the url's host
+            ::returns: the number of seconds to wait before sending it
+        '''
+        if not interval:
+            return 0.
+        return self.get(urlsplit(url).hostname or "", interval).reserve()
+
+    def throttle(self, url, interval=DEFAULT_WEB_REQUEST_SLEEP_TIME):
+        ''' waits until the next request to the url's host may be sent
+            ::returns: the number of seconds waited
+        '''
+        wait = self.reserve(url, interval)
+        if wait:
+            sleep(wait)
+        return wait
+
+    def clear(self):
+        ''' removes all buckets and configured domains '''
+        with self._lock:
+            self._buckets = {}
+            self._domains = {}
+
+
+# the throttle registry used by default
+THROTTLE_REGISTRY = ThrottleRegistry()
+
+
+class Backoff(object):
+    ''' @class Backoff
+        computes the waiting time between retries (exponential backoff with
+        full jitter, honoring Retry-After headers)
+    '''
+
+    def __init__(self, base=DEFAULT_BACKOFF_BASE,
+                 factor=DEFAULT_BACKOFF_FACTOR, maximum=DEFAULT_BACKOFF_MAX,
+                 max_retry_after=DEFAULT_MAX_RETRY_AFTER, jitter=True):
+        ''' ::param base: waiting time before the first retry
+            ::param factor: growth of the waiting time per retry
+            ::param maximum: maximum waiting time
+            ::param max_retry_after: maximum Retry-After period to wait for
+            ::param jitter: randomize the waiting time (between 0 and the
+                            computed value)
+        '''
+        self.base = base
+        self.factor = factor
+        self.maximum = maximum
+        self.max_retry_after = max_retry_after
+        self.jitter = jitter
+
+    def get_wait(self, attempt, headers=None):
+        ''' returns the seconds to wait before the given retry or None, if
+            the server requests a longer delay than max_retry_after
+            ::param attempt: the number of the retry (starting with 0)
+            ::param headers: optional headers of the failed response
+        '''
+        retry_after = self.get_retry_after(headers)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after \
+                else None
+
+        wait = min(self.maximum, self.base * self.factor ** attempt)
+        return uniform(0, wait) if self.jitter else wait
+
+    @staticmethod
+    def get_retry_after(headers):
+        ''' returns the delay (in seconds) requested by the Retry-After
+            header or None '''
+        value = headers.get('Retry-After') if headers is not None else None
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(mktime_tz(date) - time.time(), 0.)
+
+
+# the backoff used by default
+DEFAULT_BACKOFF = Backoff()
+
+
+class CircuitOpenError(urllib2.URLError):
+    ''' raised for requests to hosts whose circuit is open '''
+
+    def __init__(self, host):
+        urllib2.URLError.__init__(self, "circuit open for host %s" % host)
+        self.host = host
+
+
+class CircuitBreaker(object):
+    ''' @class CircuitBreaker
+        stops requests to a failing host
+
+        @remarks
+        The circuit opens after failure_threshold consecutive failures
+        (connection errors, timeouts and server errors). After
+        reset_timeout seconds, a single probe request is let through
+        (half-open); the circuit closes, if it succeeds, and opens again
+        otherwise.
+    '''
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = 0.
+        self._probe_started = 0.
+        self._lock = Lock()
+
+    def allow(self):
+        ''' returns whether a request may be sent '''
+        if self.state == self.CLOSED:
+            return True
+
+        with self._lock:
+            now = time.time()
+            if self.state == self.OPEN:
+                if now - self._opened < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            elif now - self._probe_started < self.reset_timeout:
+                # another probe is in progress
+                return False
+            self._probe_started = now
+            return True
+
+    def release(self):
+        ''' returns a probe granted by allow() which has not been sent '''
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_started = 0.
+
+    def record_success(self):
+        if self.state != self.CLOSED or self.failures:
+            with self._lock:
+                self.state = self.CLOSED
+                self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    log.warning("Opening circuit after %d failures.",
+                                self.failures)
+                self.state = self.OPEN
+                self._opened = time.time()
+
+
+class CircuitBreakerRegistry(object):
+    ''' @class CircuitBreakerRegistry
+        keeps the CircuitBreakers of all hosts
+    '''
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = Lock()
+
+    def get(self, host):
+        ''' returns the circuit breaker of the given host '''
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(host)
+                if breaker is None:
+                    breaker = self._breakers[host] = CircuitBreaker(
+                        self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def clear(self):
+        with self._lock:
+            self._breakers = {}
+
+
+# the circuit breakers used by default
+CIRCUIT_BREAKERS = CircuitBreakerRegistry()
+
+
+class DeadlineExceededError(urllib2.URLError):
+    ''' raised if the deadline of a request has passed '''
+
+    def __init__(self, url):
+        urllib2.URLError.__init__(self, "deadline exceeded for %s" % url)
+        self.url = url
+
+
+class _KeepAliveMixin(object):
+    ''' opens requests using the persistent connections of a
+        ConnectionPool
+
+        @remarks
+        new connections are established within the request's
+        connect_timeout (if set); the request's timeout applies to reads
+    '''
+
+    def _open_pooled(self, http_class, scheme, req, **http_conn_args):
+        host = req.host if hasattr(req, 'host') else req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        # tunneled (proxy) connections are not pooled
+        if getattr(req, '_tunnel_host', None):
+            return self.do_open(http_class, req, **http_conn_args)
+
+        timeout = req.timeout
+        if timeout is _GLOBAL_DEFAULT_TIMEOUT:
+            timeout = getdefaulttimeout()
+        connect_timeout = getattr(req, 'connect_timeout', None) or timeout
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items()
+                       if k not in headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+        selector = req.selector if hasattr(req, 'selector') \
+            else req.get_selector()
+        data = req.data if hasattr(req, 'data') else req.get_data()
+
+        key = (scheme, host)
+        while True:
+            connection = self.pool.get(key)
+            reused = connection is not None
+            if not reused:
+                connection = http_class(host, timeout=connect_timeout,
+                                        **http_conn_args)
+                connection.set_debuglevel(self._debuglevel)
+            try:
+                if not reused:
+                    connection.connect()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                connection.request(req.get_method(), selector, data, headers)
+                response = connection.getresponse()
+                break
+            except (SocketError, httplib.HTTPException) as e:
+                connection.close()
+                # the server closed the idle connection; retry with a new one
+                if reused and not isinstance(e, SocketTimeout):
+                    continue
+                if isinstance(e, httplib.HTTPException):
+                    raise
+                raise urllib2.URLError(e)
+
+        return PooledResponse(
+            response, lambda reusable: self.pool.release(key, connection,
+                                                         reusable),
+            req.get_full_url())
+
+
+class KeepAliveHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+    ''' urllib2 handler using persistent HTTP connections '''
+
+    def __init__(self, pool=CONNECTION_POOL, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self._open_pooled(httplib.HTTPConnection, 'http', req)
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+    ''' urllib2 handler using persistent HTTPS connections '''
+
+    def __init__(self, pool=CONNECTION_POOL, debuglevel=0, context=None):
+        urllib2.HTTPSHandler.__init__(self, debuglevel, context)
+        self.pool = pool
+        self._ssl_context = context
+
+    def https_open(self, req):
+        kargs = {'context': self._ssl_context} if self._ssl_context else {}
+        return self._open_pooled(httplib.HTTPSConnection, 'https', req,
+                                 **kargs)
+
+
 class Retrieve(object):
     ''' @class Retrieve
         retrieves URLs using HTTP
@@ -67,7 +873,10 @@ class Retrieve(object):
         - authentication and
         - compression
         - support for the context protocol (python)
-        - automatic throttling support
+        - automatic throttling support (per host, see ThrottleRegistry)
+        - persistent (keep-alive) connections
+        - retries with exponential backoff and per host circuit breakers
+        - per request timeouts and deadlines
 
         @warning
         There are certain urls such as
@@ -77,14 +886,44 @@ class Retrieve(object):
     '''
 
     __slots__ = ('module', 'sleep_time', 'last_access_time', 'user_agent',
+                 'timeout', 'connect_timeout', 'connection_pool',
+                 'throttle_registry', 'backoff', 'circuit_breakers',
                  '_supported_http_authentification_methods')
 
     def __init__(self, module, sleep_time=DEFAULT_WEB_REQUEST_SLEEP_TIME,
-                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT):
-        setdefaulttimeout(default_timeout)
+                 user_agent=USER_AGENT, default_timeout=DEFAULT_TIMEOUT,
+                 connection_pool=CONNECTION_POOL,
+                 throttle_registry=THROTTLE_REGISTRY,
+                 backoff=DEFAULT_BACKOFF, circuit_breakers=CIRCUIT_BREAKERS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+        ''' ::param module: the module name used in the user agent
+            ::param sleep_time: seconds to wait between two requests to the
+                                same host (unless configured in the
+                                throttle_registry; 0 disables throttling)
+            ::param user_agent: the user agent
+            ::param default_timeout: the read timeout of requests (this
+                                     does not affect other sockets)
+            ::param connection_pool: the ConnectionPool used for persistent
+                                     connections (None to disable pooling)
+            ::param throttle_registry: the ThrottleRegistry shared with
+                                       other Retrieve objects
+            ::param backoff: the Backoff used between retries
+            ::param circuit_breakers: the CircuitBreakerRegistry shared with
+                                      other Retrieve objects (None to
+                                      disable circuit breakers)
+            ::param connect_timeout: the timeout for establishing
+                                     connections (defaults to the read
+                                     timeout; requires a connection_pool)
+        '''
         self.module = module
+        self.timeout = default_timeout
+        self.connect_timeout = connect_timeout
         self.sleep_time = sleep_time
         self.last_access_time = 0
+        self.connection_pool = connection_pool
+        self.throttle_registry = throttle_registry
+        self.backoff = backoff
+        self.circuit_breakers = circuit_breakers
 
         self._supported_http_authentification_methods = {
             'basic': Retrieve._getHTTPBasicAuthOpener,
@@ -95,26 +934,46 @@ class Retrieve(object):
 
     def open(self, url, data=None, headers={}, user=None, pwd=None, retry=0,
              authentification_method="basic", accept_gzip=True,
-             head_only=False):
+             head_only=False, timeout=None, connect_timeout=None,
+             deadline=None):
         ''' Opens an URL and returns the matching file object
             @param[in] url
             @param[in] data    optional data to submit
             @param[in] headers a dictionary of optional headers
             @param[in] user    optional user name
             @param[in] pwd     optional password
-            @param[in] retry   number of retries in case of an temporary error
+            @param[in] retry   number of retries in case of temporary errors,
+                               connection errors and timeouts
             @param[in] authentification_method the used authentification_method
                         ('basic'*, 'digest')
             @param[in] accept_gzip flag to change the accepted encoding, gzip
                         or not
             @param[in] head_only   if True: only execute a HEAD request
+            @param[in] timeout     optional read timeout (overrides the
+                                   default_timeout)
+            @param[in] connect_timeout optional connect timeout
+            @param[in] deadline    optional time (as returned by time.time())
+                                   by which the request including all retries
+                                   has to be completed
             @returns a file object for reading the url
+
+            @remarks
+            the timeouts of every attempt are limited to the time remaining
+            until the deadline, and no retries are attempted whose backoff
+            (or throttling delay) would exceed it. These timeouts also bound every single read of
+            the returned file object, but not the time spent reading all of
+            it.
         '''
         auth_handler = self._supported_http_authentification_methods[
             authentification_method]
-        urlObj = None
+        breaker = self.circuit_breakers.get(getHostName(url)) \
+            if self.circuit_breakers is not None else None
         tries = 0
-        while not urlObj:
+        while True:
+            # fails early, if the deadline has passed
+            self._get_timeouts(url, timeout, connect_timeout, deadline)
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(getHostName(url))
             request = urllib2.Request(url, data, headers)
 
             if head_only:
@@ -123,33 +982,139 @@ class Retrieve(object):
             request.add_header('User-Agent', self.user_agent)
 
             if accept_gzip:
-                request.add_header('Accept-encoding', 'gzip')
+                request.add_header('Accept-encoding', 'gzip, deflate')
 
-            self._throttle()
+            try:
+                self._throttle(url, deadline)
+                request.timeout, request.connect_timeout = self._get_timeouts(
+                    url, timeout, connect_timeout, deadline)
+            except Exception:
+                # the request has not been sent => other requests may probe
+                if breaker is not None:
+                    breaker.release()
+                raise
 
             opener = []
             if PROXY_SERVER:
                 opener.append(urllib2.ProxyHandler({"http": PROXY_SERVER}))
             if user and pwd:
                 opener.append(auth_handler(url, user, pwd))
+            if self.connection_pool is not None:
+                opener.append(KeepAliveHandler(self.connection_pool))
+                opener.append(KeepAliveHTTPSHandler(self.connection_pool))
 
-            urllib2.install_opener(urllib2.build_opener(*opener))
             try:
-                urlObj = urllib2.urlopen(request)
+                urlObj = urllib2.build_opener(*opener).open(
+                    request, timeout=request.timeout)
             except urllib2.HTTPError as e:
-                if e.code in HTTP_TEMPORARY_ERROR_CODES and tries < retry:
-                    time.sleep(randint(*RETRY_WAIT_TIME_RANGE))
-                    tries += 1
-                    continue
-                else:
-                    raise e
+                if breaker is not None:
+                    if e.code in HTTP_SERVER_ERROR_CODES:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                wait = self.backoff.get_wait(tries, e.hdrs) \
+                    if e.code in HTTP_TEMPORARY_ERROR_CODES and tries < retry \
+                    else None
+                if wait is None:
+                    raise
+                # returns the connection to the pool
+                e.close()
+                error = e
+            except (urllib2.URLError, SocketError, httplib.HTTPException) \
+                    as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                if tries >= retry:
+                    raise
+                wait = self.backoff.get_wait(tries)
+                error = e
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                break
+
+            if deadline is not None and time.time() + wait >= deadline:
+                raise error
+            log.info("Retrying %s in %.1f seconds (%s).", url, wait, error)
+            sleep(wait)
+            tries += 1
 
-            # check whether the data stream is compressed
-            if urlObj.headers.get('Content-Encoding') == 'gzip':
-                return self._getUncompressedStream(urlObj)
+        # check whether the data stream is compressed
+        encoding = (urlObj.headers.get('Content-Encoding') or '').lower()
+        if encoding in SUPPORTED_CONTENT_ENCODINGS:
+            return self._getUncompressedStream(urlObj, encoding)
 
         return urlObj
 
+    def _get_timeouts(self, url, timeout, connect_timeout, deadline):
+        ''' returns the read and connect timeout of the next attempt
+            @raises DeadlineExceededError if the deadline has passed
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        connect_timeout = connect_timeout or self.connect_timeout or timeout
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise DeadlineExceededError(url)
+            timeout = remaining if timeout is None \
+                else min(timeout, remaining)
+            connect_timeout = min(connect_timeout or remaining, remaining)
+        return timeout, connect_timeout
+
+    def fetch_many(self, requests, max_workers=DEFAULT_MAX_WORKERS,
+                   ordered=True,
+                   max_host_concurrency=DEFAULT_MAX_HOST_CONCURRENCY):
+        ''' retrieves the given requests concurrently
+            @param[in] requests    a sequence of urls or dictionaries with
+                                   the keyword arguments of open() (e.g.
+                                   {'url': url, 'data': data, 'retry': 2})
+            @param[in] max_workers number of threads
+            @param[in] ordered     return the results in the order of the
+                                   requests rather than in the order of
+                                   completion
+            @param[in] max_host_concurrency maximum number of concurrent
+                                   requests per host
+            @returns an iterator of (request, content) tuples, which are
+                     returned as soon as they are available; content is the
+                     exception raised by failed requests
+        '''
+        requests = list(requests)
+        if not requests:
+            return
+
+        host_semaphores = defaultdict(
+            partial(BoundedSemaphore, max_host_concurrency))
+        for request in requests:
+            host_semaphores[self._get_request_host(request)]
+
+        pool = ThreadPool(min(max_workers, len(requests)))
+        try:
+            fetch = partial(self._fetch, host_semaphores=host_semaphores)
+            for result in (pool.imap(fetch, requests) if ordered
+                           else pool.imap_unordered(fetch, requests)):
+                yield result
+        finally:
+            pool.terminate()
+
+    @staticmethod
+    def _get_request_host(request):
+        return getHostName(request['url'] if isinstance(request, dict)
+                           else request)
+
+    def _fetch(self, request, host_semaphores):
+        ''' retrieves the given request (see fetch_many) '''
+        kargs = dict(request) if isinstance(request, dict) \
+            else {'url': request}
+        with host_semaphores[self._get_request_host(request)]:
+            try:
+                f = self.open(**kargs)
+                try:
+                    return request, f.read()
+                finally:
+                    f.close()
+            except Exception as e:
+                return request, e
+
     @staticmethod
     def _getHTTPBasicAuthOpener(url, user, pwd):
         ''' returns an opener, capable of handling http-auth '''
@@ -169,19 +1134,24 @@ class Retrieve(object):
         return auth_handler
 
     @staticmethod
-    def _getUncompressedStream(urlObj):
+    def _getUncompressedStream(urlObj, encoding='gzip'):
         ''' transparently uncompressed the given data stream
             @param[in] urlObj
+            @param[in] encoding the content encoding ('gzip' or 'deflate')
             @returns an urlObj containing the uncompressed data
         '''
-        compressedStream = io.BytesIO(urlObj.read())
-        return GzipFile(fileobj=compressedStream)
+        return DecompressingStream(urlObj, 'deflate'
+                                   if encoding == 'deflate' else 'gzip')
 
-    def _throttle(self):
-        ''' delays web access according to the content provider's policy '''
-        if (time.time() - self.last_access_time) < \
-                DEFAULT_WEB_REQUEST_SLEEP_TIME:
-            time.sleep(self.sleep_time)
+    def _throttle(self, url, deadline=None):
+        ''' delays web access according to the content provider's policy
+            @raises DeadlineExceededError if the delay exceeds the deadline
+        '''
+        wait = self.throttle_registry.reserve(url, self.sleep_time)
+        if wait:
+            if deadline is not None and time.time() + wait >= deadline:
+                raise DeadlineExceededError(url)
+            sleep(wait)
         self.last_access_time = time.time()
 
     def __enter__(self):
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+''' @package eWRT.access.async_http
+    tests the asyncio based retrieval '''
+
+import asyncio
+import time
+import unittest
+
+from eWRT.access.async_http import *
+from eWRT.access.http import ConnectionPool, ThrottleRegistry
+from http_test import LocalServer
+
+
+class TestAsyncRetrieve(unittest.TestCase):
+    ''' tests AsyncRetrieve against a local HTTP server '''
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def _get_retrieve(self, **kargs):
+        kargs.setdefault('sleep_time', 0)
+        return AsyncRetrieve(__name__, connection_pool=self.pool,
+                             throttle_registry=ThrottleRegistry(), **kargs)
+
+    def _open_many(self, retrieve, urls):
+        async def collect():
+            async with retrieve:
+                return [result async for result in retrieve.open_many(urls)]
+        return asyncio.run(collect())
+
+    def testOpen(self):
+        async def fetch():
+            async with self._get_retrieve() as r:
+                return await r.open(self.server.url + "/gzip/hello")
+        assert asyncio.run(fetch()) == b"hello"
+
+    def testOpenMany(self):
+        urls = [self.server.url + "/slow/%d" % i for i in range(8)]
+        start = time.time()
+        result = dict(self._open_many(self._get_retrieve(), urls))
+        assert time.time() - start < 0.5
+        assert result == dict((url, url.split("/", 3)[3].encode())
+                              for url in urls)
+
+    def testHostConcurrency(self):
+        urls = [self.server.url + "/slow/%d" % i for i in range(6)]
+        self._open_many(self._get_retrieve(max_host_concurrency=2), urls)
+        assert self.server.max_active == 2
+
+    def testGlobalConcurrency(self):
+        urls = [self.server.url + "/slow/%d" % i for i in range(6)]
+        self._open_many(self._get_retrieve(max_concurrency=1), urls)
+        assert self.server.max_active == 1
+
+    def testThrottling(self):
+        urls = [self.server.url + "/%d" % i for i in range(3)]
+        start = time.time()
+        self._open_many(self._get_retrieve(sleep_time=0.1), urls)
+        assert time.time() - start >= 0.19
+
+    def testEventLoops(self):
+        ''' the retrieve object may be used by several event loops '''
+        urls = [self.server.url + "/slow/%d" % i for i in range(3)]
+        retrieve = self._get_retrieve(max_host_concurrency=1)
+
+        async def collect():
+            return [result async for result in retrieve.open_many(urls)]
+
+        try:
+            for _ in range(2):
+                result = dict(asyncio.run(collect()))
+                assert result == dict((url, url.split("/", 3)[3].encode())
+                                      for url in urls)
+        finally:
+            retrieve.close()
+        assert self.server.max_active == 1
+
+    def testErrors(self):
+        ''' failed requests return their exception '''
+        urls = [self.server.url + "/a", "http://127.0.0.1:1/unreachable"]
+        result = dict(self._open_many(self._get_retrieve(), urls))
+        assert result[urls[0]] == b"a"
+        assert isinstance(result[urls[1]], Exception)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+# the asyncio based retrieval requires python 3.7+
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append("async_http_test.py")
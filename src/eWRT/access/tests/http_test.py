@@ -19,7 +19,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from eWRT.access.http import *
+import io
+import os
 import unittest
+from gzip import GzipFile
+from email.utils import formatdate
+from socket import getdefaulttimeout
 import pytest
 
 class TestRetrieve(unittest.TestCase):
@@ -31,14 +36,10 @@ class TestRetrieve(unittest.TestCase):
 
     def setUp(self):
         from logging import StreamHandler
-        self.default_timeout = DEFAULT_TIMEOUT
 
         # set logging handler
         log.addHandler(StreamHandler())
 
-    def tearDown(self):
-        setdefaulttimeout(self.default_timeout)
-
     @pytest.mark.remote
     def testRetrieval(self):
         ''' tries to retrieve the following url's from the list '''
@@ -98,6 +99,537 @@ class TestRetrieve(unittest.TestCase):
             if user:
                 assert url != test_url
 
+class TestConnectionPool(unittest.TestCase):
+    ''' tests persistent connections against a local HTTP server '''
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.pool = ConnectionPool(max_connections=2)
+        self.retrieve = Retrieve(__name__, sleep_time=0,
+                                 connection_pool=self.pool)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def testKeepAlive(self):
+        for _ in range(5):
+            r = self.retrieve.open(self.server.url + "/hello")
+            assert r.read() == b"hello"
+        assert len(self.server.connections) == 1
+        assert len(self.pool) == 1
+
+    def testResponseInterface(self):
+        ''' pooled responses provide the interface of urllib2's responses
+            (on python 2 and 3) '''
+        url = self.server.url + "/line1%0Aline2"
+        r = self.retrieve.open(url)
+        assert r.code == r.getcode() == 200
+        assert r.geturl() == url
+        assert r.info()['Content-Length'] == "11"
+        assert r.headers.get('Content-Length') == "11"
+        assert r.readline() == b"line1\n"
+        assert list(r) == [b"line2"]
+        assert len(self.pool) == 1
+
+        e = pytest.raises(urllib2.HTTPError, self.retrieve.open,
+                          self.server.url + "/error/404/1/missing").value
+        assert e.code == 404
+        assert e.info()['Content-Length'] == "0"
+
+    def testPartiallyReadResponse(self):
+        ''' connections of partially read responses are not reused '''
+        r = self.retrieve.open(self.server.url + "/hello")
+        r.read(2)
+        r.close()
+        assert len(self.pool) == 0
+        assert self.retrieve.open(self.server.url + "/a").read() == b"a"
+        assert len(self.server.connections) == 2
+
+    def testStaleConnection(self):
+        ''' connections closed by the server are replaced transparently '''
+        self.retrieve.open(self.server.url + "/hello").read()
+        self.server.close_connections()
+        assert self.retrieve.open(self.server.url + "/b").read() == b"b"
+
+    def testIdleTimeout(self):
+        self.pool.idle_timeout = 0
+        for _ in range(2):
+            self.retrieve.open(self.server.url + "/hello").read()
+        assert len(self.server.connections) == 2
+
+    def testThreads(self):
+        from multiprocessing.pool import ThreadPool
+        urls = [self.server.url + "/%d" % i for i in range(20)]
+        fetch = lambda url: self.retrieve.open(url).read()
+        p = ThreadPool(4)
+        assert p.map(fetch, urls) == [str(i).encode() for i in range(20)]
+        p.close()
+        assert len(self.pool) <= self.pool.max_connections
+
+    def testGzip(self):
+        r = self.retrieve.open(self.server.url + "/gzip/hello")
+        assert r.read() == b"hello"
+
+    def testDeflate(self):
+        r = self.retrieve.open(self.server.url + "/deflate/hello")
+        assert r.read() == b"hello"
+        assert r.headers.get('Content-Encoding') == 'deflate'
+        assert len(self.pool) == 1
+
+    def testTimeouts(self):
+        self.retrieve.open(self.server.url + "/a", timeout=5,
+                           connect_timeout=1).read()
+        connection = self.pool.get(('http', self.server.url[7:]))
+        assert connection.sock.gettimeout() == 5
+
+        # timeouts are not retried with new connections
+        self.assertRaises(urllib2.URLError, self.retrieve.open,
+                          self.server.url + "/slow/b", timeout=0.05)
+        assert self.server.requests["/slow/b"] == 1
+
+    def testNoGlobalTimeout(self):
+        default_timeout = getdefaulttimeout()
+        Retrieve(__name__, default_timeout=7).open(self.server.url + "/a")
+        assert getdefaulttimeout() == default_timeout
+
+    def testNoPool(self):
+        r = Retrieve(__name__, sleep_time=0, connection_pool=None)
+        assert r.open(self.server.url + "/c").read() == b"c"
+        assert r.open(self.server.url + "/c").read() == b"c"
+        assert len(self.server.connections) == 2
+
+
+class TestFetchMany(unittest.TestCase):
+    ''' tests the concurrent retrieval of multiple requests '''
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.pool = ConnectionPool()
+        self.retrieve = Retrieve(__name__, sleep_time=0,
+                                 connection_pool=self.pool)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def testOrdered(self):
+        urls = [self.server.url + path for path in ("/slow/a", "/b", "/c")]
+        result = list(self.retrieve.fetch_many(urls))
+        assert result == list(zip(urls, [b"slow/a", b"b", b"c"]))
+
+    def testAsCompleted(self):
+        urls = [self.server.url + path for path in ("/slow/a", "/b")]
+        result = list(self.retrieve.fetch_many(urls, ordered=False))
+        assert result == [(urls[1], b"b"), (urls[0], b"slow/a")]
+
+    def testConcurrency(self):
+        urls = [self.server.url + "/slow/%d" % i for i in range(8)]
+        start = time.time()
+        list(self.retrieve.fetch_many(urls, max_workers=8,
+                                      max_host_concurrency=2))
+        assert self.server.max_active == 2
+        assert 0.35 < time.time() - start < 0.6
+
+    def testRequestsAndErrors(self):
+        requests = [{'url': self.server.url + "/gzip/a", 'retry': 1},
+                    "http://127.0.0.1:1/unreachable"]
+        result = list(self.retrieve.fetch_many(requests))
+        assert result[0] == (requests[0], b"a")
+        assert isinstance(result[1][1], urllib2.URLError)
+        assert list(self.retrieve.fetch_many([])) == []
+
+
+class TestRetries(unittest.TestCase):
+    ''' tests retries, backoff and circuit breakers '''
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.breakers = CircuitBreakerRegistry(failure_threshold=3,
+                                               reset_timeout=0.2)
+        self.retrieve = Retrieve(__name__, sleep_time=0,
+                                 backoff=Backoff(base=0.01),
+                                 circuit_breakers=self.breakers)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testBackoff(self):
+        backoff = Backoff(base=1, maximum=10, jitter=False)
+        assert [backoff.get_wait(n) for n in range(5)] == [1, 2, 4, 8, 10]
+        backoff.jitter = True
+        assert all(0 <= backoff.get_wait(3) <= 8 for _ in range(20))
+
+    def testRetryAfter(self):
+        backoff = Backoff(max_retry_after=60)
+        assert backoff.get_wait(0, {'Retry-After': '30'}) == 30
+        assert backoff.get_wait(0, {'Retry-After': '3600'}) is None
+        date = formatdate(time.time() + 20, usegmt=True)
+        assert 15 < Backoff.get_retry_after({'Retry-After': date}) <= 20
+        assert Backoff.get_retry_after({'Retry-After': 'soon'}) is None
+        assert Backoff.get_retry_after({}) is None
+
+    def testRetry(self):
+        for code in (429, 503):
+            url = self.server.url + "/error/%d/2/retry" % code
+            assert self.retrieve.open(url, retry=2).read() == \
+                b"error/%d/2/retry" % code
+            assert self.server.requests["/error/%d/2/retry" % code] == 3
+
+    def testNoRetry(self):
+        url = self.server.url + "/error/404/1/missing"
+        self.assertRaises(urllib2.HTTPError, self.retrieve.open, url, retry=2)
+        url = self.server.url + "/error/503/3/failing"
+        self.assertRaises(urllib2.HTTPError, self.retrieve.open, url, retry=1)
+        assert self.server.requests["/error/503/3/failing"] == 2
+
+    def testConnectionError(self):
+        self.server.stop()
+        self.assertRaises(urllib2.URLError, self.retrieve.open,
+                          self.server.url + "/down", retry=1)
+        assert self.breakers.get(self.server.url).failures == 2
+
+    def testDeadline(self):
+        url = self.server.url + "/error/503/1000/deadline"
+        retrieve = Retrieve(__name__, sleep_time=0, circuit_breakers=None,
+                            backoff=Backoff(base=0.01, maximum=0.01))
+        start = time.time()
+        self.assertRaises(urllib2.URLError, retrieve.open, url,
+                          retry=1000, deadline=time.time() + 0.2)
+        assert time.time() - start < 0.3
+        assert self.server.requests["/error/503/1000/deadline"] > 1
+
+        # retries are not attempted, if the backoff exceeds the deadline
+        retrieve.backoff = Backoff(base=0.5, jitter=False)
+        self.assertRaises(urllib2.HTTPError, retrieve.open,
+                          self.server.url + "/error/503/1/no-retry",
+                          retry=1, deadline=time.time() + 0.2)
+        assert self.server.requests["/error/503/1/no-retry"] == 1
+
+        # the deadline also limits the timeouts of every attempt
+        start = time.time()
+        self.assertRaises(urllib2.URLError, retrieve.open,
+                          self.server.url + "/slow/a", timeout=5,
+                          deadline=time.time() + 0.05)
+        assert time.time() - start < 0.1
+
+    def testExpiredDeadline(self):
+        self.assertRaises(DeadlineExceededError, self.retrieve.open,
+                          self.server.url + "/a", deadline=time.time())
+        assert "/a" not in self.server.requests
+
+    def testThrottleDeadline(self):
+        ''' requests fail early, if throttling exceeds the deadline '''
+        retrieve = Retrieve(__name__, sleep_time=5, circuit_breakers=None,
+                            throttle_registry=ThrottleRegistry())
+        retrieve.open(self.server.url + "/a").read()
+        start = time.time()
+        self.assertRaises(DeadlineExceededError, retrieve.open,
+                          self.server.url + "/b", deadline=time.time() + 1)
+        assert time.time() - start < 0.5
+        assert "/b" not in self.server.requests
+
+    def testCircuitBreaker(self):
+        url = self.server.url + "/error/500/3/broken"
+        self.assertRaises(urllib2.HTTPError, self.retrieve.open, url, retry=2)
+        breaker = self.breakers.get(self.server.url)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        # requests to the host fail without reaching the server
+        self.assertRaises(CircuitOpenError, self.retrieve.open,
+                          self.server.url + "/hello")
+        assert "/hello" not in self.server.requests
+
+        # half-open: a single probe closes the circuit again
+        time.sleep(0.2)
+        assert self.retrieve.open(url).read() == b"error/500/3/broken"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def testUnsentProbe(self):
+        ''' probes which exceed the deadline do not block the circuit '''
+        retrieve = Retrieve(__name__, sleep_time=5,
+                            throttle_registry=ThrottleRegistry(),
+                            circuit_breakers=self.breakers)
+        retrieve.open(self.server.url + "/a").read()
+        breaker = self.breakers.get(self.server.url)
+        for _ in range(3):
+            breaker.record_failure()
+        time.sleep(0.2)
+
+        self.assertRaises(DeadlineExceededError, retrieve.open,
+                          self.server.url + "/b", deadline=time.time() + 1)
+        assert "/b" not in self.server.requests
+        assert breaker.allow()
+
+    def testFailedProbe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+        breaker.record_failure()
+        assert not breaker.allow()
+        time.sleep(0.1)
+        assert breaker.allow()
+        # only a single probe is let through
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+
+class TestThrottling(unittest.TestCase):
+    ''' tests the per host token buckets '''
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.registry = ThrottleRegistry()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.temp_dir)
+
+    def testTokenBucket(self):
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.time()
+        waits = [bucket.acquire() for _ in range(6)]
+        assert waits[:2] == [0., 0.]
+        assert all(wait > 0 for wait in waits[2:])
+        assert 0.15 < time.time() - start < 0.5
+
+    def testThreads(self):
+        from multiprocessing.pool import ThreadPool
+        bucket = TokenBucket(rate=50)
+        p = ThreadPool(4)
+        start = time.time()
+        p.map(lambda _: bucket.acquire(), range(10))
+        p.close()
+        assert time.time() - start >= 9 / 50. - 0.01
+
+    def testRegistry(self):
+        self.registry.configure("example.com", rate=100)
+        bucket = self.registry.get("www.Example.com")
+        assert bucket is self.registry.get("api.example.com")
+        assert bucket.rate == 100
+        assert self.registry.get("example.org", interval=0.5).rate == 2
+        assert self.registry.get("example.org") is \
+            self.registry.get("example.org")
+        assert self.registry.get("www.example.org") is not \
+            self.registry.get("example.org")
+        # configured domains ignore the requested interval
+        assert self.registry.get("example.com", interval=5) is bucket
+        assert self.registry.throttle("http://example.org/", interval=0) \
+            == 0.
+
+    def testInterval(self):
+        ''' the interval of a later caller is not ignored '''
+        assert self.registry.reserve("http://example.org/", 5) == 0.
+        assert self.registry.reserve("http://example.org/", 5) > 4
+        assert self.registry.reserve("http://example.org/", 0.01) == 0.
+        assert self.registry.reserve("http://example.org/", 0.01) < 0.02
+
+    def testSharedHost(self):
+        ''' Retrieve objects share the buckets of their hosts '''
+        a = Retrieve(__name__, sleep_time=0.1,
+                     throttle_registry=self.registry)
+        b = Retrieve(__name__, sleep_time=0.1,
+                     throttle_registry=self.registry)
+        start = time.time()
+        a._throttle("http://example.com/a")
+        b._throttle("http://example.com/b")
+        b._throttle("http://example.org/")
+        assert 0.09 < time.time() - start < 0.19
+
+    def testFileTokenBucket(self):
+        state_file = os.path.join(self.temp_dir, "bucket")
+        a = FileTokenBucket(rate=10, state_file=state_file)
+        b = FileTokenBucket(rate=10, state_file=state_file)
+        assert a.acquire() == 0.
+        assert b.acquire() > 0.05
+
+
+class TestDecompressingStream(unittest.TestCase):
+    ''' tests the streaming decompression of responses '''
+
+    LINES = [("line %d\n" % i).encode("ascii") for i in range(20000)]
+    DATA = b"".join(LINES)
+
+    def _stream(self, data, encoding='gzip', chunk_size=1024):
+        return DecompressingStream(io.BytesIO(data), encoding, chunk_size)
+
+    def testRead(self):
+        s = self._stream(gzip_compress(self.DATA))
+        assert s.read(10) == self.DATA[:10]
+        assert len(s._buffer) < 2 * s.chunk_size
+        assert s.read() == self.DATA[10:]
+        assert s.read() == b"" and s.read(10) == b""
+
+    def testBoundedMemory(self):
+        ''' highly compressible data is inflated on demand '''
+        data = b"x" * (1 << 24)
+        s = self._stream(gzip_compress(data))
+        total = 0
+        while True:
+            chunk = s.read(4096)
+            if not chunk:
+                break
+            assert len(s._buffer) <= 2 * s.chunk_size
+            total += len(chunk)
+        assert total == len(data)
+
+    def testLines(self):
+        s = self._stream(gzip_compress(self.DATA))
+        assert s.readline() == self.LINES[0]
+        assert s.readline(3) == self.LINES[1][:3]
+        assert s.readline() == self.LINES[1][3:]
+        assert list(s) == self.LINES[2:]
+        assert self._stream(gzip_compress(self.DATA)).readlines() == \
+            self.LINES
+
+    def testDeflate(self):
+        assert self._stream(zlib.compress(self.DATA), 'deflate').read() == \
+            self.DATA
+        c = zlib.compressobj(6, zlib.DEFLATED, -15)
+        raw = c.compress(self.DATA) + c.flush()
+        assert self._stream(raw, 'deflate').read() == self.DATA
+
+    def testMultipleMembers(self):
+        data = gzip_compress(b"hello ") + gzip_compress(b"world")
+        assert self._stream(data, chunk_size=4).read() == b"hello world"
+
+        # several members within a single chunk
+        data = b"".join(gzip_compress(c * 3) for c in (b"a", b"b", b"c", b"d"))
+        for chunk_size in (1, 7, 1024):
+            assert self._stream(data, chunk_size=chunk_size).read() == \
+                b"aaabbbcccddd"
+            assert self._stream(data, chunk_size=chunk_size).read(5) == \
+                b"aaabb"
+
+    def testTruncatedStream(self):
+        for data, encoding in ((gzip_compress(self.DATA), 'gzip'),
+                               (zlib.compress(self.DATA), 'deflate')):
+            for chunk_size in (1, 7, 1024):
+                s = self._stream(data[:-10], encoding, chunk_size)
+                self.assertRaises(EOFError, s.read)
+                s = self._stream(data[:len(data) // 2], encoding, chunk_size)
+                self.assertRaises(EOFError, list, s)
+
+        c = zlib.compressobj(6, zlib.DEFLATED, -15)
+        raw = c.compress(self.DATA) + c.flush()
+        self.assertRaises(EOFError, self._stream(raw[:-10], 'deflate').read)
+
+        # an empty body is not truncated
+        assert self._stream(b"").read() == b""
+
+    def testCorruptStream(self):
+        s = self._stream(b"\x1f\x8bcorrupt")
+        self.assertRaises(zlib.error, s.read)
+
+
+class LocalServer(object):
+    ''' a local HTTP/1.1 server which returns the (unquoted) request path
+        without the leading slash as content
+
+        @remarks
+        helper class for the unit tests; paths starting with /gzip/ are
+        returned gzip and deflate compressed; /slow/ paths take 0.1 seconds
+        and record the number of concurrent requests; the first n requests
+        to /error/<code>/<n>/ paths fail with the given status code (429
+        responses include a Retry-After header).
+    '''
+
+    def __init__(self):
+        from threading import Thread
+        try:
+            from urllib.parse import unquote
+        except ImportError:
+            from urllib import unquote
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        except ImportError:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # send headers and content in a single segment
+            wbufsize = -1
+
+            def do_GET(self):
+                server.connections.add(self.client_address)
+                server.sockets.add(self.connection)
+                content = unquote(self.path[1:]).encode("utf-8")
+                with server.lock:
+                    server.requests[self.path] = \
+                        server.requests.get(self.path, 0) + 1
+                if content.startswith(b"error/"):
+                    _, code, failures, _ = self.path[1:].split("/", 3)
+                    if server.requests[self.path] <= int(failures):
+                        self.send_response(int(code))
+                        if code == "429":
+                            self.send_header("Retry-After", "0")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                if content.startswith(b"slow/"):
+                    with server.lock:
+                        server.active += 1
+                        server.max_active = max(server.active,
+                                                server.max_active)
+                    time.sleep(0.1)
+                    with server.lock:
+                        server.active -= 1
+                self.send_response(200)
+                if content.startswith(b"gzip/"):
+                    content = gzip_compress(content[5:])
+                    self.send_header("Content-Encoding", "gzip")
+                elif content.startswith(b"deflate/"):
+                    content = zlib.compress(content[8:])
+                    self.send_header("Content-Encoding", "deflate")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.connections = set()
+        self.sockets = set()
+        self.requests = {}
+        self.lock = Lock()
+        self.active = 0
+        self.max_active = 0
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.httpd.server_address[1]
+        self.thread = Thread(target=self.httpd.serve_forever, args=(0.05, ))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close_connections(self):
+        from socket import SHUT_RDWR
+        for sock in list(self.sockets):
+            try:
+                sock.shutdown(SHUT_RDWR)
+            except Exception:
+                pass
+
+    def stop(self):
+        self.close_connections()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def gzip_compress(data):
+    ''' returns the gzip compressed data '''
+    buf = io.BytesIO()
+    with GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+
 def t_retrieve(url):
     ''' retrieves the given url from the web
 
@@ -22,28 +22,487 @@
 __author__ = "Albert Weichselbraun"
 __copyright__ = "GPL"
 
-from os import makedirs, remove, getpid, link
-from os.path import join, exists, dirname, basename, join
-from eWRT.util.pickleIterator import WritePickleIterator, ReadPickleIterator
-from time import time
-from operator import itemgetter
+from os import makedirs, remove, rmdir, getpid, stat, fstat, utime, walk, \
+    close, ftruncate, urandom, write
+from os import open as os_open, O_CREAT, O_EXCL, O_WRONLY, O_RDWR
+from os.path import join, exists, dirname, basename, abspath
+from eWRT.util.pickleIterator import WritePickleIterator, ReadPickleIterator, \
+    INDEX_SUFFIX
+from eWRT.util.codec import GzipCodec, get_codec, decode
+from eWRT.util.metrics import get_function_name
+from time import time, sleep
 from hashlib import sha1
-from gzip import GzipFile
+from collections import OrderedDict, deque
+from threading import Lock, Thread, Event, Timer, local
+from sys import getsizeof
+from errno import ENOENT, EEXIST
+from struct import pack, Struct
+from functools import partial, update_wrapper
+from mmap import mmap, ACCESS_READ
+from tempfile import mkstemp
+from zlib import crc32
+from binascii import hexlify
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from heapq import heapify, heappop
+from weakref import ref, WeakSet
+from multiprocessing.util import Finalize, register_after_fork
+import logging
+import sqlite3
+import atexit
 from socket import gethostname
 try:
-    from cPickle import dump, load
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
-    from pickle import dump, load
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # python 2
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full  # python 2
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    long
+except NameError:
+    long = int  # python 3
+try:
+    from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+except ImportError:
+    flock = None  # windows
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # python 2 backport
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+# codec used by the DiskCache for writing new entries
+DEFAULT_CODEC = GzipCodec()
+
+# seconds between two passes of the DiskCacheJanitor
+DEFAULT_JANITOR_INTERVAL = 300
+# number of directory entries the janitor processes per step
+DEFAULT_JANITOR_BATCH_SIZE = 10000
+# once max_bytes is exceeded, the janitor evicts entries until the cache
+# size drops below this fraction of max_bytes
+JANITOR_LOW_WATER_MARK = 0.9
+
+# seconds after which a DiskCache checks whether another process has bumped
+# its namespace's generation
+GENERATION_CHECK_INTERVAL = 1.
+
+# seconds after which single flight computations are considered as failed
+DEFAULT_LEASE_TIMEOUT = 60
+# initial and maximum interval (seconds) for polling single flight lock files
+SINGLE_FLIGHT_POLL_INTERVAL = (0.01, 0.5)
+
+# maximum number of pending background writes
+DEFAULT_WRITE_QUEUE_SIZE = 10000
+# behavior of background writers with a full queue: wait for a free slot
+# ('block'), discard the write ('drop') or write in the caller's thread
+# ('sync')
+BACKPRESSURE_POLICIES = ('block', 'drop', 'sync')
+
+# pack files (see PackedCache)
+PACK_MAGIC = b"\xfeWPACK\x01\x00"
+PACK_LOAD_FACTOR = 0.5
+_PACK_HEADER = Struct("<QQ")        # number of index slots, index offset
+_PACK_RECORD = Struct("<II")        # key length, value length
+_PACK_SLOT = Struct("<QQ")          # key hash, record offset
+_PACK_HASH = Struct("<Q")
+
+# default number of entries cached per instance by cached_method
+DEFAULT_METHOD_CACHE_SIZE = 1024
+
+# shared memory caches (see SharedMemoryCache)
+SHARED_MAGIC = b"\xfeWSHM\x01\x00\x00"
+SHARED_MEMORY_DIR = "/dev/shm"
+SHARED_LOAD_FACTOR = 0.7
+DEFAULT_SHARED_SLOTS = 1 << 16
+DEFAULT_SHARED_BYTES = 1 << 26
+# number of slots, generation, data end, number of entries, used slots
+_SHARED_HEADER = Struct("<QQQQQ")
+_SHARED_RECORD = Struct("<III")     # key length, value length, crc32
+_SHARED_DELETED = 1                 # record offset of deleted slots
+
+# number of elements after which the IterableCache checkpoints partial files
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+# number of entries and seconds the SQLiteCache buffers before writing
+DEFAULT_SQLITE_BATCH_SIZE = 100
+DEFAULT_SQLITE_BATCH_INTERVAL = 1.
+# seconds to wait for database locks held by other processes
+DEFAULT_SQLITE_TIMEOUT = 30.
+
+# number of threads used by DiskCache.fetch_many for reading and writing
+DEFAULT_IO_THREADS = 8
+
+_MISSING = object()
+
+# thread pool for parallel cache file I/O (created on demand per process)
+_io_pool = None
+_io_pool_pid = None
+_io_pool_lock = Lock()
+
+
+def _get_io_pool():
+    ''' returns the thread pool used for parallel cache file I/O '''
+    global _io_pool, _io_pool_pid
+    with _io_pool_lock:
+        if _io_pool is None or _io_pool_pid != getpid():
+            _io_pool = ThreadPool(DEFAULT_IO_THREADS)
+            _io_pool_pid = getpid()
+        return _io_pool
+
+# caches flushed at the exit of the current process (without keeping them
+# alive)
+_EXIT_PRIORITY = 20                 # multiprocessing.pool.Pool uses 15
+_exit_flushes = WeakSet()
+_exit_flushes_pid = None
+_exit_flushes_lock = Lock()
+
+
+def _flush_at_exit(cache):
+    ''' flushes the pending writes of the given cache at exit
+
+        @remarks
+        The flush is performed by a multiprocessing finalizer, which also
+        runs in multiprocessing workers (which exit through os._exit and,
+        therefore, skip the atexit handlers). Its exit priority is higher
+        than the one of thread pools, i.e. caches are flushed before the
+        I/O thread pool is terminated.
+    '''
+    global _exit_flushes_pid
+    with _exit_flushes_lock:
+        if cache not in _exit_flushes:
+            _exit_flushes.add(cache)
+            # processes started by multiprocessing inherit the cache
+            register_after_fork(cache, _flush_at_exit)
+        if _exit_flushes_pid != getpid():
+            Finalize(None, _flush_all, exitpriority=_EXIT_PRIORITY)
+            _exit_flushes_pid = getpid()
+
+
+def _flush_all():
+    ''' flushes all caches registered with _flush_at_exit '''
+    for cache in list(_exit_flushes):
+        try:
+            cache.flush()
+        except Exception as e:
+            log.warning("Cannot flush %s at exit: %s", cache, e)
+
+# computations in progress: cache file -> _Flight
+_in_flight = {}
+_in_flight_lock = Lock()
+
+
+class _Flight(object):
+    ''' a computation in progress, waited for by other threads '''
+    __slots__ = ('done', 'completed', 'result')
+
+    def __init__(self):
+        self.done = Event()
+        self.completed = False
+        self.result = None
+
+
+# entries currently revalidated in the background: (cache id, object id)
+_revalidating = set()
+_revalidating_lock = Lock()
+
+
+class Expiring(object):
+    ''' wraps the result of a cached function, which should expire after
+        ttl seconds (overwrites the cache's ttl for this entry)
+
+        usage:
+          @DiskCached("./cache", ttl=3600)
+          def myfunction(*args):
+              return Expiring(result, ttl=60)
+    '''
+    __slots__ = ('value', 'ttl')
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.ttl = ttl
+
+
+class _Entry(object):
+    ''' a cached object (or exception) with an expiry date '''
+    __slots__ = ('value', 'expires', 'error')
+
+    def __init__(self, value, expires, error=None):
+        self.value = value
+        self.expires = expires
+        self.error = error
+
+    def __getstate__(self):
+        return (self.value, self.expires, self.error)
+
+    def __setstate__(self, state):
+        self.value, self.expires, self.error = state
+
+
+def _get_value(entry):
+    ''' returns the value of a cache entry or raises the cached exception '''
+    if type(entry) is not _Entry:
+        return entry
+    if entry.error is not None:
+        # python 3 extends the exception's traceback on every raise
+        if getattr(entry.error, '__traceback__', None) is not None:
+            entry.error.__traceback__ = None
+        raise entry.error
+    return entry.value
+
 
 get_unique_temp_file = lambda fname: join(dirname(fname),
                                           "_%s-%s-%d" % (basename(fname),
                                           gethostname(), getpid()))
 
+
+class _TimedCall(object):
+    ''' wraps a fetch function and measures the duration of its calls '''
+    __slots__ = ('fn', 'elapsed', 'keys')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.elapsed = None
+        self.keys = ()
+
+    def __call__(self, *args, **kargs):
+        start = time()
+        try:
+            return self.fn(*args, **kargs)
+        finally:
+            self.elapsed = (self.elapsed or 0.) + time() - start
+
+
+class _TimedBatchCall(_TimedCall):
+    ''' wraps a fetch_many batch function and records the missing keys '''
+    __slots__ = ()
+
+    def __call__(self, keys):
+        self.keys = keys
+        return _TimedCall.__call__(self, keys)
+
+
+def get_object_size(obj, _seen=None):
+    ''' returns the approximated memory footprint of the given object in
+        bytes (including the content of lists, tuples, sets and dicts) '''
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_object_size(k, _seen) + get_object_size(v, _seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_object_size(item, _seen) for item in obj)
+    elif isinstance(obj, _Entry):
+        size += get_object_size(obj.value, _seen)
+    return size
+
+
+_text_type = type(u"")
+try:
+    _string_types = basestring  # python 2
+except NameError:
+    _string_types = str
+_TEXT_TYPES = set((_text_type, ))
+_pack_length = Struct("<Q").pack
+_NUMBER_TYPES = {int: b"i", long: b"i", float: b"f", bool: b"?"}
+
+
+def _get_fast_hash():
+    ''' returns the fastest available hash function (xxhash if installed
+        or sha1, which is hardware accelerated on current CPUs) '''
+    if xxhash:
+        return getattr(xxhash, 'xxh3_128', xxhash.xxh64)
+    return sha1
+
+
+class _CallKey(tuple):
+    ''' the key of a function call (see Cache.getKey), which is encoded
+        like the call itself by KeyEncoders; its repr equals the one of a
+        plain tuple. '''
+    __slots__ = ()
+
+
+class KeyEncoder(object):
+    ''' @class KeyEncoder
+        Computes canonical object ids for cache keys.
+
+        In contrast to Cache.getObjectId the encoder
+        - hashes strings and bytes directly rather than their repr,
+        - sorts keyword arguments, dictionaries and sets,
+        - uses the __cache_key__() method of objects that provide one and
+        - refuses objects with the default repr (which contains the object's
+          memory address and, therefore, changes between processes).
+
+        usage:
+          @DiskCached("./cache", key_encoder=KeyEncoder(fast=True))
+          def myfunction(*args):
+
+        @remarks
+        The object ids differ from the ones computed by Cache.getObjectId,
+        i.e. switching an existing cache to the encoder invalidates it.
+        Function calls are encoded without building the tuple returned by
+        Cache.getKey; use fetchObjectId for entries that are later queried
+        with 'key in cache' or removed with 'del cache[key]'.
+    '''
+
+    def __init__(self, fast=False, hash_function=None):
+        ''' ::param fast: use the fast non-cryptographic xxhash (if
+                          installed) instead of sha1
+            ::param hash_function: optional hashlib compatible constructor
+        '''
+        self.fast = fast
+        self.hash_function = hash_function or \
+            (_get_fast_hash() if fast else sha1)
+
+    def __getstate__(self):
+        return {'fast': self.fast, 'hash_function': None if self.fast
+                else self.hash_function}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def getObjectId(self, obj):
+        ''' returns the object id for the given key '''
+        out = []
+        self._encode(obj, out)
+        return self.hash_function(b"".join(out)).hexdigest()
+
+    def getCallObjectId(self, args, kargs):
+        ''' returns the object id for the given function arguments '''
+        out = [b"C"]
+        self._encode(args, out)
+        # keyword argument names are strings and, therefore, sortable
+        for name in sorted(kargs):
+            self._encode(name, out)
+            self._encode(kargs[name], out)
+        return self.hash_function(b"".join(out)).hexdigest()
+
+    def _encode(self, obj, out):
+        ''' appends the canonical encoding of obj to the list out '''
+        t = type(obj)
+        if t is _text_type:
+            data = obj.encode("utf8")
+            out.append(b"s" + _pack_length(len(data)))
+            out.append(data)
+        elif t is bytes:
+            out.append(b"b" + _pack_length(len(obj)))
+            out.append(obj)
+        elif t in _NUMBER_TYPES:
+            data = repr(obj).encode("ascii")
+            out.append(_NUMBER_TYPES[t] + _pack_length(len(data)) + data)
+        elif t is tuple or t is list:
+            self._encode_sequence(obj, out)
+        elif obj is None:
+            out.append(b"N")
+        elif t is dict:
+            self._encode_dict(obj, out)
+        elif t is set or t is frozenset:
+            out.append(b"e" + _pack_length(len(obj)))
+            out.extend(sorted(self._encode_item(item) for item in obj))
+        elif hasattr(obj, '__cache_key__'):
+            self._encode(t.__name__, out)
+            out.append(b"k")
+            self._encode(obj.__cache_key__(), out)
+        elif t.__repr__ is object.__repr__:
+            raise TypeError("Cannot compute a stable cache key for %s; "
+                            "please implement __cache_key__." % t)
+        else:
+            data = repr(obj).encode("utf8")
+            out.append(b"r" + _pack_length(len(data)))
+            out.append(data)
+
+    def _encode_sequence(self, obj, out):
+        tag = b"t" if type(obj) is tuple else b"l"
+        # sequences of strings are encoded as the concatenated string and
+        # the length of its items
+        if len(obj) > 1 and set(map(type, obj)) == _TEXT_TYPES:
+            data = u"".join(obj).encode("utf8")
+            out.append(tag.upper() + _pack_length(len(obj)) +
+                       pack("<%dQ" % len(obj), *map(len, obj)))
+            out.append(data)
+            return
+
+        out.append(tag + _pack_length(len(obj)))
+        for item in obj:
+            self._encode(item, out)
+
+    def _encode_dict(self, obj, out):
+        out.append(b"d" + _pack_length(len(obj)))
+        for key, value in sorted((self._encode_item(k), v)
+                                 for k, v in obj.items()):
+            out.append(key)
+            self._encode(value, out)
+
+    def _encode_item(self, obj):
+        ''' returns the encoding of a single object '''
+        out = []
+        self._encode(obj, out)
+        return b"".join(out)
+
+
 class Cache(object):
-    ''' An abstract class for caching functions '''
+    ''' An abstract class for caching functions
 
-    def __init__(self, fn=None):
+        @remarks
+        Subclasses implement _fetch, which receives the object id computed
+        by fetch (based on the function arguments) or fetchObjectId (based
+        on a user defined key).
+
+        Hits, misses and latencies are recorded under the name of the
+        cached function if a metrics_registry is set, e.g.
+        cache.metrics_registry = REGISTRY (see eWRT.util.metrics) or
+        Cache.metrics_registry = REGISTRY for all caches. Recording is
+        disabled by default to keep cache hits cheap.
+    '''
+    _cache_hit = 0
+    _cache_miss = 0
+    _bytes_read = 0
+    _bytes_written = 0
+    metrics_registry = None
+    # (registry, function, CacheMetrics) of the last recorded call
+    _metrics = None
+
+    def __init__(self, fn=None, key_encoder=None, ttl=0,
+                 stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=()):
+        ''' ::param fn: function to cache (optional)
+            ::param key_encoder: optional KeyEncoder used for computing
+                                 object ids (default: sha1 of the key's repr)
+            ::param ttl: number of seconds after which entries expire (0 for
+                         entries which never expire). Cached functions may
+                         return Expiring objects to set per entry ttls.
+            ::param stale_while_revalidate: number of seconds after the expiry
+                         in which the stale entry is returned, while a
+                         background thread refreshes it
+            ::param negative_ttl: if set, None results and the exceptions
+                         listed in negative_exceptions are cached for
+                         negative_ttl seconds
+            ::param negative_exceptions: tuple of exception classes to cache
+        '''
         self.fn = fn
+        self.key_encoder = key_encoder
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.negative_ttl = negative_ttl
+        self.negative_exceptions = tuple(negative_exceptions)
 
     def __call__(self, *args, **kargs):
         ''' retrieves the result using self.fn as function and
@@ -66,25 +525,258 @@ class Cache(object):
             The key helps to determine whether the object is already in
             the cache or not.
         '''
-        raise NotImplementedError
+        return self._record(self._object_id(key), fetch_function, args, kargs)
 
     def fetch(self, fetch_function, *args, **kargs):
         ''' Fetches a object from the cache or computes it by calling the
             fetch_function.
             The objectId is computed based on the function arguments
         '''
+        return self._record(self.getCallObjectId(args, kargs), fetch_function,
+                            args, kargs)
+
+    def _record(self, obj_id, fetch_function, args, kargs):
+        ''' calls _fetch and records the access in the metrics registry '''
+        if self.metrics_registry is None:
+            return self._fetch(obj_id, fetch_function, args, kargs)
+
+        metrics = self._get_metrics(fetch_function)
+        call = _TimedCall(fetch_function)
+        start = time()
+        try:
+            return self._fetch(obj_id, call, args, kargs)
+        finally:
+            if call.elapsed is None:
+                metrics.record(time() - start)
+            else:
+                metrics.record(time() - start, call.elapsed, hits=0, misses=1)
+
+    def _get_metrics(self, fetch_function):
+        ''' returns the CacheMetrics of the cached function '''
+        registry, fn = self.metrics_registry, self.fn or fetch_function
+        cached = self._metrics
+        if cached is None or cached[0] is not registry or cached[1] != fn:
+            cached = self._metrics = (
+                registry, fn, registry.get(get_function_name(fn), self))
+        return cached[2]
+
+    def _get_metrics_gauges(self):
+        ''' returns the byte, entry and eviction counts of the cache (None
+            for values not tracked by the cache) '''
+        return {'bytes_read': self._bytes_read,
+                'bytes_written': self._bytes_written,
+                'entries': None,
+                'evictions': None}
+
+    def _get_directory_gauges(self):
+        ''' returns the cache directory and its entry and eviction counts
+            for caches sharing these counts with other caches (or None) '''
+        return None
+
+    def fetch_many(self, keys, fetch_function_batch):
+        ''' Fetches the objects for the given keys from the cache and
+            computes all missing objects with a single call of
+            fetch_function_batch.
+
+            ::param keys: a sequence of keys
+            ::param fetch_function_batch: function which receives the list
+                of missing keys and returns either a dictionary key -> object
+                or a sequence of objects in the order of the missing keys
+            ::returns: a list of objects in the order of the given keys
+
+            @remarks
+            Expired entries are recomputed as part of the batch rather
+            than revalidated in the background.
+        '''
+        keys = list(keys)
+        if self.metrics_registry is None:
+            return self._fetch_many(keys, fetch_function_batch)
+
+        metrics = self._get_metrics(fetch_function_batch)
+        call = _TimedBatchCall(fetch_function_batch)
+        start = time()
+        try:
+            return self._fetch_many(keys, call)
+        finally:
+            misses = len(call.keys) if call.elapsed is not None else 0
+            metrics.record(time() - start, call.elapsed,
+                           hits=len(keys) - misses, misses=misses)
+
+    def _fetch_many(self, keys, fetch_function_batch):
+        obj_ids = [self._object_id(key) for key in keys]
+        result = self._lookup_many(obj_ids)
+
+        missing = [pos for pos, obj in enumerate(result) if obj is _MISSING]
+        if not missing:
+            return result
+
+        missing_keys = [keys[pos] for pos in missing]
+        computed = fetch_function_batch(missing_keys)
+        if isinstance(computed, dict):
+            computed = [computed.get(key) for key in missing_keys]
+        else:
+            computed = list(computed)
+            if len(computed) != len(missing):
+                raise ValueError("fetch_function_batch returned %d objects "
+                                 "for %d keys" % (len(computed), len(missing)))
+
+        items = []
+        for pos, obj in zip(missing, computed):
+            entry, cacheable = self._wrap(obj)
+            if cacheable:
+                items.append((obj_ids[pos], entry))
+            result[pos] = _get_value(entry)
+        self._cache_miss += len(missing)
+        if items:
+            self._store_many(items)
+        return result
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        ''' Fetches the object with the given object id from the cache or
+            computes it by calling fetch_function(*args, **kargs).
+        '''
+        raise NotImplementedError
+
+    def _lookup_many(self, obj_ids):
+        ''' ::returns: a list of the cached objects (or _MISSING) for the
+                       given object ids '''
+        return [self._lookup(obj_id) for obj_id in obj_ids]
+
+    def _store_many(self, items):
+        ''' stores the given (object id, entry) pairs '''
+        for obj_id, entry in items:
+            self._store(obj_id, entry)
+
+    def _lookup(self, obj_id):
+        ''' returns the cached object with the given object id or _MISSING
+            (required for using the cache as a tier of a TieredCache)
+        '''
+        raise NotImplementedError
+
+    def _store(self, obj_id, obj):
+        ''' stores the object (or _Entry) under the given object id
+            (required for using the cache as a tier of a TieredCache)
+        '''
+        raise NotImplementedError
+
+    def _delete(self, obj_id):
+        ''' removes the object with the given object id
+            ::returns: True if the object has been removed
+        '''
         raise NotImplementedError
 
+    def _call(self, fetch_function, args, kargs):
+        ''' calls the fetch_function
+
+            ::returns: a tuple (entry, cacheable), where entry is either the
+                       result or an _Entry with its expiry date and cacheable
+                       indicates whether the entry should be cached
+        '''
+        try:
+            obj = fetch_function(*args, **kargs)
+        except self.negative_exceptions as e:
+            if not self.negative_ttl:
+                raise
+            return _Entry(None, time() + self.negative_ttl, e), True
+        return self._wrap(obj)
+
+    def _wrap(self, obj):
+        ''' ::returns: the tuple (entry, cacheable) for a computed object '''
+        ttl = self.ttl
+        if isinstance(obj, Expiring):
+            obj, ttl = obj.value, obj.ttl
+
+        # Do not cache None (unless negative caching has been enabled)
+        if obj == None:
+            if self.negative_ttl:
+                return _Entry(None, time() + self.negative_ttl), True
+            return obj, False
+        return self._get_entry(obj, ttl), True
+
+    def _get_entry(self, obj, ttl=None):
+        ''' returns the entry to cache for the given object (entries are
+            returned unchanged) '''
+        if type(obj) is _Entry:
+            return obj
+        ttl = self.ttl if ttl is None else ttl
+        return _Entry(obj, time() + ttl) if ttl else obj
+
+    def _check_entry(self, entry, obj_id, store, fetch_function, args, kargs):
+        ''' returns the entry's value or _MISSING if the entry has expired.
+            Stale entries are returned and refreshed in the background, if
+            within the stale_while_revalidate period.
+
+            ::param entry: the cached entry
+            ::param obj_id: the entry's object id
+            ::param store: function used to store a refreshed entry
+        '''
+        if type(entry) is not _Entry:
+            return entry
+
+        now = time()
+        if now < entry.expires:
+            return _get_value(entry)
+        if entry.error is None and \
+                now < entry.expires + self.stale_while_revalidate:
+            self._revalidate(obj_id, store, fetch_function, args, kargs)
+            return entry.value
+        return _MISSING
+
+    @staticmethod
+    def _valid(entry):
+        ''' returns the entry's value or _MISSING if it has expired '''
+        if type(entry) is _Entry and entry.expires <= time():
+            return _MISSING
+        return _get_value(entry)
+
+    def _revalidate(self, obj_id, store, fetch_function, args, kargs):
+        ''' refreshes an entry in a background thread '''
+        revalidation_id = (id(self), obj_id)
+        with _revalidating_lock:
+            if revalidation_id in _revalidating:
+                return
+            _revalidating.add(revalidation_id)
+
+        def refresh():
+            try:
+                entry, cacheable = self._call(fetch_function, args, kargs)
+                if cacheable:
+                    store(entry)
+            except Exception as e:
+                log.warning("Cannot revalidate cache entry: %s", e)
+            finally:
+                with _revalidating_lock:
+                    _revalidating.discard(revalidation_id)
+
+        t = Thread(target=refresh, name="eWRT cache revalidation")
+        t.daemon = True
+        t.start()
+
     @staticmethod
     def getKey(*args, **kargs):
         ''' returns the key for a set of function parameters '''
-        return (args, tuple(kargs.items()))
+        return _CallKey((args, tuple(kargs.items())))
 
     @staticmethod
     def getObjectId(obj):
         ''' returns an identifier representing the object '''
         return sha1(repr(obj).encode("utf8")).hexdigest()
 
+    def getCallObjectId(self, args, kargs):
+        ''' returns the object id for the given function arguments '''
+        if self.key_encoder:
+            return self.key_encoder.getCallObjectId(args, kargs)
+        return self.getObjectId(self.getKey(*args, **kargs))
+
+    def _object_id(self, key):
+        ''' returns the object id for a user defined key '''
+        if self.key_encoder:
+            # keys returned by getKey refer to the entries stored by fetch
+            if type(key) is _CallKey:
+                return self.key_encoder.getCallObjectId(key[0], dict(key[1]))
+            return self.key_encoder.getObjectId(key)
+        return self.getObjectId(key)
+
 
 
 class DiskCache(Cache):
@@ -94,23 +786,184 @@ class DiskCache(Cache):
 
         @remarks
         This version of DiskCached is threadsafe
+        With single_flight enabled, concurrent misses on the same key are
+        computed only once (across threads and processes).
+        With write_behind enabled, computed objects are returned at once and
+        written by a background thread; call flush() to wait for pending
+        writes (performed automatically at exit). Objects computed under a
+        single flight lock are written before the lock is released.
+        Caches with a namespace and/or generation store their entries in
+        the directory <cache_dir>/<namespace>@<generation>. Changing the
+        generation (or calling invalidate()) invalidates all entries of
+        the namespace at once; a DiskCacheJanitor removes the files of
+        the namespace's previous generations in the background (caches
+        without namespace never retire any directories, since they might
+        share the cache_dir with other caches).
+        If max_bytes or max_age are set, a shared DiskCacheJanitor thread
+        evicts the least recently used cache files in the background.
     '''
 
-    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="", fn=None):
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="", fn=None,
+                 max_bytes=0, max_age=0, janitor_interval=DEFAULT_JANITOR_INTERVAL,
+                 codec=None, single_flight=False,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT, key_encoder=None,
+                 ttl=0, stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=(), write_behind=False,
+                 max_queue_size=DEFAULT_WRITE_QUEUE_SIZE,
+                 backpressure='block', namespace=None, generation=None):
         ''' initializes the Cache object
             ::param cache_dir: the cache base directory
             ::param cache_nesting_level: optional number of nesting level (0)
             ::param cache_file_suffix: optional suffix for cache files
             ::param fn: function to cache (optional; required for directly calling the class
                           using __call__
+            ::param max_bytes: optional maximum size of the cache in bytes
+            ::param max_age: optional number of seconds after which entries
+                             that have not been accessed are evicted
+            ::param janitor_interval: seconds between two janitor passes
+            ::param codec: the eWRT.util.codec.Codec (or codec name) used for
+                           writing new entries (default: gzip). Entries
+                           written with other codecs remain readable.
+            ::param single_flight: if True, only one thread/process computes
+                                   a missing entry while concurrent callers
+                                   wait for its result
+            ::param lease_timeout: seconds after which other callers stop
+                                   waiting for a single flight computation
+                                   of a thread/process which stopped
+                                   renewing its lease
+            ::param key_encoder: optional KeyEncoder for computing object ids
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+            ::param write_behind: write computed objects in a background
+                                  thread
+            ::param max_queue_size: maximum number of pending writes
+            ::param backpressure: policy for writes exceeding max_queue_size
+                                  ('block', 'drop' or 'sync')
+            ::param namespace: optional namespace of the cache's entries
+            ::param generation: optional generation (e.g. the version of a
+                                web service API); if omitted, namespaced
+                                caches use a generation counter stored in
+                                the cache directory (see invalidate())
         '''
-        Cache.__init__(self, fn)
+        assert backpressure in BACKPRESSURE_POLICIES
+        assert "@" not in str(generation)
+        Cache.__init__(self, fn, key_encoder, ttl, stale_while_revalidate,
+                       negative_ttl, negative_exceptions)
         self.cache_dir = cache_dir
         self.cache_file_suffix = cache_file_suffix
         self.cache_nesting_level = cache_nesting_level
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.codec = get_codec(codec) if isinstance(codec, _string_types) \
+            else codec or DEFAULT_CODEC
+        self.single_flight = single_flight
+        self.lease_timeout = lease_timeout
+        self.write_behind = write_behind
+        self.max_queue_size = max_queue_size
+        self.backpressure = backpressure
+        self.janitor_interval = janitor_interval
+        self.namespace = namespace
+        self.generation = generation
 
         self._cache_hit = 0
         self._cache_miss = 0
+        self._generation_dir = None
+        self._generation_checked = 0
+        self._init_state()
+
+        if max_bytes or max_age:
+            DiskCacheJanitor.get_instance(cache_dir, max_bytes, max_age,
+                                          janitor_interval)
+        if namespace is not None or generation is not None:
+            self._update_generation()
+
+    def _init_state(self):
+        ''' initializes the per process write-behind state '''
+        # entries queued for writing: cache file -> entry
+        self._pending = {}
+        self._pending_lock = Lock()
+        self._writer = None
+        if self.write_behind:
+            self._writer = _BackgroundWriter(self.max_queue_size,
+                                             self.backpressure)
+            _flush_at_exit(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_metrics', None)
+        for attr in ('_pending', '_pending_lock', '_writer'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def flush(self):
+        ''' blocks until all pending writes have been performed '''
+        if self._writer:
+            self._writer.flush()
+
+    def invalidate(self):
+        ''' invalidates all entries of the cache's namespace by bumping the
+            namespace's stored generation counter '''
+        assert self.generation is None, \
+            "caches with an explicit generation are invalidated by " \
+            "changing the generation"
+        self.flush()
+        generation_file = self._get_generation_file()
+        if not exists(self.cache_dir):
+            makedirs(self.cache_dir)
+        temp_file = get_unique_temp_file(generation_file)
+        with open(temp_file, "w") as f:
+            f.write(str(self._read_generation() + 1))
+        replace(temp_file, generation_file)
+        self._update_generation()
+
+    def _get_generation_file(self):
+        return join(self.cache_dir, "_generation@%s" % (self.namespace or ""))
+
+    def _read_generation(self):
+        ''' returns the namespace's stored generation counter '''
+        try:
+            with open(self._get_generation_file()) as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _update_generation(self):
+        ''' determines the directory of the current generation and retires
+            the directories of previous generations '''
+        generation = self.generation if self.generation is not None \
+            else self._read_generation()
+        generation_dir = join(self.cache_dir,
+                              "%s@%s" % (self.namespace or "", generation))
+        self._generation_checked = time()
+        if generation_dir == self._generation_dir:
+            return
+
+        self._generation_dir = generation_dir
+        if not self.namespace or not scandir or not exists(self.cache_dir):
+            return
+        retired = [entry.path for entry in scandir(self.cache_dir)
+                   if entry.is_dir() and entry.path != generation_dir and
+                   "@" in entry.name and
+                   entry.name.rpartition("@")[0] == self.namespace]
+        if retired:
+            janitor = DiskCacheJanitor.get_instance(
+                self.cache_dir, self.max_bytes, self.max_age,
+                self.janitor_interval)
+            for path in retired:
+                janitor.retire(path)
+
+    def _get_base_dir(self):
+        ''' returns the directory containing the cache's entries '''
+        if self._generation_dir is None:
+            return self.cache_dir
+        if self.generation is None and \
+                time() - self._generation_checked > GENERATION_CHECK_INTERVAL:
+            self._update_generation()
+        return self._generation_dir
 
 
     def fetch(self, fetch_function, *args, **kargs):
@@ -126,19 +979,20 @@ class DiskCache(Cache):
 
             ::returns: the object (retrieved from the cache or computed)
         '''
-        objectId = self.getKey(*args, **kargs)
-        return self.fetchObjectId(objectId, fetch_function, *args, **kargs)
+        return self._record(self.getCallObjectId(args, kargs), fetch_function,
+                            args, kargs)
 
 
     def __contains__(self, key):
         ''' returns whether the key is already stored in the cache '''
-        cache_file = self._get_fname(self.getObjectId(key))
-        return exists(cache_file)
+        cache_file = self._get_fname(self._object_id(key))
+        return cache_file in self._pending or exists(cache_file)
 
 
     def __delitem__(self, key):
         ''' removes the given item from the cache '''
-        cache_file = self._get_fname(self.getObjectId(key))
+        self.flush()
+        cache_file = self._get_fname(self._object_id(key))
         remove(cache_file)
 
 
@@ -156,40 +1010,225 @@ class DiskCache(Cache):
 
             ::returns: the object (retrieved from the cache or computed)
         '''
-        cache_file = self._get_fname(self.getObjectId(key))
-        if exists(cache_file):
-            #
-            # case 1: cache hit - return the cached result
-            #
-            self._cache_hit += 1
-            with GzipFile(cache_file) as f:
-                return load(f)
+        return self._record(self._object_id(key), fetch_function, args, kargs)
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        cache_file = self._get_fname(obj_id)
+        #
+        # case 1: cache hit - return the cached result
+        #
+        entry = self._load(cache_file)
+        if entry is not _MISSING:
+            obj = self._check_entry(entry, obj_id, partial(self._save, cache_file),
+                                    fetch_function, args, kargs)
+            if obj is not _MISSING:
+                return obj
 
         #
         # case 2: cache miss
         # - compute and cache the result
         #
-        temp_file = get_unique_temp_file(cache_file)
+        if self.single_flight:
+            return self._fetch_single_flight(cache_file, fetch_function,
+                                             args, kargs)
+        return self._compute(cache_file, fetch_function, args, kargs)
+
+    def _load(self, cache_file):
+        ''' returns the cached entry or _MISSING '''
+        if self._pending:
+            obj = self._pending.get(cache_file, _MISSING)
+            if obj is not _MISSING:
+                self._cache_hit += 1
+                return obj
+        if not exists(cache_file):
+            return _MISSING
+        try:
+            with open(cache_file, "rb") as f:
+                data = f.read()
+                obj = decode(data)
+                # entries written without expiry date expire ttl seconds
+                # after their last modification
+                if self.ttl and type(obj) is not _Entry:
+                    obj = _Entry(obj, fstat(f.fileno()).st_mtime + self.ttl)
+        # the janitor might have removed the file in the meantime
+        except (IOError, OSError) as e:
+            if e.errno != ENOENT:
+                raise e
+            return _MISSING
+
+        self._cache_hit += 1
+        self._bytes_read += len(data)
+        if self.max_bytes or self.max_age:
+            self._touch(cache_file)
+        return obj
 
+    def _compute(self, cache_file, fetch_function, args, kargs, save=None):
+        ''' computes the object and stores it in the cache
+            ::param save: function used for storing the entry (default:
+                          _save)
+        '''
         self._cache_miss += 1
-        obj = fetch_function(*args, **kargs)
+        entry, cacheable = self._call(fetch_function, args, kargs)
+        if cacheable:
+            try:
+                (save or self._save)(cache_file, entry)
+            except Exception as e:
+                # cached exceptions might not be serializable
+                if type(entry) is not _Entry or entry.error is None:
+                    raise e
+                log.warning("Cannot cache exception %s: %s", entry.error, e)
+        return _get_value(entry)
+
+    def _save(self, cache_file, entry):
+        ''' writes the entry immediately or queues it (write behind) '''
+        if not self._writer:
+            self._write(cache_file, entry)
+            return
 
-        # Do not cache None
-        if obj == None:
-            return obj
+        with self._pending_lock:
+            self._pending[cache_file] = entry
+        if not self._writer.submit(self._write_pending, cache_file, entry):
+            self._discard_pending(cache_file, entry)
 
-        with GzipFile(temp_file, "w") as f:
-            dump(obj, f)
+    def _write_pending(self, cache_file, entry):
+        ''' writes a queued entry '''
+        try:
+            self._write(cache_file, entry)
+        finally:
+            self._discard_pending(cache_file, entry)
+
+    def _discard_pending(self, cache_file, entry):
+        ''' removes the entry from the pending writes, unless it has been
+            replaced by a newer one '''
+        with self._pending_lock:
+            if self._pending.get(cache_file) is entry:
+                del self._pending[cache_file]
+
+    def _write(self, cache_file, obj):
+        ''' atomically writes the object to the given cache file '''
+        temp_file = get_unique_temp_file(cache_file)
+        data = self.codec.dumps(obj)
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        self._bytes_written += len(data)
 
+        # replaces expired entries
         try:
-            link(temp_file, cache_file)
-        # ignore file exists errors
-        except OSError as e:
-            if e.errno != 17:
-                raise e
+            replace(temp_file, cache_file)
+        except OSError:
+            self._remove(temp_file)
+
+    def _lookup(self, obj_id):
+        return self._valid(self._load(self._get_fname(obj_id)))
+
+    def _store(self, obj_id, obj):
+        self._save(self._get_fname(obj_id), self._get_entry(obj))
+
+    def _lookup_many(self, obj_ids):
+        if len(obj_ids) < 2:
+            return Cache._lookup_many(self, obj_ids)
+        return _get_io_pool().map(self._lookup, obj_ids)
+
+    def _store_many(self, items):
+        # duplicate keys would be written in parallel to the same temp file
+        items = list(dict((self._get_fname(obj_id), entry)
+                          for obj_id, entry in items).items())
+        if self._writer or len(items) < 2:
+            for cache_file, entry in items:
+                self._save(cache_file, entry)
+        else:
+            _get_io_pool().map(lambda item: self._write(*item), items)
 
-        remove(temp_file)
-        return obj
+    def _delete(self, obj_id):
+        self.flush()
+        try:
+            remove(self._get_fname(obj_id))
+            return True
+        except OSError:
+            return False
+
+    def _fetch_single_flight(self, cache_file, fetch_function, args, kargs):
+        ''' ensures that only one thread computes a missing object; all
+            other threads wait for its result '''
+        with _in_flight_lock:
+            flight = _in_flight.get(cache_file)
+            leader = flight is None
+            if leader:
+                flight = _in_flight[cache_file] = _Flight()
+
+        if not leader:
+            if flight.done.wait(self.lease_timeout) and flight.completed:
+                self._cache_hit += 1
+                return flight.result
+            # the leader failed or timed out => compute the object ourselves
+            return self._fetch_single_flight_process(cache_file,
+                                                     fetch_function, args,
+                                                     kargs)
+        try:
+            flight.result = self._fetch_single_flight_process(
+                cache_file, fetch_function, args, kargs)
+            flight.completed = True
+            return flight.result
+        finally:
+            with _in_flight_lock:
+                del _in_flight[cache_file]
+            flight.done.set()
+
+    def _fetch_single_flight_process(self, cache_file, fetch_function, args,
+                                     kargs):
+        ''' ensures that only one process computes a missing object by
+            using a lock file; other processes poll until the object is
+            available, the lock has been released or its lease expired '''
+        lock_file = join(dirname(cache_file), "_%s.lock" % basename(cache_file))
+        token = ("%d:%s" % (getpid(), hexlify(urandom(8)).decode("ascii"))
+                 ).encode("ascii")
+        poll_interval = SINGLE_FLIGHT_POLL_INTERVAL[0]
+        while True:
+            try:
+                fd = os_open(lock_file, O_CREAT | O_EXCL | O_WRONLY)
+                try:
+                    write(fd, token)
+                finally:
+                    close(fd)
+                break
+            except OSError as e:
+                if e.errno != EEXIST:
+                    raise e
+
+            obj = self._valid(self._load(cache_file))
+            if obj is not _MISSING:
+                return obj
+            try:
+                owner = _read_lock_owner(lock_file)
+                if time() - stat(lock_file).st_mtime > self.lease_timeout:
+                    log.warning("Lease of %s expired.", lock_file)
+                    _release_lock(lock_file, owner)
+                    continue
+            except (IOError, OSError):
+                continue
+            sleep(poll_interval)
+            poll_interval = min(2 * poll_interval,
+                                SINGLE_FLIGHT_POLL_INTERVAL[1])
+
+        # refresh the lease while computing, so that other processes do not
+        # consider slow computations as expired
+        done = Event()
+        heartbeat = Thread(target=_renew_lease,
+                           args=(lock_file, token, self.lease_timeout / 3.,
+                                 done))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            # another process might have finished in the meantime
+            obj = self._valid(self._load(cache_file))
+            if obj is not _MISSING:
+                return obj
+            # write behind would release the lock before the entry exists
+            return self._compute(cache_file, fetch_function, args, kargs,
+                                 save=self._write)
+        finally:
+            done.set()
+            _release_lock(lock_file, token)
 
 
     def _remove(self, fname):
@@ -199,11 +1238,32 @@ class DiskCache(Cache):
         except OSError:
             pass
 
+    @staticmethod
+    def _touch(fname):
+        ''' updates the access time of the given file, since the file
+            system might be mounted with the noatime or relatime option.
+            The modification time is kept, since it determines the expiry
+            of entries written without an expiry date. '''
+        try:
+            utime(fname, (time(), stat(fname).st_mtime))
+        except OSError:
+            pass
+
 
     def getCacheStatistics(self):
         ''' returns statistics regarding the cache's hit/miss ratio '''
         return {'cache_hits': self._cache_hit, 'cache_misses': self._cache_miss}
 
+    def _get_directory_gauges(self):
+        # entry and eviction counts are only known to a running janitor,
+        # which is shared by all caches of the directory
+        cache_dir = abspath(self.cache_dir)
+        janitor = DiskCacheJanitor._instances.get(cache_dir)
+        if janitor is None:
+            return None
+        return cache_dir, {'entries': janitor.getEntryCount(),
+                           'evictions': janitor.evicted}
+
 
     def _get_fname(self, obj_id):
         ''' Computes the filename of the file with the given
@@ -214,7 +1274,8 @@ class DiskCache(Cache):
         '''
         assert len(obj_id) >= self.cache_nesting_level
 
-        obj_dir = join(*([self.cache_dir] + list(obj_id[:self.cache_nesting_level])))
+        obj_dir = join(*([self._get_base_dir()] +
+                         list(obj_id[:self.cache_nesting_level])))
         if not exists(obj_dir):
             try:
                 makedirs(obj_dir)
@@ -235,70 +1296,649 @@ class DiskCached(object):
     '''
     __slots__ = ('cache', )
 
-    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix=""):
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="",
+                 max_bytes=0, max_age=0, codec=None, single_flight=False,
+                 key_encoder=None, ttl=0, stale_while_revalidate=0,
+                 negative_ttl=0, negative_exceptions=(), write_behind=False,
+                 max_queue_size=DEFAULT_WRITE_QUEUE_SIZE,
+                 backpressure='block', namespace=None, generation=None):
         ''' initializes the Cache object
             ::param fn:                  the function to cache
             ::param cache_dir:           the cache base directory
             ::param cache_nesting_level: optional number of nesting level (0)
             ::param cache_file_suffix:   optional suffix for cache files
+            ::param max_bytes:           optional maximum cache size in bytes
+            ::param max_age:             optional maximum idle time in seconds
+            ::param codec:               optional codec for new entries
+            ::param single_flight:       deduplicate concurrent cache misses
+            ::param key_encoder:         optional KeyEncoder
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+            ::param write_behind:        write entries in the background
+            ::param max_queue_size:      maximum number of queued writes
+            ::param backpressure:        policy for a full write queue
+            ::param namespace:           optional namespace
+            ::param generation:          optional generation of the namespace
         '''
-        self.cache = DiskCache(cache_dir, cache_nesting_level, cache_file_suffix)
+        self.cache = DiskCache(cache_dir, cache_nesting_level, cache_file_suffix,
+                               max_bytes=max_bytes, max_age=max_age, codec=codec,
+                               single_flight=single_flight,
+                               key_encoder=key_encoder, ttl=ttl,
+                               stale_while_revalidate=stale_while_revalidate,
+                               negative_ttl=negative_ttl,
+                               negative_exceptions=negative_exceptions,
+                               write_behind=write_behind,
+                               max_queue_size=max_queue_size,
+                               backpressure=backpressure,
+                               namespace=namespace, generation=generation)
 
     def __call__(self, fn):
         self.cache.fn = fn
         return self.cache
 
 
+class _DirectoryState(object):
+    ''' the janitor's view of a single cache directory '''
+    __slots__ = ('mtime', 'subdirs', 'files')
+
+    def __init__(self, mtime, subdirs, files):
+        self.mtime = mtime
+        self.subdirs = subdirs
+        self.files = files      # file name -> (access time, size)
+
+
+class DiskCacheJanitor(object):
+    ''' @class DiskCacheJanitor
+        Evicts files from a DiskCache directory which either exceed the
+        cache's max_age or are the least recently used ones once the cache
+        grows beyond max_bytes.
+
+        usage:
+          janitor = DiskCacheJanitor("./cache", max_bytes=2**30)
+          janitor.start()    # background thread
+          janitor.run_pass() # or a single synchronous pass
+
+        @remarks
+        The janitor never locks the cache. It keeps an index of the cache
+        tree and processes it in batches of batch_size directory entries.
+        Directories whose modification time did not change since the last
+        pass are not rescanned, so that consecutive passes over large caches
+        remain cheap. Access times recorded in the index are verified before
+        a file is evicted.
+        Directories of retired DiskCache generations (see retire()) are
+        removed in batches before the next regular step.
+    '''
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, cache_dir, max_bytes=0, max_age=0,
+                 batch_size=DEFAULT_JANITOR_BATCH_SIZE):
+        ''' ::param cache_dir: the cache base directory
+            ::param max_bytes: maximum cache size in bytes (0 for no limit)
+            ::param max_age: maximum number of seconds a file may remain
+                             unused (0 for no limit)
+            ::param batch_size: number of directory entries processed per step
+        '''
+        assert scandir, "the janitor requires os.scandir or the scandir package"
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.evicted = 0
+        self.reclaimed = 0
+
+        self._dirs = {}
+        self._total_bytes = 0
+        self._walker = None
+        self._retired = deque()
+        self._reclaiming = set()
+        self._reclaimer = None
+        self._thread = None
+        self._stop = Event()
+        self._wakeup = Event()
+
+    @classmethod
+    def get_instance(cls, cache_dir, max_bytes=0, max_age=0,
+                     interval=DEFAULT_JANITOR_INTERVAL):
+        ''' returns the running janitor for the given cache directory,
+            starting it if necessary. If several caches share a directory,
+            the most restrictive limits apply. '''
+        stricter = lambda a, b: min(a, b) if a and b else a or b
+        with cls._instances_lock:
+            janitor = cls._instances.get(abspath(cache_dir))
+            if janitor is None:
+                janitor = cls(cache_dir, max_bytes, max_age)
+                cls._instances[abspath(cache_dir)] = janitor
+                janitor.start(interval)
+            else:
+                janitor.max_bytes = stricter(janitor.max_bytes, max_bytes)
+                janitor.max_age = stricter(janitor.max_age, max_age)
+            return janitor
+
+    def getCacheSize(self):
+        ''' returns the cache size in bytes as observed by the last scan '''
+        return self._total_bytes
+
+    def getEntryCount(self):
+        ''' returns the number of files observed by the last scan '''
+        return sum(len(state.files) for state in list(self._dirs.values()))
+
+    def retire(self, path):
+        ''' schedules the removal of the given directory (e.g. the entries
+            of a previous DiskCache generation) '''
+        if path not in self._reclaiming:
+            self._reclaiming.add(path)
+            self._retired.append(path)
+            self._wakeup.set()
+
+    def start(self, interval=DEFAULT_JANITOR_INTERVAL):
+        ''' starts the janitor in a daemon thread '''
+        self._stop.clear()
+        self._thread = Thread(target=self._run, args=(interval, ),
+                              name="DiskCacheJanitor(%s)" % self.cache_dir)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' stops the janitor thread '''
+        with self._instances_lock:
+            if self._instances.get(abspath(self.cache_dir)) is self:
+                del self._instances[abspath(self.cache_dir)]
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                if self.step():
+                    self._wait(interval)
+            except Exception as e:
+                log.warning("DiskCacheJanitor(%s): %s", self.cache_dir, e)
+                self._wait(interval)
+
+    def _wait(self, interval):
+        ''' waits for the given interval, for stop() or for retire() '''
+        self._wakeup.wait(interval)
+        self._wakeup.clear()
+
+    def run_pass(self):
+        ''' performs a complete pass over the cache directory '''
+        while not self.step():
+            pass
+
+    def step(self):
+        ''' processes the next batch of directory entries and evicts files
+            if necessary.
+
+            ::returns: True, if the step has completed a pass over the cache
+        '''
+        if self._reclaimer is None and self._retired:
+            self._reclaimer = self._reclaim()
+        if self._reclaimer is not None:
+            for _ in range(self.batch_size):
+                try:
+                    next(self._reclaimer)
+                except StopIteration:
+                    self._reclaimer = None
+                    break
+            return False
+
+        if self._walker is None:
+            self._walker = self._walk()
+
+        completed = True
+        for _ in range(self.batch_size):
+            try:
+                next(self._walker)
+            except StopIteration:
+                break
+        else:
+            completed = False
+
+        if completed:
+            self._walker = None
+            if self.max_age:
+                self._evict_expired()
+        if self.max_bytes and self._total_bytes > self.max_bytes:
+            self._evict_least_recently_used()
+        return completed
+
+    def _walk(self):
+        ''' generator which scans the cache tree and yields after each
+            processed directory entry '''
+        pending = [self.cache_dir]
+        seen = set()
+        while pending:
+            path = pending.pop()
+            seen.add(path)
+            try:
+                mtime = stat(path).st_mtime
+            except OSError:
+                continue
+
+            state = self._dirs.get(path)
+            if state and state.mtime == mtime:
+                pending.extend(state.subdirs)
+                yield
+                continue
+
+            subdirs, files = [], {}
+            try:
+                for entry in scandir(path):
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self._reclaiming:
+                            subdirs.append(entry.path)
+                    # ignore the temporary files of active writers
+                    elif not entry.name.startswith("_"):
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                            files[entry.name] = (max(st.st_atime, st.st_mtime),
+                                                 st.st_size)
+                        except OSError:
+                            pass
+                    yield
+            except OSError:
+                continue
+
+            self._set_directory(path, _DirectoryState(mtime, subdirs, files))
+            pending.extend(subdirs)
+
+        for path in [p for p in self._dirs if p not in seen]:
+            self._set_directory(path, None)
+
+    def _reclaim(self):
+        ''' generator which removes the retired directories and yields
+            after each processed directory entry '''
+        while self._retired:
+            path = self._retired.popleft()
+            for dirpath, _, fnames in walk(path, topdown=False):
+                self._set_directory(dirpath, None)
+                for fname in fnames:
+                    try:
+                        remove(join(dirpath, fname))
+                        self.reclaimed += 1
+                    except OSError:
+                        pass
+                    yield
+                try:
+                    rmdir(dirpath)
+                except OSError:
+                    pass
+                yield
+            self._reclaiming.discard(path)
+
+    def _set_directory(self, path, state):
+        ''' replaces the indexed state of the given directory '''
+        old = self._dirs.pop(path, None)
+        if old:
+            self._total_bytes -= sum(size for _, size in old.files.values())
+        if state:
+            self._dirs[path] = state
+            self._total_bytes += sum(size for _, size in state.files.values())
+
+    def _evict(self, path, fname, atime):
+        ''' removes the given file, unless it has been accessed after atime
+
+            ::returns: True if the file has been removed
+        '''
+        state = self._dirs[path]
+        _, size = state.files.pop(fname)
+        self._total_bytes -= size
+        fpath = join(path, fname)
+        try:
+            st = stat(fpath)
+            current_atime = max(st.st_atime, st.st_mtime)
+            if current_atime > atime:
+                state.files[fname] = (current_atime, st.st_size)
+                self._total_bytes += st.st_size
+                return False
+            remove(fpath)
+        except OSError:
+            return False
+
+        self.evicted += 1
+        return True
+
+    def _evict_expired(self):
+        ''' removes all files which have not been used within max_age '''
+        cutoff = time() - self.max_age
+        for path, state in list(self._dirs.items()):
+            for fname, (atime, _) in list(state.files.items()):
+                if atime < cutoff:
+                    self._evict(path, fname, atime)
+
+    def _evict_least_recently_used(self):
+        ''' removes the least recently used files until the cache size
+            drops below the low water mark '''
+        target = self.max_bytes * JANITOR_LOW_WATER_MARK
+        candidates = [(atime, path, fname)
+                      for path, state in self._dirs.items()
+                      for fname, (atime, _) in state.files.items()]
+        heapify(candidates)
+        while candidates and self._total_bytes > target:
+            atime, path, fname = heappop(candidates)
+            self._evict(path, fname, atime)
+
+
+class _LRUSegment(object):
+    ''' A single lock protected segment of the MemoryCache which keeps its
+        entries in least recently used order.
+
+        @remarks
+        all operations (get, put, evict) are O(1).
+    '''
+    __slots__ = ('max_size', 'max_bytes', 'lock', 'data', 'sizes', 'bytes',
+                 'evicted')
+
+    def __init__(self, max_size=0, max_bytes=0):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.evicted = 0
+
+    def get(self, key):
+        ''' returns the value for the given key and marks it as recently
+            used; raises a KeyError if the key is not available '''
+        with self.lock:
+            obj = self.data.pop(key)
+            self.data[key] = obj
+            return obj
+
+    def put(self, key, obj):
+        ''' stores the given object and evicts the least recently used
+            entries if necessary.
+
+            ::returns: the number of evicted entries
+        '''
+        size = get_object_size(obj) if self.max_bytes else 0
+        with self.lock:
+            if key in self.data:
+                self._pop(key)
+            self.data[key] = obj
+            self.sizes[key] = size
+            self.bytes += size
+            return self._evict()
+
+    def put_if_absent(self, key, obj):
+        ''' stores the given object, unless the key is already available
+
+            ::returns: True if the object has been stored
+        '''
+        size = get_object_size(obj) if self.max_bytes else 0
+        with self.lock:
+            if key in self.data:
+                return False
+            self.data[key] = obj
+            self.sizes[key] = size
+            self.bytes += size
+            self._evict()
+            return True
+
+    def remove(self, key):
+        ''' removes the given key; raises a KeyError if it does not exist '''
+        with self.lock:
+            self._pop(key)
+
+    def newest(self, n=0):
+        ''' returns the n most recently used (key, object) pairs in least
+            recently used order (all pairs if n is 0); only references are
+            copied while holding the lock. '''
+        with self.lock:
+            if not n:
+                return list(self.data.items())
+            items = [(key, self.data[key])
+                     for key in islice(reversed(self.data), n)]
+        items.reverse()
+        return items
+
+    def _pop(self, key):
+        obj = self.data.pop(key)
+        self.bytes -= self.sizes.pop(key)
+        return obj
+
+    def _evict(self):
+        ''' removes least recently used entries until the segment satisfies
+            its size and byte budget (the most recent entry is always kept) '''
+        evicted = 0
+        while len(self.data) > 1 and (
+                (self.max_size and len(self.data) > self.max_size) or
+                (self.max_bytes and self.bytes > self.max_bytes)):
+            key, _ = self.data.popitem(last=False)
+            self.bytes -= self.sizes.pop(key)
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+
 class MemoryCache(Cache):
     '''
-        @class MemoryCached
+        @class MemoryCache
 
         Caches abitrary functions based on the function's arguments (fetch) or
         on a user defined key (fetchObjectId)
-    '''
-    __slots__ = ('max_cache_size', '_cacheData', '_usage')
 
-    def __init__(self, max_cache_size=0, fn=None):
-        ''' initializes the Cache object '''
-        Cache.__init__(self, fn)
-        self._cacheData = {}
-        self._usage = {}
+        @remarks
+        The cache evicts the least recently used entries as soon as either
+        max_cache_size or the approximated max_bytes budget is exceeded.
+        Entries are spread over lock_stripes independent segments, which
+        allows threads to share a single instance without contending on one
+        lock. Eviction is performed per segment (i.e. each segment receives
+        an equal share of the cache's budget).
+        If a snapshot_file is given, the cache is restored from the file in
+        a background thread (i.e. without blocking the first requests) and
+        the hottest snapshot_entries entries are written to the file at exit
+        and every snapshot_interval seconds (once the restore has finished).
+    '''
+    __slots__ = ('max_cache_size', 'max_bytes', '_segments', 'snapshot_file',
+                 'snapshot_entries', 'restored')
+
+    def __init__(self, max_cache_size=0, fn=None, max_bytes=0,
+                 lock_stripes=1, key_encoder=None, ttl=0,
+                 stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=(), snapshot_file=None,
+                 snapshot_entries=0, snapshot_interval=0):
+        ''' initializes the Cache object
+            ::param max_cache_size: maximum number of cached entries (0 for
+                                    an unbounded cache)
+            ::param fn: function to cache (optional)
+            ::param max_bytes: optional budget for the approximated size of
+                               the cached objects in bytes (0 for no limit)
+            ::param lock_stripes: number of independently locked segments
+            ::param key_encoder: optional KeyEncoder for computing object ids
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+            ::param snapshot_file: optional file for persisting the cache
+            ::param snapshot_entries: maximum number of entries written to
+                                      the snapshot (0 for all entries)
+            ::param snapshot_interval: optional number of seconds between two
+                                       snapshots (in addition to the one at
+                                       exit)
+        '''
+        Cache.__init__(self, fn, key_encoder, ttl, stale_while_revalidate,
+                       negative_ttl, negative_exceptions)
         self.max_cache_size = max_cache_size
+        self.max_bytes = max_bytes
+        lock_stripes = max(1, lock_stripes)
+        if max_cache_size:
+            lock_stripes = min(lock_stripes, max_cache_size)
+
+        share = lambda budget: budget and max(1, budget // lock_stripes)
+        self._segments = [_LRUSegment(share(max_cache_size), share(max_bytes))
+                          for _ in range(lock_stripes)]
+
+        self.snapshot_file = snapshot_file
+        self.snapshot_entries = snapshot_entries
+        # set once the snapshot has been restored
+        self.restored = Event()
+        if snapshot_file:
+            self._start_thread(self.restore, "restore")
+            _flush_at_exit(self)
+            if snapshot_interval:
+                self._start_thread(self._snapshot_periodically, "snapshot",
+                                   snapshot_interval)
+        else:
+            self.restored.set()
 
-    def fetch(self, fetch_function, *args, **kargs):
-        key = self.getKey(*args, **kargs)
-        return self.fetchObjectId(key, fetch_function, *args, **kargs)
+    def snapshot(self, fname=None, max_entries=None):
+        ''' writes the hottest entries in least recently used order to the
+            given file
 
-    def fetchObjectId(self, key, fetch_function, *args, **kargs):
-        # update the object's last usage time stamp
-        key = self.getObjectId(key)
-        self._usage[key] = time()
+            ::param fname: the snapshot file (default: snapshot_file)
+            ::param max_entries: maximum number of entries to write
+                                 (default: snapshot_entries)
+            ::returns: the number of written entries
+        '''
+        fname = WritePickleIterator.get_filename(fname or self.snapshot_file)
+        max_entries = self.snapshot_entries if max_entries is None \
+            else max_entries
+        share = max_entries and max(1, max_entries // len(self._segments))
+
+        temp_file = WritePickleIterator.get_filename(
+            get_unique_temp_file(fname))
+        written = 0
+        with WritePickleIterator(temp_file) as w:
+            for segment in self._segments:
+                for obj_id, entry in segment.newest(share):
+                    try:
+                        w.dump((obj_id, entry))
+                        written += 1
+                    except Exception as e:
+                        log.debug("Cannot snapshot entry %s: %s", obj_id, e)
+
+        # the index first, so that readers never see data without index
+        replace(temp_file + INDEX_SUFFIX, fname + INDEX_SUFFIX)
+        replace(temp_file, fname)
+        return written
+
+    def restore(self, fname=None):
+        ''' loads the entries of the given snapshot file; entries which
+            are already cached are kept
+
+            ::param fname: the snapshot file (default: snapshot_file)
+            ::returns: the number of restored entries
+        '''
+        fname = WritePickleIterator.get_filename(fname or self.snapshot_file)
+        restored = 0
+        try:
+            if not exists(fname):
+                return restored
+            now = time()
+            with ReadPickleIterator(fname) as r:
+                for obj_id, entry in r:
+                    if type(entry) is _Entry and \
+                            entry.expires + self.stale_while_revalidate <= now:
+                        continue
+                    if self._get_segment(obj_id).put_if_absent(obj_id,
+                                                               entry):
+                        restored += 1
+        except Exception as e:
+            log.warning("Cannot restore snapshot %s: %s", fname, e)
+        finally:
+            self.restored.set()
+        return restored
+
+    def flush(self):
+        ''' writes a snapshot to the snapshot_file (if set) '''
+        if self.snapshot_file:
+            self._try_snapshot()
+
+    def _try_snapshot(self):
+        ''' writes a snapshot, logging rather than raising errors; the
+            snapshot is skipped if it has not been restored yet, since
+            this would overwrite it with a partial cache. '''
+        if not self.restored.is_set():
+            log.warning("Skipping snapshot %s, since it has not been "
+                        "restored yet.", self.snapshot_file)
+            return
+        try:
+            self.snapshot()
+        except Exception as e:
+            log.warning("Cannot write snapshot %s: %s", self.snapshot_file, e)
+
+    def _snapshot_periodically(self, interval):
+        self.restored.wait()
+        while True:
+            sleep(interval)
+            self._try_snapshot()
+
+    def _start_thread(self, target, name, *args):
+        t = Thread(target=target, args=args,
+                   name="MemoryCache %s (%s)" % (name, self.snapshot_file))
+        t.daemon = True
+        t.start()
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        segment = self._get_segment(obj_id)
         try:
-            return self._cacheData[key]
+            obj = self._check_entry(segment.get(obj_id), obj_id,
+                                    partial(segment.put, obj_id),
+                                    fetch_function, args, kargs)
+            if obj is not _MISSING:
+                return obj
         except KeyError:
-            obj = fetch_function(*args, **kargs)
-            if obj != None:
-                self.garbage_collect_cache()
-                self._cacheData[key] = obj
-            return obj
+            pass
+
+        entry, cacheable = self._call(fetch_function, args, kargs)
+        if cacheable:
+            segment.put(obj_id, entry)
+        return _get_value(entry)
+
+    def _lookup(self, obj_id):
+        try:
+            return self._valid(self._get_segment(obj_id).get(obj_id))
+        except KeyError:
+            return _MISSING
+
+    def _store(self, obj_id, obj):
+        self._get_segment(obj_id).put(obj_id, self._get_entry(obj))
+
+    def _store_many(self, items):
+        for obj_id, entry in items:
+            self._get_segment(obj_id).put(obj_id, entry)
+
+    def _delete(self, obj_id):
+        try:
+            self._get_segment(obj_id).remove(obj_id)
+            return True
+        except KeyError:
+            return False
 
     def __contains__(self, key):
         ''' returns whether the key is already stored in the cache '''
-        return self.getObjectId(key) in self._cacheData
+        obj_id = self._object_id(key)
+        return obj_id in self._get_segment(obj_id).data
 
     def __delitem__(self, key):
         ''' removes the given item from the cache '''
-        del self._cacheData[self.getObjectId(key)]
+        obj_id = self._object_id(key)
+        self._get_segment(obj_id).remove(obj_id)
 
-    def garbage_collect_cache(self):
-        ''' removes the object which have not been in use for the
-            longest time '''
-        if self.max_cache_size == 0 or len(self._cacheData) <= self.max_cache_size:
-            return
+    def __len__(self):
+        return sum(len(segment.data) for segment in self._segments)
+
+    def getCacheSize(self):
+        ''' returns the approximated size of all cached objects in bytes
+            (only tracked if max_bytes has been set) '''
+        return sum(segment.bytes for segment in self._segments)
 
-        (key, _) = sorted(self._usage.items(), key=itemgetter(1), reverse=True).pop()
-        del self._usage[key]
-        del self._cacheData[key]
+    def _get_metrics_gauges(self):
+        gauges = Cache._get_metrics_gauges(self)
+        gauges['entries'] = len(self)
+        gauges['evictions'] = sum(segment.evicted
+                                  for segment in self._segments)
+        return gauges
+
+    def _get_segment(self, obj_id):
+        ''' returns the segment responsible for the given object id '''
+        if len(self._segments) == 1:
+            return self._segments[0]
+        return self._segments[int(obj_id[:8], 16) % len(self._segments)]
 
 
 class MemoryCached(MemoryCache):
@@ -306,16 +1946,38 @@ class MemoryCached(MemoryCache):
         usage:
           @MemoryCached or @MemoryCached(max_cache_size)
           def myfunction(*args):            ...
+
+          @MemoryCached(10000, max_bytes=2**26, lock_stripes=16)
+          def myfunction(*args):            ...
     '''
-    def __init__(self, arg):
+    def __init__(self, arg=0, max_bytes=0, lock_stripes=1, key_encoder=None,
+                 ttl=0, stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=(), snapshot_file=None,
+                 snapshot_entries=0, snapshot_interval=0):
         ''' initializes the MemoryCache object
             ::param arg: either the max_cache_size or the function to call
+            ::param max_bytes: optional byte budget (see MemoryCache)
+            ::param lock_stripes: number of independently locked segments
+            ::param key_encoder: optional KeyEncoder
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+            ::param snapshot_file, snapshot_entries, snapshot_interval:
+                    persistence settings (see MemoryCache)
         '''
         if hasattr(arg, '__call__'):
             MemoryCache.__init__(self)
             self._fn = arg
         else:
-            MemoryCache.__init__(self, max_cache_size=arg)
+            MemoryCache.__init__(self, max_cache_size=arg,
+                                 max_bytes=max_bytes,
+                                 lock_stripes=lock_stripes,
+                                 key_encoder=key_encoder, ttl=ttl,
+                                 stale_while_revalidate=stale_while_revalidate,
+                                 negative_ttl=negative_ttl,
+                                 negative_exceptions=negative_exceptions,
+                                 snapshot_file=snapshot_file,
+                                 snapshot_entries=snapshot_entries,
+                                 snapshot_interval=snapshot_interval)
             self._fn = None
 
     def __call__(self, *args, **kargs):
@@ -328,62 +1990,1345 @@ class MemoryCached(MemoryCache):
             return self.fetch(self._fn, *args, **kargs)
 
 
-class IterableCache(DiskCache):
-    ''' caches arbitrary iterable content identified by an identifier '''
+class SharedMemoryCache(Cache):
+    ''' @class SharedMemoryCache
+        A fixed-size memory cache shared by all processes of a host (e.g.
+        the workers of a multiprocessing.Pool).
+
+        usage:
+          cache = SharedMemoryCache(max_bytes=2**26)
+          pool = Pool(8)          # forked workers share the cache
+
+          @SharedMemoryCached("/dev/shm/lev.cache")
+          def lev(s1, s2): ...
+
+        @remarks
+        The cache is an open addressing hash table in a memory-mapped file
+        (created in SHARED_MEMORY_DIR, if no shm_file is given). Objects are
+        stored pickled, i.e. every hit deserializes the object.
+        Reads do not acquire any locks; records are validated by their
+        checksum and a generation counter, which writers increment while
+        clearing the table. Writes are serialized by a file lock (fcntl, if
+        available; every process opens its own lock file descriptor, since
+        forked processes would otherwise share the parent's lock) and
+        append records to the data area. Once the data area
+        or the hash table is full, the whole cache is cleared.
+        Forked processes share the cache; independently started processes
+        share it if they use the same shm_file.
+
+        Layout (little endian):
+          header:  SHARED_MAGIC, number of slots, generation, data end,
+                   number of entries, used slots
+          index:   (key hash, record offset) slots; the offset 0 marks empty
+                   and _SHARED_DELETED deleted slots
+          records: key length, value length, crc32, key, value (pickled)
+    '''
+
+    def __init__(self, shm_file=None, max_bytes=DEFAULT_SHARED_BYTES,
+                 slots=DEFAULT_SHARED_SLOTS, fn=None, key_encoder=None,
+                 ttl=0, stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=()):
+        ''' ::param shm_file: the file holding the cache (default: a
+                               temporary file removed at exit)
+            ::param max_bytes: size of the data area in bytes
+            ::param slots: number of hash table slots
+            ::param fn: function to cache (optional)
+            ::param key_encoder: optional KeyEncoder for computing object ids
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+
+            @remarks
+            max_bytes and slots are ignored for existing shm_files.
+        '''
+        Cache.__init__(self, fn, key_encoder, ttl, stale_while_revalidate,
+                       negative_ttl, negative_exceptions)
+        self._owner = None
+        if shm_file is None:
+            fd, shm_file = mkstemp(
+                prefix="ewrt-cache-",
+                dir=SHARED_MEMORY_DIR if exists(SHARED_MEMORY_DIR) else None)
+            close(fd)
+            self._owner = getpid()
+            atexit.register(self._remove)
+        self.shm_file = shm_file
+        self.max_bytes = max_bytes
+        self.slots = slots
+        self._evicted = 0
+        self._init_state()
+
+    def _init_state(self):
+        ''' maps the shared file into memory (initializing new files) '''
+        self._fd = os_open(self.shm_file, O_RDWR | O_CREAT, 0o600)
+        self._pid = None
+        self._acquire()
+        try:
+            size = fstat(self._fd).st_size
+            if size:
+                self._data = mmap(self._fd, size)
+                if self._data[:len(SHARED_MAGIC)] != SHARED_MAGIC:
+                    raise ValueError("%s is not a shared memory cache." %
+                                     self.shm_file)
+                self._slots = self._get_header()[0]
+            else:
+                self._slots = self.slots
+                size = self._get_data_start() + self.max_bytes
+                ftruncate(self._fd, size)
+                self._data = mmap(self._fd, size)
+                self._data[:len(SHARED_MAGIC)] = SHARED_MAGIC
+                self._set_header(self._slots, 0, self._get_data_start(), 0, 0)
+        finally:
+            self._release()
+        self._size = size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_metrics', None)
+        for attr in ('_lock', '_lock_fd', '_pid', '_fd', '_data', '_slots',
+                     '_size'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def close(self):
+        self._data.close()
+        if self._pid == getpid():
+            close(self._lock_fd)
+        close(self._fd)
+
+    def _remove(self):
+        ''' removes the temporary shm_file created by this process '''
+        if self._owner != getpid():
+            return
+        try:
+            self.close()
+            remove(self.shm_file)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _acquire(self):
+        if self._pid != getpid():
+            # flock() locks are shared by all duplicates of a file descriptor
+            # (including the ones inherited by forked processes)
+            self._lock = Lock()
+            self._lock_fd = os_open(self.shm_file, O_RDWR)
+            self._pid = getpid()
+        self._lock.acquire()
+        if flock is not None:
+            flock(self._lock_fd, LOCK_EX)
+
+    def _release(self):
+        if flock is not None:
+            flock(self._lock_fd, LOCK_UN)
+        self._lock.release()
+
+    def _get_header(self):
+        return _SHARED_HEADER.unpack_from(self._data, len(SHARED_MAGIC))
+
+    def _set_header(self, *header):
+        _SHARED_HEADER.pack_into(self._data, len(SHARED_MAGIC), *header)
+
+    def _get_data_start(self):
+        return len(SHARED_MAGIC) + _SHARED_HEADER.size + \
+            self._slots * _PACK_SLOT.size
+
+    def _get_slot_offset(self, slot):
+        return len(SHARED_MAGIC) + _SHARED_HEADER.size + \
+            slot * _PACK_SLOT.size
+
+    def _read_record(self, offset, key):
+        ''' returns the record's value, if it is valid and stores the given
+            key (None otherwise) '''
+        if offset + _SHARED_RECORD.size > self._size:
+            return None
+        key_len, value_len, checksum = _SHARED_RECORD.unpack_from(self._data,
+                                                                  offset)
+        start = offset + _SHARED_RECORD.size
+        end = start + key_len + value_len
+        if key_len != len(key) or end > self._size:
+            return None
+        record = self._data[start:end]
+        if record[:key_len] != key or crc32(record) & 0xffffffff != checksum:
+            return None
+        return record[key_len:]
+
+    def _find(self, key, key_hash):
+        ''' ::returns: the tuple (slot, value) of the given key or
+                       (None, None), if the key is not cached '''
+        slot = key_hash % self._slots
+        for _ in range(self._slots):
+            slot_hash, offset = _PACK_SLOT.unpack_from(
+                self._data, self._get_slot_offset(slot))
+            if not offset:
+                break
+            if slot_hash == key_hash and offset != _SHARED_DELETED:
+                value = self._read_record(offset, key)
+                if value is not None:
+                    return slot, value
+            slot = (slot + 1) % self._slots
+        return None, None
+
+    def _get(self, obj_id):
+        ''' returns the pickled entry or None '''
+        key = obj_id.encode("utf-8") if isinstance(obj_id, _text_type) \
+            else obj_id
+        generation = self._get_header()[1]
+        # the cache is being cleared
+        if generation & 1:
+            return None
+        value = self._find(key, _get_pack_hash(key))[1]
+        if self._get_header()[1] != generation:
+            return None
+        return value
+
+    def _put(self, obj_id, entry):
+        ''' stores the given entry '''
+        key = obj_id.encode("utf-8") if isinstance(obj_id, _text_type) \
+            else obj_id
+        try:
+            value = dumps(entry, HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.debug("Cannot pickle entry %s: %s", obj_id, e)
+            return
+        record_size = _SHARED_RECORD.size + len(key) + len(value)
+        if self._get_data_start() + record_size > self._size:
+            return
+
+        key_hash = _get_pack_hash(key)
+        self._acquire()
+        try:
+            slots, generation, end, entries, used = self._get_header()
+            if end + record_size > self._size or \
+                    used + 1 > slots * SHARED_LOAD_FACTOR:
+                self._clear()
+                slots, generation, end, entries, used = self._get_header()
+
+            slot, _ = self._find(key, key_hash)
+            if slot is None:
+                slot = self._get_free_slot(key_hash)
+                if slot is None:
+                    # the used slots counter does not match the table
+                    self._clear()
+                    slots, generation, end, entries, used = \
+                        self._get_header()
+                    slot = self._get_free_slot(key_hash)
+                offset = _PACK_SLOT.unpack_from(
+                    self._data, self._get_slot_offset(slot))[1]
+                entries += 1
+                used += not offset
+
+            record = key + value
+            _SHARED_RECORD.pack_into(self._data, end, len(key), len(value),
+                                     crc32(record) & 0xffffffff)
+            self._data[end + _SHARED_RECORD.size:end + record_size] = record
+            # publish the record once it has been written completely
+            _PACK_SLOT.pack_into(self._data, self._get_slot_offset(slot),
+                                 key_hash, end)
+            self._set_header(slots, generation, end + record_size, entries,
+                             used)
+            self._bytes_written += len(value)
+        finally:
+            self._release()
+
+    def _get_free_slot(self, key_hash):
+        ''' returns the first empty or deleted slot for the given hash (None,
+            if the table is full) '''
+        slot = key_hash % self._slots
+        for _ in range(self._slots):
+            offset = _PACK_SLOT.unpack_from(self._data,
+                                            self._get_slot_offset(slot))[1]
+            if offset in (0, _SHARED_DELETED):
+                return slot
+            slot = (slot + 1) % self._slots
+        return None
+
+    def _clear(self):
+        ''' removes all entries (requires the lock) '''
+        slots, generation, end, entries, used = self._get_header()
+        self._set_header(slots, generation + 1, end, entries, used)
+        index_start = self._get_slot_offset(0)
+        data_start = self._get_data_start()
+        self._data[index_start:data_start] = b"\0" * (data_start - index_start)
+        self._set_header(slots, generation + 2, data_start, 0, 0)
+        self._evicted += entries
+
+    def clear(self):
+        ''' removes all entries from the cache '''
+        self._acquire()
+        try:
+            self._clear()
+        finally:
+            self._release()
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        data = self._get(obj_id)
+        if data is not None:
+            obj = self._check_entry(loads(data), obj_id,
+                                    partial(self._put, obj_id),
+                                    fetch_function, args, kargs)
+            if obj is not _MISSING:
+                self._cache_hit += 1
+                self._bytes_read += len(data)
+                return obj
+
+        self._cache_miss += 1
+        entry, cacheable = self._call(fetch_function, args, kargs)
+        if cacheable:
+            self._put(obj_id, entry)
+        return _get_value(entry)
+
+    def _lookup(self, obj_id):
+        data = self._get(obj_id)
+        if data is None:
+            return _MISSING
+        self._bytes_read += len(data)
+        return self._valid(loads(data))
+
+    def _store(self, obj_id, obj):
+        self._put(obj_id, self._get_entry(obj))
+
+    def _store_many(self, items):
+        for obj_id, entry in items:
+            self._put(obj_id, entry)
+
+    def _delete(self, obj_id):
+        key = obj_id.encode("utf-8") if isinstance(obj_id, _text_type) \
+            else obj_id
+        self._acquire()
+        try:
+            slot, _ = self._find(key, _get_pack_hash(key))
+            if slot is None:
+                return False
+            slots, generation, end, entries, used = self._get_header()
+            _PACK_SLOT.pack_into(self._data, self._get_slot_offset(slot),
+                                 0, _SHARED_DELETED)
+            self._set_header(slots, generation, end, entries - 1, used)
+            return True
+        finally:
+            self._release()
+
+    def __contains__(self, key):
+        ''' returns whether the key is already stored in the cache '''
+        return self._get(self._object_id(key)) is not None
+
+    def __delitem__(self, key):
+        ''' removes the given item from the cache '''
+        if not self._delete(self._object_id(key)):
+            raise KeyError(key)
+
+    def __len__(self):
+        return self._get_header()[3]
+
+    def getCacheSize(self):
+        ''' returns the number of bytes used by the data area '''
+        return self._get_header()[2] - self._get_data_start()
+
+    def _get_metrics_gauges(self):
+        gauges = Cache._get_metrics_gauges(self)
+        gauges['entries'] = len(self)
+        gauges['evictions'] = self._evicted
+        return gauges
+
+    def getCacheStatistics(self):
+        ''' returns statistics regarding the cache's hit/miss ratio '''
+        return {'cache_hits': self._cache_hit, 'cache_misses': self._cache_miss}
+
+
+class SharedMemoryCached(object):
+    ''' Decorator based on SharedMemoryCache for caching arbitrary function
+        calls across processes
+        usage:
+          @SharedMemoryCached()
+          def myfunction(*args):
+    '''
+    __slots__ = ('cache', )
+
+    def __init__(self, shm_file=None, max_bytes=DEFAULT_SHARED_BYTES,
+                 slots=DEFAULT_SHARED_SLOTS, key_encoder=None, ttl=0,
+                 stale_while_revalidate=0, negative_ttl=0,
+                 negative_exceptions=()):
+        ''' initializes the SharedMemoryCache object
+            ::param shm_file:  the file holding the cache (optional)
+            ::param max_bytes: size of the data area in bytes
+            ::param slots:     number of hash table slots
+            ::param key_encoder: optional KeyEncoder
+            ::param ttl, stale_while_revalidate, negative_ttl,
+                    negative_exceptions: expiry settings (see Cache)
+        '''
+        self.cache = SharedMemoryCache(
+            shm_file, max_bytes, slots, key_encoder=key_encoder, ttl=ttl,
+            stale_while_revalidate=stale_while_revalidate,
+            negative_ttl=negative_ttl,
+            negative_exceptions=negative_exceptions)
+
+    def __call__(self, fn):
+        self.cache.fn = fn
+        return self.cache
+
+
+class cached_method(object):
+    ''' Decorator for caching methods
+        usage:
+          class Gazetteer(object):
+              @cached_method
+              def getIdFromName(self, name): ...
 
-    def __iter__(self):
+              @cached_method(max_cache_size=10000, shared=True)
+              def getCountryName(self, code): ...
+
+        @remarks
+        Every instance uses its own bounded MemoryCache, which is discarded
+        together with the instance (the instances are only referenced
+        weakly). Keys are computed from the method's arguments without self,
+        i.e. instances neither need a stable repr nor are hashed on every
+        call. Setting shared=True (or passing a cache) declares that the
+        method's result does not depend on the instance, so that all
+        instances share a single cache.
+        Decorated methods are called like ordinary methods; accessing them
+        through the class (e.g. Gazetteer.getIdFromName(g, name)) is
+        supported as well.
+    '''
+
+    def __init__(self, arg=None, max_cache_size=DEFAULT_METHOD_CACHE_SIZE,
+                 shared=False, cache=None, **kargs):
+        ''' ::param arg: the method (if used without arguments)
+            ::param max_cache_size: maximum number of entries per instance
+            ::param shared: share one cache between all instances
+            ::param cache: optional cache shared by all instances (e.g. a
+                           DiskCache); implies shared
+            ::param kargs: further MemoryCache arguments (e.g. ttl)
+        '''
+        self.max_cache_size = max_cache_size
+        self.kargs = kargs
+        self.cache = cache
+        if shared and cache is None:
+            self.cache = MemoryCache(max_cache_size, **kargs)
+        # id(instance) -> (weak reference to the instance, cache)
+        self._caches = {}
+        self._lock = Lock()
+        self.fn = None
+        if hasattr(arg, '__call__'):
+            self._wrap(arg)
+
+    def _wrap(self, fn):
+        self.fn = fn
+        update_wrapper(self, fn)
+        if self.cache is not None:
+            self.cache.fn = fn
         return self
 
-    def fetchObjectId(self, key, function, *args, **kargs):
-        ''' fetches the object with the given id, querying
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return partial(self.__call__, instance)
+
+    def __call__(self, *args, **kargs):
+        if self.fn is None:
+            return self._wrap(args[0])
+
+        instance, args = args[0], args[1:]
+        cache = self.get_cache(instance)
+        return cache._record(cache.getCallObjectId(args, kargs),
+                             partial(self.fn, instance), args, kargs)
+
+    def get_cache(self, instance):
+        ''' returns the cache used for the given instance '''
+        if self.cache is not None:
+            return self.cache
+
+        instance_id = id(instance)
+        entry = self._caches.get(instance_id)
+        if entry is not None and entry[0]() is instance:
+            return entry[1]
+
+        with self._lock:
+            entry = self._caches.get(instance_id)
+            if entry is None or entry[0]() is not instance:
+                def discard(instance_ref, instance_id=instance_id):
+                    if self._caches.get(instance_id, (None, ))[0] \
+                            is instance_ref:
+                        del self._caches[instance_id]
+
+                cache = MemoryCache(self.max_cache_size, **self.kargs)
+                cache.fn = self.fn
+                entry = self._caches[instance_id] = (ref(instance, discard),
+                                                     cache)
+        return entry[1]
+
+
+class IterableCache(DiskCache):
+    ''' caches arbitrary iterable content identified by an identifier
+
+        usage:
+          cache = IterableCache("./cache", resume_argument="offset")
+          for item in cache.fetch(crawl, url):
+              ...
+
+        @remarks
+        Elements are written to a partial cache file, which is committed
+        atomically once the iterator has been exhausted. The partial file
+        is checkpointed every checkpoint_interval elements and kept if the
+        iterator fails or the consumer stops early. Subsequent requests
+        return the cached prefix first and then continue with the live
+        iterator. If resume_argument is set, the number of cached elements
+        is passed to the function as this keyword argument; otherwise the
+        function is called again and the cached prefix is skipped.
+        Partial files are locked (using fcntl, if available), so that only
+        one consumer extends them.
+        Accesses are not recorded in the metrics registry, since the
+        returned iterators are consumed lazily.
+    '''
+    metrics_registry = None
+
+    def __init__(self, cache_dir, cache_nesting_level=0, cache_file_suffix="",
+                 fn=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 resume_argument=None, **kargs):
+        ''' initializes the Cache object
+            ::param cache_dir, cache_nesting_level, cache_file_suffix, fn:
+                    see DiskCache
+            ::param checkpoint_interval: number of elements after which the
+                                         partial cache file is checkpointed
+            ::param resume_argument: optional name of the keyword argument
+                                     used to pass the resume position
+            ::param kargs: further DiskCache parameters
+        '''
+        DiskCache.__init__(self, cache_dir, cache_nesting_level,
+                           cache_file_suffix, fn, **kargs)
+        self.checkpoint_interval = checkpoint_interval
+        self.resume_argument = resume_argument
+
+    def _fetch(self, obj_id, function, args, kargs):
+        ''' returns an iterator over the object with the given id, querying
              a) the cache and
              b) the function
             if the function is called, the functions result is saved
             in the cache
 
-            ::param key:      key to fetch
+            ::param obj_id:   object id to fetch
             ::param function: function to call if the result is not in the cache
             ::param args:     arguments
             ::param kargs:    optional keyword arguments
 
-            ::returns: the object (retrieved from the cache or computed)
+            ::returns: an iterator over the object's elements
         '''
-        cache_file = self._get_fname(self.getObjectId(key))
-
+        cache_file = self._get_fname(obj_id)
         if exists(cache_file):
-            self._cached = True
-            self._pickle_iterator = ReadPickleIterator(cache_file)
-        else:
-            self._fetch_function_iterator = function(*args, **kargs).__iter__()
-            self._cached = False
-            self._pickle_iterator = WritePickleIterator(cache_file)
+            return self._read(cache_file)
+        return self._cache(cache_file, function, args, kargs)
 
-        return self
+    def _get_fname(self, obj_id):
+        return WritePickleIterator.get_filename(
+            DiskCache._get_fname(self, obj_id))
+
+    def _read(self, cache_file):
+        ''' returns the elements of a committed cache file '''
+        with ReadPickleIterator(cache_file) as r:
+            for obj in r:
+                self._cache_hit += 1
+                yield obj
+
+    def _cache(self, cache_file, function, args, kargs):
+        ''' returns the cached prefix followed by the elements of the
+            live iterator, which are written to the partial cache file '''
+        partial_file = cache_file[:-3] + ".partial.gz"
+        lock = self._lock_partial(partial_file)
+        if lock is None:
+            # another consumer extends the partial file
+            for obj in function(*args, **kargs):
+                self._cache_miss += 1
+                yield obj
+            return
 
+        writer = None
+        try:
+            writer = WritePickleIterator(partial_file, append=True)
+            resume_position = len(writer)
+            if resume_position:
+                with ReadPickleIterator(partial_file) as r:
+                    for obj in islice(r, resume_position):
+                        self._cache_hit += 1
+                        yield obj
+
+            if self.resume_argument:
+                kargs = dict(kargs)
+                kargs[self.resume_argument] = resume_position
+                iterator = iter(function(*args, **kargs))
+            else:
+                iterator = islice(function(*args, **kargs), resume_position,
+                                  None)
+
+            for obj in iterator:
+                self._cache_miss += 1
+                writer.dump(obj)
+                if len(writer) % self.checkpoint_interval == 0:
+                    writer.checkpoint()
+                yield obj
+
+            # commit the cache file (the index first, so that readers never
+            # see the data without index)
+            writer.close()
+            replace(partial_file + INDEX_SUFFIX, cache_file + INDEX_SUFFIX)
+            replace(partial_file, cache_file)
+            self._remove(partial_file + ".lock")
+        finally:
+            if writer is not None:
+                writer.close()
+            lock.close()
 
-    def next(self):
-        return self._read_next_element() if self._cached else self._cache_next_element()
+    @staticmethod
+    def _lock_partial(partial_file):
+        ''' ::returns: the locked lock file or None if the partial file is
+                       locked by another consumer '''
+        lock = open(partial_file + ".lock", "a")
+        if flock is None:
+            return lock
+        try:
+            flock(lock.fileno(), LOCK_EX | LOCK_NB)
+            return lock
+        except (IOError, OSError):
+            lock.close()
+            return None
+
+
+class SQLiteCache(Cache):
+    ''' @class SQLiteCache
+        Caches abitrary functions based on the function's arguments (fetch) or
+        on a user defined key (fetchObjectId) in a single SQLite database.
+
+        @remarks
+        The database uses SQLite's write-ahead log, so that readers do not
+        block writers. New entries are buffered and written in batches of
+        batch_size entries (or after batch_interval seconds); call flush()
+        to persist them immediately. Pending entries are flushed when the
+        cache is garbage collected and at exit (including the exit of
+        multiprocessing workers, but not of workers killed by
+        Pool.terminate()).
+        This cache may be shared between threads and processes.
+    '''
 
-    def _cache_next_element(self):
-        ''' a) retrieves the next element from the fetch function
-            b) writes the data to the cache
-            c) passes the data through to the calling element
+    def __init__(self, db_file, fn=None, batch_size=DEFAULT_SQLITE_BATCH_SIZE,
+                 batch_interval=DEFAULT_SQLITE_BATCH_INTERVAL,
+                 timeout=DEFAULT_SQLITE_TIMEOUT, key_encoder=None):
+        ''' initializes the Cache object
+            ::param db_file: the SQLite database file
+            ::param fn: function to cache (optional)
+            ::param batch_size: number of entries to buffer before writing
+            ::param batch_interval: maximum number of seconds an entry is
+                                    buffered
+            ::param timeout: seconds to wait for locks held by other processes
+            ::param key_encoder: optional KeyEncoder for computing object ids
         '''
+        Cache.__init__(self, fn, key_encoder)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+
+        self._cache_hit = 0
+        self._cache_miss = 0
+        self._init_state()
+        self._get_connection()
+
+    def _init_state(self):
+        ''' initializes the per process state of the cache '''
+        self._local = local()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = {}
+        self._flushing = {}
+        self._pending_since = None
+        self._pid = getpid()
+        _flush_at_exit(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_metrics', None)
+        for attr in ('_local', '_lock', '_flush_lock', '_pending',
+                     '_flushing', '_pending_since', '_pid'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def __del__(self):
+        # e.g. the copies unpickled by multiprocessing workers
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def _get_connection(self):
+        ''' returns the current thread's database connection '''
+        conn = getattr(self._local, 'conn', None)
+        # connections must not be shared with forked processes
+        if conn is None or self._local.pid != getpid():
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                             "(id TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = getpid()
+        return conn
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        blob = self._get(obj_id)
+        if blob is not None:
+            obj = self._valid(loads(blob))
+            if obj is not _MISSING:
+                self._cache_hit += 1
+                self._bytes_read += len(blob)
+                return obj
+
         self._cache_miss += 1
+        obj = fetch_function(*args, **kargs)
+
+        # Do not cache None
+        if obj == None:
+            return obj
+
+        self._put(obj_id, dumps(obj, HIGHEST_PROTOCOL))
+        return obj
+
+    def _lookup(self, obj_id):
+        blob = self._get(obj_id)
+        if blob is None:
+            return _MISSING
+        self._bytes_read += len(blob)
+        return self._valid(loads(blob))
+
+    def _store(self, obj_id, obj):
+        self._put(obj_id, dumps(obj, HIGHEST_PROTOCOL))
+
+    def _delete(self, obj_id):
+        self.flush()
+        conn = self._get_connection()
+        with conn:
+            return conn.execute("DELETE FROM cache WHERE id=?",
+                                (obj_id, )).rowcount > 0
+
+    def __contains__(self, key):
+        ''' returns whether the key is already stored in the cache '''
+        return self._get(self._object_id(key)) is not None
+
+    def __delitem__(self, key):
+        ''' removes the given item from the cache '''
+        if not self._delete(self._object_id(key)):
+            raise KeyError(key)
+
+    def __len__(self):
+        self.flush()
+        return self._get_connection().execute(
+            "SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _get(self, obj_id):
+        ''' returns the serialized object or None '''
+        with self._lock:
+            blob = self._pending.get(obj_id) or self._flushing.get(obj_id)
+        if blob is not None:
+            return blob
+
+        row = self._get_connection().execute(
+            "SELECT value FROM cache WHERE id=?", (obj_id, )).fetchone()
+        return bytes(row[0]) if row else None
+
+    def _put(self, obj_id, blob):
+        ''' buffers the given entry and writes the buffer if necessary '''
+        self._bytes_written += len(blob)
+        with self._lock:
+            self._pending[obj_id] = blob
+            if self._pending_since is None:
+                self._pending_since = time()
+                if len(self._pending) < self.batch_size:
+                    self._start_batch()
+            if len(self._pending) < self.batch_size and \
+                    time() - self._pending_since < self.batch_interval:
+                return
+        self.flush()
+
+    def _start_batch(self):
+        ''' ensures that the new batch is written after batch_interval
+            seconds, even if no further entries are added '''
+        # forked processes inherit the cache but not its exit handler
+        if self._pid != getpid():
+            self._pid = getpid()
+            _flush_at_exit(self)
+        if self.batch_interval:
+            timer = Timer(self.batch_interval, _flush_expired_batch,
+                          (ref(self), self._pending_since))
+            timer.daemon = True
+            timer.start()
+
+    def _flush_batch(self, pending_since):
+        ''' writes the batch started at pending_since, if it is still
+            pending '''
+        with self._lock:
+            if self._pending_since != pending_since:
+                return
+        self.flush()
+
+    def put_many(self, items):
+        ''' writes the given (object id, serialized object) pairs in a
+            single transaction '''
+        conn = self._get_connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO cache (id, value) "
+                             "VALUES (?, ?)",
+                             ((obj_id, sqlite3.Binary(blob))
+                              for obj_id, blob in items))
+
+    def flush(self):
+        ''' writes all buffered entries to the database '''
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                self._pending_since = None
+            if self._flushing:
+                self.put_many(self._flushing.items())
+            with self._lock:
+                self._flushing = {}
+
+    def getCacheStatistics(self):
+        ''' returns statistics regarding the cache's hit/miss ratio '''
+        return {'cache_hits': self._cache_hit, 'cache_misses': self._cache_miss}
+
+
+class SQLiteCached(object):
+    ''' Decorator based on SQLiteCache for caching arbitrary function calls
+        usage:
+          @SQLiteCached("./cache/myfunction.db")
+          def myfunction(*args):
+    '''
+    __slots__ = ('cache', )
+
+    def __init__(self, db_file, batch_size=DEFAULT_SQLITE_BATCH_SIZE,
+                 batch_interval=DEFAULT_SQLITE_BATCH_INTERVAL, key_encoder=None):
+        ''' initializes the Cache object
+            ::param db_file:        the SQLite database file
+            ::param batch_size:     number of entries to buffer before writing
+            ::param batch_interval: maximum number of seconds to buffer entries
+            ::param key_encoder:    optional KeyEncoder
+        '''
+        self.cache = SQLiteCache(db_file, batch_size=batch_size,
+                                 batch_interval=batch_interval,
+                                 key_encoder=key_encoder)
+
+    def __call__(self, fn):
+        self.cache.fn = fn
+        return self.cache
+
+
+class _BackgroundWriter(object):
+    ''' performs write operations in a daemon thread '''
+
+    def __init__(self, max_queue_size=DEFAULT_WRITE_QUEUE_SIZE,
+                 backpressure='block'):
+        ''' ::param max_queue_size: maximum number of pending operations
+            ::param backpressure: policy for operations exceeding
+                                  max_queue_size (see BACKPRESSURE_POLICIES)
+        '''
+        self._queue = Queue(max_queue_size)
+        self._lock = Lock()
+        self._thread = None
+        self.backpressure = backpressure
+        self.dropped = 0
+
+    def submit(self, fn, *args):
+        ''' queues fn(*args)
+            ::returns: False if the operation has been dropped
+        '''
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name="eWRT cache writer")
+                self._thread.daemon = True
+                self._thread.start()
+        if self.backpressure == 'block':
+            self._queue.put((fn, args))
+            return True
+
         try:
-            obj = self._fetch_function_iterator.next()
-            self._pickle_iterator.dump(obj)
+            self._queue.put_nowait((fn, args))
+        except Full:
+            if self.backpressure == 'drop':
+                self.dropped += 1
+                return False
+            fn(*args)
+        return True
+
+    def flush(self):
+        ''' blocks until all queued operations have been performed '''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                log.warning("Background cache write failed: %s", e)
+            finally:
+                # do not keep the cache alive while waiting
+                fn = args = None
+                self._queue.task_done()
+
+
+class TieredCache(Cache):
+    ''' @class TieredCache
+        Combines an ordered list of caches (e.g. a MemoryCache in front of
+        a DiskCache in front of a shared SQLiteCache).
+
+        usage:
+          cache = TieredCache([MemoryCache(10000), DiskCache("./cache")])
+          cache.fetch(myfunction, *args)
+
+        @remarks
+        The object id is computed only once and used for all tiers, i.e.
+        the tiers' own key_encoder settings are ignored. Hits are promoted
+        into all faster tiers. Computed objects are written to the first
+        tier immediately and either written through (default) or written
+        behind (write_behind=True) to the slower tiers.
+    '''
+
+    def __init__(self, tiers, fn=None, write_behind=False,
+                 max_queue_size=DEFAULT_WRITE_QUEUE_SIZE, key_encoder=None):
+        ''' ::param tiers: list of caches, ordered from the fastest to the
+                           slowest one
+            ::param fn: function to cache (optional)
+            ::param write_behind: write to the slower tiers in a background
+                                  thread
+            ::param max_queue_size: maximum number of pending background
+                                    writes
+            ::param key_encoder: optional KeyEncoder for computing object ids
+        '''
+        assert tiers
+        Cache.__init__(self, fn, key_encoder)
+        self.tiers = list(tiers)
+        self._tier_hits = [0] * len(self.tiers)
+        self._cache_miss = 0
+        self._writer = None
+        if write_behind:
+            self._writer = _BackgroundWriter(max_queue_size)
+            _flush_at_exit(self)
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        obj = self._lookup(obj_id)
+        if obj is not _MISSING:
             return obj
-        except StopIteration:
-            self._pickle_iterator.close()
-            raise StopIteration
 
+        self._cache_miss += 1
+        obj = fetch_function(*args, **kargs)
+        if obj == None:
+            return obj
+        self._store(obj_id, obj)
+        return obj
+
+    def _lookup(self, obj_id):
+        for no, tier in enumerate(self.tiers):
+            obj = tier._lookup(obj_id)
+            if obj is not _MISSING:
+                self._tier_hits[no] += 1
+                for faster_tier in self.tiers[:no]:
+                    faster_tier._store(obj_id, obj)
+                return obj
+        return _MISSING
+
+    def _store(self, obj_id, obj):
+        self.tiers[0]._store(obj_id, obj)
+        for tier in self.tiers[1:]:
+            if self._writer:
+                self._writer.submit(tier._store, obj_id, obj)
+            else:
+                tier._store(obj_id, obj)
+
+    def _lookup_many(self, obj_ids):
+        ''' queries every tier once for all objects missing in the faster
+            tiers '''
+        result = [_MISSING] * len(obj_ids)
+        missing = list(range(len(obj_ids)))
+        for no, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            found = tier._lookup_many([obj_ids[pos] for pos in missing])
+            hits = [(pos, obj) for pos, obj in zip(missing, found)
+                    if obj is not _MISSING]
+            if hits:
+                self._tier_hits[no] += len(hits)
+                for faster_tier in self.tiers[:no]:
+                    faster_tier._store_many([(obj_ids[pos],
+                                              faster_tier._get_entry(obj))
+                                             for pos, obj in hits])
+                for pos, obj in hits:
+                    result[pos] = obj
+            missing = [pos for pos, obj in zip(missing, found)
+                       if obj is _MISSING]
+        return result
+
+    def _store_many(self, items):
+        for no, tier in enumerate(self.tiers):
+            tier_items = [(obj_id, tier._get_entry(entry))
+                          for obj_id, entry in items]
+            if no and self._writer:
+                self._writer.submit(tier._store_many, tier_items)
+            else:
+                tier._store_many(tier_items)
+
+    def __contains__(self, key):
+        ''' returns whether any tier contains the key '''
+        obj_id = self._object_id(key)
+        return any(tier._lookup(obj_id) is not _MISSING for tier in self.tiers)
+
+    def __delitem__(self, key):
+        ''' removes the given item from all tiers '''
+        self.flush()
+        obj_id = self._object_id(key)
+        if not [tier for tier in self.tiers if tier._delete(obj_id)]:
+            raise KeyError(key)
+
+    def flush(self):
+        ''' blocks until all pending background writes are finished '''
+        if self._writer:
+            self._writer.flush()
+
+    def getCacheStatistics(self):
+        ''' returns statistics regarding the cache's hit/miss ratio,
+            including the hits per tier '''
+        return {'cache_hits': sum(self._tier_hits),
+                'cache_misses': self._cache_miss,
+                'tier_hits': list(self._tier_hits)}
+
+class PackedCache(Cache):
+    ''' @class PackedCache
+        A read-only cache based on an immutable pack file created with
+        pack_disk_cache (or "python -m eWRT.util.cache pack").
+
+        usage:
+          cache = TieredCache([DiskCache("./cache"),
+                               PackedCache("./conceptnet.pack")])
+
+        @remarks
+        The pack is memory-mapped and looked up using its hash index, i.e.
+        lookups neither open files nor read more than the requested entry.
+        Entries are decoded from a memoryview of the pack rather than a
+        copy (python 3 only).
+        Computed objects are not stored, which allows using the
+        PackedCache as the bottom tier of a TieredCache.
+
+        Pack format (little endian):
+          header:  PACK_MAGIC, number of index slots, offset of the index
+          records: key length, value length, key, value (the encoded
+                   DiskCache entry)
+          index:   open addressing hash table of (key hash, record offset)
+                   slots; empty slots have the offset 0
+    '''
 
-    def _read_next_element(self):
-        ''' returns the next element from the cache '''
+    def __init__(self, pack_file, fn=None, key_encoder=None):
+        ''' ::param pack_file: the pack file
+            ::param fn: function to cache (optional)
+            ::param key_encoder: optional KeyEncoder for computing object ids
+                                 (must match the one of the packed DiskCache)
+        '''
+        Cache.__init__(self, fn, key_encoder)
+        self.pack_file = pack_file
+        self._cache_hit = 0
+        self._cache_miss = 0
+        self._init_state()
+
+    def _init_state(self):
+        ''' maps the pack file into memory '''
+        with open(self.pack_file, "rb") as f:
+            self._data = mmap(f.fileno(), 0, access=ACCESS_READ)
+        if self._data[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError("%s is not a cache pack." % self.pack_file)
+        try:
+            self._view = memoryview(self._data)
+        except TypeError:
+            # python 2 does not support memoryviews of mmaps
+            self._view = self._data
+        self._slots, self._index = _PACK_HEADER.unpack_from(self._data,
+                                                            len(PACK_MAGIC))
+        self._length = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_metrics', None)
+        for attr in ('_data', '_view', '_slots', '_index', '_length'):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def close(self):
+        if self._view is not self._data:
+            self._view.release()
+        self._data.close()
+
+    def _get(self, obj_id):
+        ''' returns the encoded entry (a memoryview, if supported) or None '''
+        key = obj_id.encode("utf-8") if isinstance(obj_id, _text_type) \
+            else obj_id
+        key_hash = _get_pack_hash(key)
+        slot = key_hash % self._slots
+        while True:
+            slot_hash, offset = _PACK_SLOT.unpack_from(
+                self._data, self._index + slot * _PACK_SLOT.size)
+            if not offset:
+                return None
+            if slot_hash == key_hash:
+                key_len, value_len = _PACK_RECORD.unpack_from(self._data,
+                                                              offset)
+                start = offset + _PACK_RECORD.size
+                if self._data[start:start + key_len] == key:
+                    start += key_len
+                    return self._view[start:start + value_len]
+            slot = (slot + 1) % self._slots
+
+    def _fetch(self, obj_id, fetch_function, args, kargs):
+        obj = self._lookup(obj_id)
+        if obj is _MISSING:
+            self._cache_miss += 1
+            return fetch_function(*args, **kargs)
+        return obj
+
+    def _lookup(self, obj_id):
+        data = self._get(obj_id)
+        if data is None:
+            return _MISSING
         self._cache_hit += 1
+        self._bytes_read += len(data)
         try:
-            return self._pickle_iterator.next()
-        except IOError:
-            self._pickle_iterator.close()
-            raise StopIteration
+            return self._valid(decode(data))
+        finally:
+            # allows closing the mmap
+            if isinstance(data, memoryview):
+                data.release()
+
+    def _store(self, obj_id, obj):
+        ''' packs are immutable '''
+        pass
+
+    def _delete(self, obj_id):
+        return False
+
+    def __contains__(self, key):
+        ''' returns whether the key is stored in the pack '''
+        return self._get(self._object_id(key)) is not None
+
+    def __len__(self):
+        ''' returns the number of entries in the pack '''
+        if self._length is None:
+            self._length = sum(1 for slot in range(self._slots)
+                               if _PACK_SLOT.unpack_from(
+                                   self._data,
+                                   self._index + slot * _PACK_SLOT.size)[1])
+        return self._length
+
+    def _get_metrics_gauges(self):
+        gauges = Cache._get_metrics_gauges(self)
+        gauges['entries'] = len(self)
+        return gauges
+
+    def getCacheStatistics(self):
+        ''' returns statistics regarding the cache's hit/miss ratio '''
+        return {'cache_hits': self._cache_hit, 'cache_misses': self._cache_miss}
+
+
+def _flush_expired_batch(cache_ref, pending_since):
+    ''' flushes the expired batch of the referenced SQLiteCache (if the
+        cache still exists) '''
+    cache = cache_ref()
+    if cache is not None:
+        cache._flush_batch(pending_since)
+
+
+def _get_pack_hash(key):
+    ''' returns the 64 bit hash of a packed key '''
+    return _PACK_HASH.unpack_from(sha1(key).digest())[0]
+
+
+def _read_lock_owner(lock_file):
+    ''' returns the owner token stored in the given lock file '''
+    with open(lock_file, "rb") as f:
+        return f.read()
+
+
+def _release_lock(lock_file, token):
+    ''' removes the lock file, if it is still owned by the given token '''
+    try:
+        if _read_lock_owner(lock_file) == token:
+            remove(lock_file)
+    except (IOError, OSError):
+        pass
+
+
+def _renew_lease(lock_file, token, interval, done):
+    ''' updates the lock file's modification time every interval seconds
+        until done is set or the lock has been taken over by another
+        process '''
+    while not done.wait(interval):
+        try:
+            if _read_lock_owner(lock_file) != token:
+                return
+            utime(lock_file, None)
+        except (IOError, OSError):
+            return
+
+
+def _iter_cache_files(cache_dir, cache_file_suffix=""):
+    ''' yields the (object id, file name) of all entries of a DiskCache
+        directory '''
+    for dirpath, _, fnames in walk(cache_dir):
+        for fname in fnames:
+            if fname.startswith("_") or not fname.endswith(cache_file_suffix):
+                continue
+            yield fname[:len(fname) - len(cache_file_suffix)], \
+                join(dirpath, fname)
+
+
+def pack_disk_cache(cache_dir, pack_file, cache_file_suffix="",
+                    load_factor=PACK_LOAD_FACTOR):
+    ''' compiles all entries of a DiskCache directory into an immutable
+        pack file (see PackedCache)
+
+        ::param cache_dir: the DiskCache's base directory
+        ::param pack_file: the pack file to create
+        ::param cache_file_suffix: the DiskCache's cache_file_suffix
+        ::param load_factor: maximum fraction of used index slots
+
+        ::returns: the number of packed entries
+    '''
+    slots = []
+    temp_file = get_unique_temp_file(pack_file)
+    with open(temp_file, "wb") as f:
+        f.write(PACK_MAGIC + _PACK_HEADER.pack(0, 0))
+        for obj_id, fname in _iter_cache_files(cache_dir, cache_file_suffix):
+            try:
+                with open(fname, "rb") as cache_file:
+                    value = cache_file.read()
+            except (IOError, OSError) as e:
+                log.warning("Cannot pack cache file %s: %s", fname, e)
+                continue
+            key = obj_id.encode("utf-8")
+            slots.append((_get_pack_hash(key), f.tell()))
+            f.write(_PACK_RECORD.pack(len(key), len(value)))
+            f.write(key)
+            f.write(value)
+
+        # index
+        num_slots = max(1, int(len(slots) / load_factor) + 1)
+        index = [(0, 0)] * num_slots
+        for key_hash, offset in slots:
+            slot = key_hash % num_slots
+            while index[slot][1]:
+                slot = (slot + 1) % num_slots
+            index[slot] = (key_hash, offset)
+
+        index_offset = f.tell()
+        f.write(b"".join(_PACK_SLOT.pack(*slot) for slot in index))
+        f.seek(len(PACK_MAGIC))
+        f.write(_PACK_HEADER.pack(num_slots, index_offset))
+
+    replace(temp_file, pack_file)
+    return len(slots)
+
+
+def migrate_disk_cache(cache_dir, db_file, cache_file_suffix="",
+                       batch_size=1000):
+    ''' imports all entries of a DiskCache directory into a SQLiteCache
+
+        ::param cache_dir: the DiskCache's base directory
+        ::param db_file: the SQLite database to import the entries into
+        ::param cache_file_suffix: the DiskCache's cache_file_suffix
+        ::param batch_size: number of entries per transaction
+
+        ::returns: the number of imported entries
+    '''
+    sqlite_cache = SQLiteCache(db_file)
+    imported = 0
+    batch = []
+    for obj_id, fname in _iter_cache_files(cache_dir, cache_file_suffix):
+        try:
+            with open(fname, "rb") as f:
+                blob = dumps(decode(f.read()), HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.warning("Cannot import cache file %s: %s", fname, e)
+            continue
+
+        batch.append((obj_id, blob))
+        if len(batch) >= batch_size:
+            sqlite_cache.put_many(batch)
+            imported += len(batch)
+            batch = []
+
+    sqlite_cache.put_many(batch)
+    return imported + len(batch)
+
+def main(argv=None):
+    ''' command line interface for maintaining cache directories
+
+        usage:
+          python -m eWRT.util.cache janitor --max-bytes 1000000000 ./cache
+          python -m eWRT.util.cache migrate ./cache ./cache.db
+          python -m eWRT.util.cache pack ./cache ./cache.pack
+    '''
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog="python -m eWRT.util.cache",
+                            description="maintains eWRT cache directories")
+    commands = parser.add_subparsers(dest="command")
+
+    migrate = commands.add_parser("migrate",
+                                  help="imports a DiskCache into a SQLiteCache")
+    migrate.add_argument("cache_dir")
+    migrate.add_argument("db_file")
+    migrate.add_argument("--suffix", default="",
+                         help="the DiskCache's cache_file_suffix")
+
+    pack = commands.add_parser("pack",
+                               help="compiles a DiskCache into a pack file")
+    pack.add_argument("cache_dir")
+    pack.add_argument("pack_file")
+    pack.add_argument("--suffix", default="",
+                      help="the DiskCache's cache_file_suffix")
+
+    janitor = commands.add_parser("janitor",
+                                  help="evicts entries from a DiskCache")
+    janitor.add_argument("cache_dir")
+    janitor.add_argument("--max-bytes", type=int, default=0,
+                         help="maximum cache size in bytes")
+    janitor.add_argument("--max-age", type=float, default=0,
+                         help="maximum idle time of an entry in seconds")
+    janitor.add_argument("--interval", type=float, default=0,
+                         help="keep running and start a new pass every "
+                              "INTERVAL seconds")
+
+    args = parser.parse_args(argv)
+    if args.command == "janitor":
+        j = DiskCacheJanitor(args.cache_dir, args.max_bytes, args.max_age)
+        while True:
+            j.run_pass()
+            log.info("%s: %d bytes, %d files evicted", args.cache_dir,
+                     j.getCacheSize(), j.evicted)
+            if not args.interval:
+                break
+            sleep(args.interval)
+    elif args.command == "migrate":
+        log.info("%d entries imported.",
+                 migrate_disk_cache(args.cache_dir, args.db_file, args.suffix))
+    elif args.command == "pack":
+        log.info("%d entries packed.",
+                 pack_disk_cache(args.cache_dir, args.pack_file, args.suffix))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.codec
+    serialization and compression codecs used by the eWRT caches
+
+    Every codec except GzipCodec prefixes its output with a short header
+    (HEADER_MAGIC + codec id), which allows decode() to read entries written
+    with arbitrary codecs. GzipCodec writes plain gzip streams for
+    compatibility with cache files created by previous eWRT versions.
+
+    The other codecs use the highest pickle protocol per default; pass
+    protocol=2 to share their entries with python 2 readers.
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+import zlib
+from struct import pack
+from io import BytesIO
+from gzip import GzipFile
+try:
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
+except ImportError:
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
+
+# optional codecs
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+HEADER_MAGIC = b"\xfeWC"
+HEADER_SIZE = len(HEADER_MAGIC) + 1
+GZIP_MAGIC = b"\x1f\x8b"
+# pickle protocol of the GzipCodec (readable by python 2 and 3)
+GZIP_PICKLE_PROTOCOL = 2
+
+
+class Codec(object):
+    ''' @class Codec
+        serializes objects using pickle; subclasses add compression by
+        overwriting compress() and decompress()
+    '''
+    codec_id = None
+    name = None
+
+    def __init__(self, level=None, protocol=HIGHEST_PROTOCOL):
+        ''' ::param level: optional compression level
+            ::param protocol: the pickle protocol to use
+        '''
+        self.level = level
+        self.protocol = protocol
+
+    def dumps(self, obj):
+        ''' returns the encoded object (including the codec header) '''
+        return HEADER_MAGIC + pack("B", self.codec_id) + \
+            self.compress(dumps(obj, self.protocol))
+
+    def loads(self, data):
+        ''' decodes an object encoded by dumps() '''
+        return loads(self.decompress(data[HEADER_SIZE:]))
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def __repr__(self):
+        return "%s(level=%s)" % (self.__class__.__name__, self.level)
+
+
+class PickleCodec(Codec):
+    ''' stores uncompressed pickles '''
+    codec_id = 1
+    name = "pickle"
+
+
+class ZlibCodec(Codec):
+    ''' zlib compressed pickles '''
+    codec_id = 2
+    name = "zlib"
+
+    def __init__(self, level=6, protocol=HIGHEST_PROTOCOL):
+        Codec.__init__(self, level, protocol)
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCodec(Codec):
+    ''' zstd compressed pickles (requires the zstandard package) '''
+    codec_id = 3
+    name = "zstd"
+
+    def __init__(self, level=3, protocol=HIGHEST_PROTOCOL):
+        assert zstandard, "ZstdCodec requires the zstandard package"
+        Codec.__init__(self, level, protocol)
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class Lz4Codec(Codec):
+    ''' lz4 compressed pickles (requires the lz4 package) '''
+    codec_id = 4
+    name = "lz4"
+
+    def __init__(self, level=0, protocol=HIGHEST_PROTOCOL):
+        assert lz4_frame, "Lz4Codec requires the lz4 package"
+        Codec.__init__(self, level, protocol)
+
+    def compress(self, data):
+        return lz4_frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+class GzipCodec(Codec):
+    ''' gzip compressed pickles without codec header (i.e. the format
+        used by previous versions of the DiskCache) '''
+    name = "gzip"
+
+    def __init__(self, level=9, protocol=GZIP_PICKLE_PROTOCOL):
+        Codec.__init__(self, level, protocol)
+
+    def dumps(self, obj):
+        buf = BytesIO()
+        with GzipFile(fileobj=buf, mode="wb", compresslevel=self.level) as f:
+            f.write(dumps(obj, self.protocol))
+        return buf.getvalue()
+
+    def loads(self, data):
+        # wbits=31 decodes gzip streams
+        return loads(zlib.decompress(data, 31))
+
+
+CODECS = dict((codec.name, codec) for codec in
+              (PickleCodec, ZlibCodec, ZstdCodec, Lz4Codec, GzipCodec))
+_CODEC_IDS = dict((codec.codec_id, codec) for codec in CODECS.values()
+                  if codec.codec_id)
+_DEFAULT_INSTANCES = {}
+
+
+def get_codec(name, level=None):
+    ''' returns a codec instance
+        ::param name: the codec's name ('pickle', 'zlib', 'gzip', 'zstd', 'lz4')
+        ::param level: optional compression level
+    '''
+    return CODECS[name]() if level is None else CODECS[name](level)
+
+
+def available_codecs():
+    ''' returns the names of all codecs usable in this environment '''
+    return [name for name, codec in sorted(CODECS.items())
+            if (codec is not ZstdCodec or zstandard) and
+            (codec is not Lz4Codec or lz4_frame)]
+
+
+def decode(data):
+    ''' decodes data encoded by any of the codecs
+        ::param data: the encoded data (bytes or a memoryview)
+    '''
+    if data[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        codec_class = GzipCodec
+    elif data[:HEADER_SIZE - 1] == HEADER_MAGIC:
+        codec_class = _CODEC_IDS[ord(bytes(data[HEADER_SIZE - 1:HEADER_SIZE]))]
+    else:
+        raise ValueError("Unknown cache entry format.")
+
+    codec = _DEFAULT_INSTANCES.get(codec_class)
+    if codec is None:
+        codec = _DEFAULT_INSTANCES[codec_class] = codec_class()
+    return codec.loads(data)
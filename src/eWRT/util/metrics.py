@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+
+''' @package eWRT.util.metrics
+    collects usage metrics of the eWRT caches
+
+    Caches with a metrics_registry record their hits, misses and
+    lookup/compute latencies in the CacheMetrics of the cached function (identified by its qualified
+    name). Byte, entry and eviction counts are provided by the caches
+    themselves and aggregated over all caches which served the function.
+    Counts shared by several functions (e.g. the entries of a DiskCache
+    directory) are reported once per cache directory.
+
+    usage:
+      from eWRT.util.cache import Cache
+      from eWRT.util.metrics import REGISTRY
+      Cache.metrics_registry = REGISTRY   # enables recording for all caches
+      REGISTRY.as_dict()          # python dictionary
+      REGISTRY.to_prometheus()    # Prometheus text exposition format
+      REGISTRY.to_performance()   # eWRT.util.monitoring.Performance objects
+'''
+
+# (C)opyrights 2008-2015 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = "Albert Weichselbraun"
+__copyright__ = "GPL"
+
+from bisect import bisect_left
+from threading import Lock, local, current_thread
+from weakref import WeakSet
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5,
+                   1., 5., 10., float("inf"))
+
+# metrics provided by the caches (see Cache._get_metrics_gauges)
+GAUGES = ('bytes_read', 'bytes_written', 'entries', 'evictions')
+
+PROMETHEUS_PREFIX = "ewrt_cache"
+
+
+def get_function_name(fn):
+    ''' returns the qualified name of the given function '''
+    name = getattr(fn, '__qualname__', None) or \
+        getattr(fn, '__name__', None) or type(fn).__name__
+    module = getattr(fn, '__module__', None)
+    return "%s.%s" % (module, name) if module else name
+
+
+class Histogram(object):
+    ''' a histogram with fixed buckets '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        ''' adds the observations of another histogram '''
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def as_dict(self):
+        return {'buckets': list(zip(self.buckets, self.counts)),
+                'sum': self.sum, 'count': self.count}
+
+
+class _Counters(object):
+    ''' the accesses recorded by a single thread '''
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.hits = 0
+        self.misses = 0
+        self.lookup_latency = Histogram()
+        self.compute_latency = Histogram()
+
+    def merge(self, other):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.lookup_latency.merge(other.lookup_latency)
+        self.compute_latency.merge(other.compute_latency)
+
+
+class CacheMetrics(object):
+    ''' the metrics of a single cached function
+
+        @remarks
+        Every thread records its accesses in its own counters, which are
+        aggregated on read. Recording therefore never acquires a lock.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.caches = WeakSet()
+        self._local = local()
+        self._counters = []             # counters of all running threads
+        self._retired = _Counters()     # counters of terminated threads
+        self._lock = Lock()
+
+    def _get_counters(self):
+        ''' returns the counters of the current thread '''
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = _Counters(current_thread())
+            with self._lock:
+                self._retire()
+                self._counters.append(counters)
+        return counters
+
+    def _retire(self):
+        ''' merges the counters of terminated threads '''
+        for counters in [c for c in self._counters if not c.thread.is_alive()]:
+            self._retired.merge(counters)
+            self._counters.remove(counters)
+
+    def _collect(self):
+        ''' returns the sum of the counters of all threads '''
+        total = _Counters()
+        with self._lock:
+            self._retire()
+            for counters in [self._retired] + self._counters:
+                total.merge(counters)
+        return total
+
+    def record(self, latency, compute_latency=None, hits=1, misses=0):
+        ''' records a cache access
+
+            ::param latency: the access' total latency in seconds
+            ::param compute_latency: seconds spent computing missing objects
+                                     (None, if all objects have been cached)
+            ::param hits, misses: number of cache hits and misses
+        '''
+        counters = self._get_counters()
+        counters.hits += hits
+        counters.misses += misses
+        if compute_latency is None:
+            counters.lookup_latency.observe(latency)
+        else:
+            counters.lookup_latency.observe(max(latency - compute_latency, 0.))
+            counters.compute_latency.observe(compute_latency)
+
+    @property
+    def hits(self):
+        return self._collect().hits
+
+    @property
+    def misses(self):
+        return self._collect().misses
+
+    def get_hit_ratio(self):
+        ''' returns the fraction of cache hits (None without accesses) '''
+        return _get_hit_ratio(self._collect())
+
+    def get_gauges(self):
+        ''' returns the byte, entry and eviction counts of all caches
+            which served this function (None if unknown) '''
+        gauges = dict((gauge, None) for gauge in GAUGES)
+        for cache in list(self.caches):
+            for gauge, value in cache._get_metrics_gauges().items():
+                # caches return None for unknown values
+                if value is not None:
+                    gauges[gauge] = (gauges[gauge] or 0) + value
+        return gauges
+
+    def as_dict(self):
+        counters = self._collect()
+        result = {'hits': counters.hits,
+                  'misses': counters.misses,
+                  'hit_ratio': _get_hit_ratio(counters),
+                  'lookup_latency': counters.lookup_latency.as_dict(),
+                  'compute_latency': counters.compute_latency.as_dict()}
+        result.update(self.get_gauges())
+        return result
+
+
+class MetricsRegistry(object):
+    ''' keeps the CacheMetrics of all cached functions '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def get(self, name, cache=None):
+        ''' returns the metrics for the given function name
+            ::param name: the function's qualified name
+            ::param cache: the cache serving the function
+        '''
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self._metrics.setdefault(name, CacheMetrics(name))
+        if cache is not None and cache not in metrics.caches:
+            metrics.caches.add(cache)
+        return metrics
+
+    def clear(self):
+        ''' removes all metrics '''
+        with self._lock:
+            self._metrics.clear()
+
+    def as_dict(self):
+        ''' returns the metrics of all functions (name -> metrics) '''
+        return dict((name, metrics.as_dict())
+                    for name, metrics in list(self._metrics.items()))
+
+    def get_directory_gauges(self):
+        ''' returns the entry and eviction counts of all cache directories
+            (cache directory -> gauges), which are shared by all functions
+            cached in the directory '''
+        directories = {}
+        for metrics in list(self._metrics.values()):
+            for cache in list(metrics.caches):
+                gauges = cache._get_directory_gauges()
+                if gauges is not None:
+                    directories[gauges[0]] = gauges[1]
+        return directories
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        ''' returns the metrics in the Prometheus text exposition format '''
+        data = sorted(self.as_dict().items())
+        lines = []
+
+        def add_metric(metric, metric_type, doc, values):
+            lines.append("# HELP %s_%s %s" % (prefix, metric, doc))
+            lines.append("# TYPE %s_%s %s" % (prefix, metric, metric_type))
+            lines.extend(values)
+
+        def label(name, **extra):
+            labels = [('function', name)] + sorted(extra.items())
+            return "{%s}" % ",".join('%s="%s"' % (key, _escape(value))
+                                     for key, value in labels)
+
+        for metric, doc in (('hits', 'Number of cache hits.'),
+                            ('misses', 'Number of cache misses.')):
+            add_metric(metric + "_total", "counter", doc,
+                       ["%s_%s_total%s %d" % (prefix, metric, label(name),
+                                              values[metric])
+                        for name, values in data])
+
+        for metric, doc in (('bytes_read', 'Number of bytes read.'),
+                            ('bytes_written', 'Number of bytes written.'),
+                            ('evictions', 'Number of evicted entries.'),
+                            ('entries', 'Number of cached entries.')):
+            metric_type = "gauge" if metric == "entries" else "counter"
+            name_suffix = "" if metric == "entries" else "_total"
+            add_metric(metric + name_suffix, metric_type, doc,
+                       ["%s_%s%s%s %d" % (prefix, metric, name_suffix,
+                                          label(name), values[metric])
+                        for name, values in data
+                        if values[metric] is not None])
+
+        directories = sorted(self.get_directory_gauges().items())
+        for metric, doc in (('entries', 'Number of entries in the cache '
+                                        'directory.'),
+                            ('evictions', 'Number of entries evicted from '
+                                          'the cache directory.')):
+            metric_type = "gauge" if metric == "entries" else "counter"
+            name_suffix = "" if metric == "entries" else "_total"
+            add_metric("directory_" + metric + name_suffix, metric_type, doc,
+                       ['%s_directory_%s%s{cache_dir="%s"} %d' % (
+                           prefix, metric, name_suffix, _escape(cache_dir),
+                           values[metric])
+                        for cache_dir, values in directories])
+
+        for metric, doc in (('lookup', 'Latency of cache lookups.'),
+                            ('compute', 'Latency of computing missing '
+                                        'objects.')):
+            samples = []
+            for name, values in data:
+                histogram = values[metric + '_latency']
+                cumulative = 0
+                for bound, count in histogram['buckets']:
+                    cumulative += count
+                    samples.append("%s_%s_seconds_bucket%s %d" % (
+                        prefix, metric, label(name, le=_format_bound(bound)),
+                        cumulative))
+                samples.append("%s_%s_seconds_sum%s %r" % (
+                    prefix, metric, label(name), histogram['sum']))
+                samples.append("%s_%s_seconds_count%s %d" % (
+                    prefix, metric, label(name), histogram['count']))
+            add_metric(metric + "_seconds", "histogram", doc, samples)
+
+        return "\n".join(lines) + "\n"
+
+    def to_performance(self):
+        ''' returns the metrics as a list of
+            eWRT.util.monitoring.Performance objects '''
+        from eWRT.util.monitoring import Performance
+
+        performance = []
+        for name, values in sorted(self.as_dict().items()):
+            if values['hit_ratio'] is not None:
+                performance.append(Performance(
+                    "%s hit ratio" % name,
+                    round(100 * values['hit_ratio'], 2), '%', min=0, max=100))
+            performance.append(Performance("%s hits" % name,
+                                           values['hits'], 'c'))
+            performance.append(Performance("%s misses" % name,
+                                           values['misses'], 'c'))
+            for metric in ('lookup', 'compute'):
+                histogram = values[metric + '_latency']
+                if histogram['count']:
+                    performance.append(Performance(
+                        "%s %s latency" % (name, metric),
+                        histogram['sum'] / histogram['count'], 's'))
+            for metric in ('bytes_read', 'bytes_written'):
+                if values[metric] is not None:
+                    performance.append(Performance(
+                        "%s %s" % (name, metric), values[metric], 'B'))
+        return performance
+
+
+def _get_hit_ratio(counters):
+    ''' returns the fraction of cache hits (None without accesses) '''
+    total = counters.hits + counters.misses
+    return float(counters.hits) / total if total else None
+
+
+def _escape(value):
+    ''' escapes Prometheus label values '''
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+# the registry used by all eWRT caches
+REGISTRY = MetricsRegistry()
@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 
-''' pickelIterator '''
+''' pickelIterator
+
+    Stores sequences of pickled elements in gzip compatible files.
+
+    File format: the file consists of independently compressed gzip members.
+    The first member contains FRAME_MAGIC, all following members (blocks)
+    contain length-prefixed pickle frames. A sidecar index (fname + '.idx')
+    stores the offset of every block, which allows computing the number of
+    elements, seeking and decompressing blocks in parallel.
+
+    Files written by previous versions (base64 encoded pickles, one per
+    line) remain readable.
+'''
 
 # (C)opyrights 2008 - 2015 by Albert Weichselbraun <albert@weichselbraun.net>
 #
@@ -20,11 +32,69 @@
 __copyright__ = "GPL"
 
 import gzip
-from binascii import b2a_base64, a2b_base64
+import zlib
+from os import fstat
+from os.path import exists
+from bisect import bisect_right
+from struct import Struct
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+from binascii import a2b_base64
 try:
-    from cPickle import dumps, loads
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
-    from pickle import dumps, loads
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # python 2
+
+# content of the first gzip member of files using the binary frame format
+FRAME_MAGIC = b"\x00WPI\x01"
+INDEX_MAGIC = b"WPIX\x01"
+INDEX_SUFFIX = ".idx"
+
+# uncompressed size of a block in bytes
+DEFAULT_BLOCK_SIZE = 1 << 16
+DEFAULT_COMPRESSLEVEL = 6
+# number of bytes read at once while rebuilding the index
+INDEX_READ_SIZE = 1 << 16
+
+_FRAME = Struct("<I")                   # length of the pickled element
+_INDEX_HEADER = Struct("<QQ")           # number of elements, file size
+_INDEX_ENTRY = Struct("<QQQ")           # offset, size, first element
+
+
+def _compress(data, compresslevel):
+    ''' returns the data as gzip member '''
+    c = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _is_complete(d):
+    ''' returns whether the decompressobj d has reached the end of its
+        gzip member '''
+    if d.unused_data or getattr(d, 'eof', False):
+        return True
+    if hasattr(d, 'eof'):
+        return False
+    # python 2 does not provide eof => data following the end of the member
+    # ends up in unused_data
+    d.decompress(b"\x00")
+    return d.unused_data == b"\x00"
+
+
+def _split_frames(data):
+    ''' returns the pickles stored in the given block '''
+    frames = []
+    pos, end = 0, len(data)
+    while pos < end:
+        size, = _FRAME.unpack_from(data, pos)
+        pos += _FRAME.size
+        frames.append(data[pos:pos + size])
+        pos += size
+    return frames
+
 
 class AbstractIterator(object):
     '''
@@ -49,34 +119,281 @@ class AbstractIterator(object):
     def close(self):
         self.f.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @classmethod
     def get_filename(cls, fname):
         return fname if fname.endswith('.gz') else fname + '.gz'
 
 class WritePickleIterator(AbstractIterator):
-    ''' writes pickeled elements (available as iterator) to a file '''
+    ''' writes pickeled elements (available as iterator) to a file
 
-    def __init__(self, fname):
-        AbstractIterator.__init__(self, fname, file_mode='w')
+        @remarks
+        The index is written on checkpoint() and close(); readers rebuild
+        the index of files which have not been closed properly.
+    '''
+
+    def __init__(self, fname, block_size=DEFAULT_BLOCK_SIZE,
+                 compresslevel=DEFAULT_COMPRESSLEVEL, append=False):
+        ''' ::param fname: the file name ('.gz' is appended if necessary)
+            ::param block_size: uncompressed size of a block in bytes
+            ::param compresslevel: the gzip compression level
+            ::param append: append to the complete blocks of an existing
+                            file rather than overwriting it
+        '''
+        self.fname = self.get_filename(fname)
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+
+        self._blocks = []
+        self._buffer = []
+        self._buffer_size = 0
+        self._count = 0
+        if append and exists(self.fname):
+            with ReadPickleIterator(self.fname) as r:
+                if not r.legacy:
+                    self._blocks = list(zip(r._offsets, r._sizes, r._starts))
+                    self._count = r._length
+
+        if self._blocks:
+            offset, size, _ = self._blocks[-1]
+            self.f = open(self.fname, "r+b")
+            # discard incomplete blocks
+            self.f.truncate(offset + size)
+            self.f.seek(offset + size)
+        else:
+            self.f = open(self.fname, "wb")
+            self.f.write(_compress(FRAME_MAGIC, compresslevel))
+        self._block_start = self._count
+
+    def __len__(self):
+        ''' returns the number of elements written so far '''
+        return self._count
 
     def dump(self, obj):
         ''' dumps the following object to the pickle file '''
-        p = b2a_base64(dumps(obj))
-        self.f.write(p)
+        p = dumps(obj, HIGHEST_PROTOCOL)
+        self._buffer.append(_FRAME.pack(len(p)))
+        self._buffer.append(p)
+        self._buffer_size += _FRAME.size + len(p)
+        self._count += 1
+        if self._buffer_size >= self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        ''' compresses and writes the buffered frames '''
+        data = _compress(b"".join(self._buffer), self.compresslevel)
+        self._blocks.append((self.f.tell(), len(data), self._block_start))
+        self.f.write(data)
+
+        self._buffer = []
+        self._buffer_size = 0
+        self._block_start = self._count
+
+    def checkpoint(self):
+        ''' persists all elements written so far (including the index) '''
+        if self._buffer:
+            self._write_block()
+        self.f.flush()
+        self._write_index(self.f.tell())
+
+    def close(self):
+        ''' writes the remaining elements and the index '''
+        if self.f.closed:
+            return
+        if self._buffer:
+            self._write_block()
+        file_size = self.f.tell()
+        self.f.close()
+        self._write_index(file_size)
+
+    def _write_index(self, file_size):
+        ''' writes the sidecar index '''
+        index = [INDEX_MAGIC, _INDEX_HEADER.pack(self._count, file_size)]
+        index.extend(_INDEX_ENTRY.pack(*block) for block in self._blocks)
+        temp_file = self.fname + INDEX_SUFFIX + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(b"".join(index))
+        replace(temp_file, self.fname + INDEX_SUFFIX)
 
 class ReadPickleIterator(AbstractIterator):
-    ''' provides an iterator over pickeled elements '''
+    ''' provides an iterator over pickeled elements
 
-    def __init__(self, fname):
-        AbstractIterator.__init__(self, fname)
+        Files in the binary frame format also support len(), seek() and
+        indexing/slicing (e.g. it[10], it[100:200]).
+    '''
 
-    def __iter__(self):
-        return self
+    def __init__(self, fname, threads=1):
+        ''' ::param fname: the file name ('.gz' is appended if necessary)
+            ::param threads: number of threads used for decompressing the
+                             blocks required by slices
+        '''
+        self.fname = self.get_filename(fname)
+        self.threads = threads
+        self._pool = None
+
+        with gzip.open(self.fname) as f:
+            self.legacy = f.read(len(FRAME_MAGIC)) != FRAME_MAGIC
+        if self.legacy:
+            self.f = gzip.open(self.fname)
+            return
+
+        self.f = open(self.fname, "rb")
+        self._lock = Lock()
+        self._length, self._offsets, self._sizes, self._starts = \
+            self._load_index() or self._build_index()
+        self._next_block = 0
+        self._frames = []
+        self._frame_pos = 0
+
+    def _load_index(self):
+        ''' returns the index stored in the sidecar file or None if the
+            index does not exist or is outdated '''
+        try:
+            with open(self.fname + INDEX_SUFFIX, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        pos = len(INDEX_MAGIC)
+        if not data.startswith(INDEX_MAGIC) or len(data) < pos + _INDEX_HEADER.size:
+            return None
+        length, file_size = _INDEX_HEADER.unpack_from(data, pos)
+        if file_size != fstat(self.f.fileno()).st_size:
+            return None
+
+        offsets, sizes, starts = [], [], []
+        for pos in range(pos + _INDEX_HEADER.size, len(data), _INDEX_ENTRY.size):
+            offset, size, start = _INDEX_ENTRY.unpack_from(data, pos)
+            offsets.append(offset)
+            sizes.append(size)
+            starts.append(start)
+        return length, offsets, sizes, starts
+
+    def _build_index(self):
+        ''' computes the index by decompressing all blocks; incomplete
+            blocks at the end of the file (e.g. after a crash) are ignored
+        '''
+        self.f.seek(0)
+        length, offsets, sizes, starts = 0, [], [], []
+        offset = 0
+        # data read beyond the end of the previous block
+        pending = b""
+        while True:
+            d = zlib.decompressobj(31)
+            block, size = [], 0
+            try:
+                while not d.unused_data and not getattr(d, 'eof', False):
+                    data = pending or self.f.read(INDEX_READ_SIZE)
+                    pending = b""
+                    if not data:
+                        break
+                    block.append(d.decompress(data))
+                    size += len(data)
+                pending = d.unused_data
+                if not size or not _is_complete(d):
+                    break
+            except zlib.error:
+                break
+            size -= len(pending)
+            block = b"".join(block)
+            if offset:
+                try:
+                    count = len(_split_frames(block))
+                except Exception:
+                    break
+                offsets.append(offset)
+                sizes.append(size)
+                starts.append(length)
+                length += count
+            offset += size
+        return length, offsets, sizes, starts
+
+    def _check_indexed(self):
+        if self.legacy:
+            raise TypeError("Random access is not supported by files in the "
+                            "legacy (base64) format.")
+
+    def _read_block(self, block_no):
+        ''' returns the pickles stored in the given block '''
+        with self._lock:
+            self.f.seek(self._offsets[block_no])
+            data = self.f.read(self._sizes[block_no])
+        return _split_frames(zlib.decompress(data, 31))
+
+    def __len__(self):
+        self._check_indexed()
+        return self._length
 
     def __next__(self):
         ''' returns the next pickled element in the file '''
-        line = self.f.readline()
-        if not line:
-            raise StopIteration
+        if self.legacy:
+            line = self.f.readline()
+            if not line:
+                raise StopIteration
+            return loads(a2b_base64(line))
+
+        if self._frame_pos >= len(self._frames):
+            if self._next_block >= len(self._offsets):
+                raise StopIteration
+            self._frames = self._read_block(self._next_block)
+            self._next_block += 1
+            self._frame_pos = 0
+        self._frame_pos += 1
+        return loads(self._frames[self._frame_pos - 1])
+
+    def seek(self, n):
+        ''' moves to the n-th element, i.e. the next call to next() returns
+            element n '''
+        self._check_indexed()
+        if not 0 <= n <= self._length:
+            raise IndexError("Element %d out of range." % n)
+
+        block_no = bisect_right(self._starts, n) - 1
+        if n == self._length or block_no < 0:
+            self._next_block, self._frames, self._frame_pos = \
+                len(self._offsets), [], 0
+            return
+        self._frames = self._read_block(block_no)
+        self._frame_pos = n - self._starts[block_no]
+        self._next_block = block_no + 1
 
-        return loads(a2b_base64(line))
+    def __getitem__(self, key):
+        self._check_indexed()
+        if isinstance(key, slice):
+            return self._get_slice(range(*key.indices(self._length)))
+
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError("Element %d out of range." % key)
+        block_no = bisect_right(self._starts, key) - 1
+        return loads(self._read_block(block_no)[key - self._starts[block_no]])
+
+    def _get_slice(self, positions):
+        ''' returns the elements at the given positions '''
+        block_nos = sorted(set(bisect_right(self._starts, n) - 1
+                               for n in positions))
+        if self.threads > 1 and len(block_nos) > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self.threads)
+            blocks = self._pool.map(self._read_block, block_nos)
+        else:
+            blocks = [self._read_block(block_no) for block_no in block_nos]
+        blocks = dict(zip(block_nos, blocks))
+
+        result = []
+        for n in positions:
+            block_no = bisect_right(self._starts, n) - 1
+            result.append(loads(blocks[block_no][n - self._starts[block_no]]))
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self.f.close()
@@ -4,9 +4,13 @@
 #
 from shutil import rmtree
 from multiprocessing import Pool
+from time import sleep
+from os import listdir, walk, environ, pathsep
+from os.path import exists
 import pytest
 
 from eWRT.util.cache import *
+from eWRT.util.codec import PickleCodec
 from eWRT.util.module_path import get_resource
 
 
@@ -59,6 +63,58 @@ class TestMemoryCached(TestCached):
     def sub(a=2, b=1):
         return a-b 
 
+class TestMemoryCacheEviction(object):
+    ''' tests the LRU eviction of the MemoryCache '''
+
+    def testLeastRecentlyUsedEviction(self):
+        ''' the least recently used entry is evicted first '''
+        m = MemoryCache(max_cache_size=3)
+        for x in range(3):
+            m.fetchObjectId(x, str, x)
+
+        # touch entry 0 and add a new one => entry 1 gets evicted
+        m.fetchObjectId(0, str, 0)
+        m.fetchObjectId(3, str, 3)
+        assert len(m) == 3
+        assert 0 in m and 2 in m and 3 in m
+        assert 1 not in m
+
+    def testByteBudget(self):
+        ''' the cache honors the max_bytes budget '''
+        m = MemoryCache(max_bytes=10000)
+        for x in range(20):
+            m.fetchObjectId(x, lambda: 1000 * "x")
+
+        assert m.getCacheSize() <= 10000
+        assert 0 < len(m) < 20
+        assert 19 in m
+
+    def testLockStripes(self):
+        ''' a striped cache can be shared between threads '''
+        from threading import Thread
+        m = MemoryCache(max_cache_size=100, lock_stripes=8)
+
+        def worker():
+            for x in range(500):
+                assert m.fetch(str, x % 150) == str(x % 150)
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(m) <= 100
+
+    def testMemoryCachedArguments(self):
+        ''' the decorator accepts the cache parameters '''
+        @MemoryCached(10, max_bytes=2**20, lock_stripes=2)
+        def mul(a, b):
+            return a * b
+
+        assert mul(3, 4) == 12
+        assert mul(3, 4) == 12
+
+
 class TestDiskCached(TestCached):
     @staticmethod
     @DiskCached(get_cache_dir(1))
@@ -187,3 +243,1239 @@ def g(c):
     assert c.fetch( str, r ) == str(r)
     return 0
 
+
+
+class TestDiskCacheJanitor(object):
+    ''' tests the eviction of DiskCache entries '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.cache = DiskCache(self.cache_dir, cache_nesting_level=2)
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def _age(self, key, seconds):
+        ''' sets the access time of the given entry into the past '''
+        from os import utime
+        from time import time
+        fname = self.cache._get_fname(Cache.getObjectId(key))
+        t = time() - seconds
+        utime(fname, (t, t))
+
+    def testMaxBytes(self):
+        ''' least recently used entries are evicted first '''
+        from os import urandom
+        for x in range(20):
+            self.cache.fetchObjectId(x, urandom, 1000)
+            self._age(x, 1000 - x)
+
+        janitor = DiskCacheJanitor(self.cache_dir, max_bytes=12000,
+                                   batch_size=7)
+        janitor.run_pass()
+        assert janitor.getCacheSize() <= 12000
+        assert janitor.evicted > 0
+        assert 0 not in self.cache
+        assert 19 in self.cache
+
+    def testMaxAge(self):
+        ''' entries which have not been used within max_age are evicted '''
+        for x in range(10):
+            self.cache.fetchObjectId(x, str, x)
+        self._age(3, 3600)
+
+        janitor = DiskCacheJanitor(self.cache_dir, max_age=60)
+        janitor.run_pass()
+        assert janitor.evicted == 1
+        assert 3 not in self.cache
+        assert 4 in self.cache
+
+        # consecutive passes do not evict recently used entries
+        janitor.run_pass()
+        assert janitor.evicted == 1
+
+    def testJanitorThread(self):
+        ''' caches with max_bytes start a shared janitor thread '''
+        c = DiskCache(self.cache_dir, max_bytes=10**6)
+        janitor = DiskCacheJanitor.get_instance(self.cache_dir)
+        assert janitor.max_bytes == 10**6
+        assert c.fetch(str, 1) == "1"
+        assert c.fetch(str, 1) == "1"
+        janitor.stop()
+
+
+class TestSQLiteCache(object):
+    ''' tests the SQLiteCache '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.db_file = join(self.cache_dir, "cache.db")
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testFetch(self):
+        ''' tests fetch, contains and delitem '''
+        c = SQLiteCache(self.db_file, batch_size=3)
+        assert c.fetch(str, 1) == "1"
+        assert c.getKey(1) in c
+        assert c.fetchObjectId("x", lambda: None) is None
+        assert "x" not in c
+
+        del c[c.getKey(1)]
+        assert c.getKey(1) not in c
+        with pytest.raises(KeyError):
+            del c[c.getKey(1)]
+
+    def testBatchedWrites(self):
+        ''' buffered entries are visible to other connections after a flush '''
+        c = SQLiteCache(self.db_file, batch_size=10, batch_interval=3600)
+        for x in range(5):
+            assert c.fetch(str, x) == str(x)
+        assert c.getCacheStatistics() == {'cache_hits': 0, 'cache_misses': 5}
+
+        other = SQLiteCache(self.db_file)
+        assert c.getKey(1) not in other
+        c.flush()
+        assert c.getKey(1) in other
+        assert len(other) == 5
+
+    def testBatchInterval(self):
+        ''' batches are written after batch_interval seconds, even without
+            further writes '''
+        c = SQLiteCache(self.db_file, batch_size=10, batch_interval=0.1)
+        c.fetch(str, 1)
+        other = SQLiteCache(self.db_file)
+        assert c.getKey(1) not in other
+        sleep(0.3)
+        assert c.getKey(1) in other
+
+    def testGarbageCollection(self):
+        ''' the exit handler does not keep caches alive '''
+        import gc
+        from weakref import ref
+        c = ref(SQLiteCache(self.db_file))
+        gc.collect()
+        assert c() is None
+
+    def testPoolWorkers(self):
+        ''' multiprocessing workers flush their pending entries at exit '''
+        c = SQLiteCache(self.db_file, batch_interval=3600)
+        p = Pool(2)
+        p.map(g, 20 * [c])
+        p.close()
+        p.join()
+        assert len(c) > 0
+
+    def testMultiProcessing(self):
+        ''' the cache may be shared between processes '''
+        c = SQLiteCache(self.db_file, batch_size=1)
+        p = Pool(4)
+        p.map(g, 20 * [c])
+        p.close()
+        p.join()
+        assert 0 < len(c) <= 7
+
+    def testDecorator(self):
+        ''' tests the SQLiteCached decorator '''
+        @SQLiteCached(self.db_file)
+        def add(a, b):
+            return a + b
+
+        assert add(1, 2) == 3
+        assert add(1, 2) == 3
+        assert add.getCacheStatistics()['cache_hits'] == 1
+
+    def testMigration(self):
+        ''' imports a DiskCache into a SQLiteCache '''
+        d = DiskCache(join(self.cache_dir, "disk"), cache_nesting_level=2)
+        for x in range(10):
+            d.fetch(str, x)
+
+        assert migrate_disk_cache(d.cache_dir, self.db_file) == 10
+        c = SQLiteCache(self.db_file)
+        assert c.fetch(lambda x: None, 3) == "3"
+
+
+def testDiskCacheCodecs():
+    ''' entries written with different codecs coexist in one directory '''
+    from tempfile import mkdtemp
+    cache_dir = mkdtemp()
+    try:
+        gzip_cache = DiskCache(cache_dir)
+        zlib_cache = DiskCache(cache_dir, codec="zlib")
+        pickle_cache = DiskCached(cache_dir, codec=PickleCodec())(str)
+
+        assert gzip_cache.fetch(str, 1) == "1"
+        assert zlib_cache.fetch(str, 2) == "2"
+        assert pickle_cache.fetch(str, 3) == "3"
+
+        for x in range(1, 4):
+            for c in (gzip_cache, zlib_cache, pickle_cache):
+                assert c.fetch(lambda x: None, x) == str(x)
+    finally:
+        rmtree(cache_dir)
+
+
+class TestSingleFlight(object):
+    ''' tests the deduplication of concurrent cache misses '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testThreads(self):
+        ''' only one thread computes the missing object '''
+        from threading import Thread
+        from time import sleep
+        calls = []
+
+        def slow_function(x):
+            calls.append(x)
+            sleep(0.2)
+            return str(x)
+
+        c = DiskCache(self.cache_dir, single_flight=True)
+        results = []
+        threads = [Thread(target=lambda: results.append(c.fetch(slow_function, 1)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == 8 * ["1"]
+        assert calls == [1]
+
+    def testProcesses(self):
+        ''' only one process computes the missing object '''
+        c = DiskCache(self.cache_dir, single_flight=True)
+        p = Pool(4)
+        log_file = join(self.cache_dir, "calls.log")
+        assert p.map(h, 8 * [(c, log_file)]) == 8 * [log_file]
+        p.close()
+        p.join()
+
+        with open(log_file) as f:
+            assert len(f.readlines()) == 1
+
+    def testLeaseRenewal(self):
+        ''' slow computations keep their lease '''
+        c = DiskCache(self.cache_dir, single_flight=True, lease_timeout=0.2)
+        p = Pool(4)
+        log_file = join(self.cache_dir, "calls.log")
+        assert p.map(h, 4 * [(c, log_file)]) == 4 * [log_file]
+        p.close()
+        p.join()
+
+        with open(log_file) as f:
+            assert len(f.readlines()) == 1
+
+    def testLockOwnership(self):
+        ''' a process never removes locks taken over by another process '''
+        lock_files = []
+
+        def take_over(x):
+            for root, dirs, files in walk(self.cache_dir):
+                lock_files.extend(join(root, f) for f in files
+                                  if f.endswith(".lock"))
+            with open(lock_files[0], "wb") as f:
+                f.write(b"other")
+            return str(x)
+
+        c = DiskCache(self.cache_dir, single_flight=True)
+        assert c.fetch(take_over, 1) == "1"
+        assert len(lock_files) == 1 and exists(lock_files[0])
+
+    def testWriteBehind(self):
+        ''' entries are written before the lock is released '''
+        from threading import Event
+        c = DiskCache(self.cache_dir, single_flight=True, write_behind=True)
+        # stall the writer thread
+        resume = Event()
+        c._writer.submit(resume.wait)
+        try:
+            assert c.fetch(str, 1) == "1"
+            other = DiskCache(self.cache_dir)
+            assert other.fetch(lambda x: None, 1) == "1"
+        finally:
+            resume.set()
+        c.flush()
+
+def h(args):
+    ''' Function for checking the single flight mode of the DiskCache.
+
+        @remarks
+        required for the TestSingleFlight unittest; logs every computation.
+    '''
+    c, log_file = args
+
+    def slow_function(log_file):
+        from time import sleep
+        with open(log_file, "a") as f:
+            f.write("computed\n")
+        sleep(0.5)
+        return log_file
+
+    return c.fetch(slow_function, log_file)
+
+
+class TestKeyEncoder(object):
+    ''' tests the canonical key encoding '''
+
+    class Term(object):
+        def __init__(self, term):
+            self.term = term
+
+        def __cache_key__(self):
+            return self.term
+
+    def testCanonicalKeys(self):
+        ''' equal arguments yield equal object ids '''
+        for encoder in (KeyEncoder(), KeyEncoder(fast=True)):
+            call_id = encoder.getCallObjectId
+            assert call_id((1, ), {'a': 1, 'b': 2}) == \
+                call_id((1, ), {'b': 2, 'a': 1})
+            assert encoder.getObjectId({'x': 1, 'y': {2, 3}}) == \
+                encoder.getObjectId({'y': {3, 2}, 'x': 1})
+            assert encoder.getObjectId(self.Term("eWRT")) == \
+                encoder.getObjectId(self.Term("eWRT"))
+
+            # the type of the arguments matters
+            distinct = (1, "1", b"1", 1.0, True, None, (1, ), [1], ("1", ),
+                        ("a", "b"), ("ab", ), self.Term("1"))
+            assert len(set(encoder.getObjectId(obj) for obj in distinct)) \
+                == len(distinct)
+
+    def testDefaultRepr(self):
+        ''' objects with the default repr are refused '''
+        with pytest.raises(TypeError):
+            KeyEncoder().getObjectId(object())
+
+    def testCache(self):
+        ''' caches use the encoder for fetch, contains and delitem '''
+        m = MemoryCache(key_encoder=KeyEncoder(fast=True))
+        assert m.fetch(TestCached.add, a=1, b=2) == 3
+        assert m.fetch(lambda **kargs: None, b=2, a=1) == 3
+        assert m.getKey(1) not in m
+        assert m.fetchObjectId("key", str, 7) == "7"
+        assert "key" in m
+        del m["key"]
+        assert "key" not in m
+
+    def testGetKey(self):
+        ''' keys returned by getKey refer to the entries stored by fetch '''
+        from tempfile import mkdtemp
+        cache_dir = mkdtemp()
+        try:
+            for c in (MemoryCache(key_encoder=KeyEncoder()),
+                      DiskCache(cache_dir, key_encoder=KeyEncoder())):
+                assert c.fetch(TestCached.add, 1, b=2) == 3
+                assert c.getKey(1, b=2) in c
+                del c[c.getKey(1, b=2)]
+                assert c.getKey(1, b=2) not in c
+        finally:
+            rmtree(cache_dir)
+
+
+class TestTieredCache(object):
+    ''' tests the TieredCache '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def _get_tiers(self):
+        return [MemoryCache(10), DiskCache(join(self.cache_dir, "disk"), 1),
+                SQLiteCache(join(self.cache_dir, "cache.db"), batch_size=1)]
+
+    def testPromotion(self):
+        ''' hits are promoted into the faster tiers '''
+        memory, disk, sqlite = self._get_tiers()
+        sqlite.fetch(str, 1)
+
+        c = TieredCache([memory, disk, sqlite])
+        assert c.fetch(lambda x: None, 1) == "1"
+        assert c.getCacheStatistics()['tier_hits'] == [0, 0, 1]
+        assert memory.getKey(1) in memory and disk.getKey(1) in disk
+
+        assert c.fetch(lambda x: None, 1) == "1"
+        assert c.getCacheStatistics() == {'cache_hits': 2,
+                                          'cache_misses': 0,
+                                          'tier_hits': [1, 0, 1]}
+
+    def testFetchMany(self):
+        memory, disk, sqlite = self._get_tiers()
+        sqlite.fetch_many([1], lambda keys: ["1"])
+        disk.fetch_many([2], lambda keys: ["2"])
+
+        c = TieredCache([memory, disk, sqlite])
+        assert c.fetch_many([1, 2, 3], lambda keys: [str(-k) for k in keys]) \
+            == ["1", "2", "-3"]
+        assert c.getCacheStatistics() == {'cache_hits': 2,
+                                          'cache_misses': 1,
+                                          'tier_hits': [0, 1, 1]}
+        assert all(x in memory for x in (1, 2, 3))
+        assert 3 in sqlite
+        assert c.fetch_many([1, 2, 3], lambda keys: 1 / 0) == ["1", "2", "-3"]
+
+    def testWriteThrough(self):
+        ''' computed objects are written to all tiers '''
+        for write_behind in (False, True):
+            tiers = self._get_tiers()
+            c = TieredCache(tiers, fn=str, write_behind=write_behind)
+            assert c(2) == "2"
+            c.flush()
+            assert all(tier.getKey(2) in tier for tier in tiers)
+            assert c.getKey(2) in c
+
+            del c[c.getKey(2)]
+            assert not any(tier.getKey(2) in tier for tier in tiers)
+            with pytest.raises(KeyError):
+                del c[c.getKey(2)]
+
+    def testFlushAtExit(self):
+        ''' pending writes to the slower tiers are flushed at exit '''
+        import sys
+        from subprocess import check_call
+        script = """if True:
+            from time import sleep
+            from eWRT.util.cache import *
+            c = TieredCache([MemoryCache(10), DiskCache(%r),
+                             SQLiteCache(%r, batch_size=1)], write_behind=True)
+            # stall the writer thread until the process exits
+            c._writer.submit(sleep, 0.5)
+            c.fetch(str, 1)
+            c.fetch_many([2, 3], lambda keys: [str(k) for k in keys])
+        """ % (join(self.cache_dir, "disk"), join(self.cache_dir, "cache.db"))
+        check_call([sys.executable, "-c", script],
+                   env=dict(environ, PYTHONPATH=pathsep.join(sys.path)))
+
+        disk = DiskCache(join(self.cache_dir, "disk"))
+        sqlite = SQLiteCache(join(self.cache_dir, "cache.db"))
+        assert disk.getKey(1) in disk and sqlite.getKey(1) in sqlite
+        assert all(k in disk and k in sqlite for k in (2, 3))
+
+    def testGarbageCollection(self):
+        ''' the exit handler does not keep write-behind caches alive '''
+        import gc
+        from weakref import ref
+        c = TieredCache(self._get_tiers(), fn=str, write_behind=True)
+        c(1)
+        c.flush()
+        c = ref(c)
+        gc.collect()
+        assert c() is None
+
+
+class TestExpiry(object):
+    ''' tests ttls, stale-while-revalidate and negative caching '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.calls = []
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def _get_caches(self, **kargs):
+        return [MemoryCache(**kargs), DiskCache(self.cache_dir, **kargs)]
+
+    def _fetch(self, x):
+        self.calls.append(x)
+        return len(self.calls)
+
+    def testTtl(self):
+        for c in self._get_caches(ttl=0.2):
+            self.calls = []
+            assert c.fetch(self._fetch, 1) == 1
+            assert c.fetch(self._fetch, 1) == 1
+            sleep(0.3)
+            assert c.fetch(self._fetch, 1) == 2
+            assert c.fetch(self._fetch, 1) == 2
+
+    def testExpiring(self):
+        ''' per entry ttls overwrite the cache's ttl '''
+        for c in self._get_caches():
+            assert c.fetch(lambda x: Expiring(x, 0.2), "a") == "a"
+            assert c.fetch(lambda x: "b", "a") == "a"
+            sleep(0.3)
+            assert c.fetch(lambda x: "b", "a") == "b"
+
+    def testDiskCacheTtlOfLegacyEntries(self):
+        ''' entries without expiry date expire ttl seconds after their
+            last modification '''
+        DiskCache(self.cache_dir).fetch(str, 1)
+        c = DiskCache(self.cache_dir, ttl=60)
+        assert c.fetch(lambda x: None, 1) == "1"
+        c.ttl = 0.1
+        sleep(0.2)
+        assert c.fetch(lambda x: "new", 1) == "new"
+
+    def testStaleWhileRevalidate(self):
+        for c in self._get_caches(ttl=0.2, stale_while_revalidate=60):
+            self.calls = []
+            assert c.fetch(self._fetch, 1) == 1
+            sleep(0.3)
+            # the stale value is returned and refreshed in the background
+            assert c.fetch(self._fetch, 1) == 1
+            for _ in range(100):
+                if c.fetch(self._fetch, 1) == 2:
+                    break
+                sleep(0.01)
+            assert c.fetch(self._fetch, 1) == 2
+            assert len(self.calls) == 2
+
+    def testNegativeCaching(self):
+        def fail(x):
+            self.calls.append(x)
+            raise ValueError(x)
+
+        # None and exceptions are not cached per default
+        for c in self._get_caches():
+            self.calls = []
+            assert c.fetch(lambda x: self.calls.append(x), 1) is None
+            assert c.fetch(lambda x: self.calls.append(x), 1) is None
+            assert len(self.calls) == 2
+            for _ in range(2):
+                with pytest.raises(ValueError):
+                    c.fetch(fail, 2)
+            assert len(self.calls) == 4
+
+        for c in self._get_caches(negative_ttl=0.2,
+                                  negative_exceptions=(ValueError, )):
+            self.calls = []
+            assert c.fetch(lambda x: self.calls.append(x), 1) is None
+            assert c.fetch(lambda x: self.calls.append(x), 1) is None
+            for _ in range(2):
+                with pytest.raises(ValueError):
+                    c.fetch(fail, 2)
+            assert len(self.calls) == 2
+
+            sleep(0.3)
+            assert c.fetch(str, 1) == "1"
+            assert c.fetch(str, 2) == "2"
+
+    def testCachedExceptionTraceback(self):
+        ''' cache hits do not extend the cached exception's traceback '''
+        from sys import exc_info
+        from traceback import extract_tb
+
+        def fail(x):
+            raise ValueError(x)
+
+        for c in self._get_caches(negative_ttl=10,
+                                  negative_exceptions=(ValueError, )):
+            lengths = set()
+            for _ in range(50):
+                try:
+                    c.fetch(fail, 1)
+                except ValueError:
+                    lengths.add(len(extract_tb(exc_info()[2])))
+            # the first call's traceback includes fail()
+            assert len(lengths) <= 2 and max(lengths) < 10
+
+
+class TestFetchMany(object):
+    ''' tests the bulk fetch_many API '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.batches = []
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def _get_caches(self):
+        return [MemoryCache(), DiskCache(self.cache_dir, 1),
+                SQLiteCache(join(self.cache_dir, "cache.db"))]
+
+    def _batch(self, keys):
+        self.batches.append(keys)
+        return [key * 2 for key in keys]
+
+    def testFetchMany(self):
+        for c in self._get_caches():
+            self.batches = []
+            assert c.fetch_many([1, 2], self._batch) == [2, 4]
+            assert c.fetch_many(range(5), self._batch) == [0, 2, 4, 6, 8]
+            assert self.batches == [[1, 2], [0, 3, 4]]
+            assert c.fetch_many([4, 3], self._batch) == [8, 6]
+            assert len(self.batches) == 2
+            # entries are shared with fetchObjectId
+            assert c.fetchObjectId(3, lambda: None) == 6
+
+    def testDictResult(self):
+        ''' batch functions may return dictionaries; None results (i.e.
+            missing keys) are not cached '''
+        for c in self._get_caches():
+            assert c.fetch_many("abc", lambda keys: {"a": 1, "c": 3}) == \
+                [1, None, 3]
+            assert c.fetch_many("abc", lambda keys: {"b": 2}) == [1, 2, 3]
+
+    def testDuplicateKeys(self):
+        keys = 50 * [1, 2, 1]
+        for c in self._get_caches():
+            assert c.fetch_many(keys, self._batch) == [2 * k for k in keys]
+            assert c.fetch_many([1, 2], lambda keys: 1 / 0) == [2, 4]
+
+        # every cache file is written once (i.e. not in parallel)
+        c = DiskCache(join(self.cache_dir, "writes"))
+        written = []
+        write = c._write
+        c._write = lambda cache_file, entry: (written.append(cache_file),
+                                              write(cache_file, entry))
+        c.fetch_many(keys, self._batch)
+        assert len(written) == len(set(written)) == 2
+
+    def testInvalidResult(self):
+        c = MemoryCache()
+        with pytest.raises(ValueError):
+            c.fetch_many([1, 2], lambda keys: [1])
+
+    def testStatistics(self):
+        c = DiskCache(self.cache_dir)
+        c.fetch_many(range(10), self._batch)
+        c.fetch_many(range(15), self._batch)
+        assert c.getCacheStatistics() == {'cache_hits': 10,
+                                          'cache_misses': 15}
+
+    def testTtl(self):
+        c = DiskCache(self.cache_dir, ttl=0.2)
+        assert c.fetch_many([1], lambda keys: [Expiring("x", 60)]) == ["x"]
+        assert c.fetch_many([2], self._batch) == [4]
+        sleep(0.3)
+        assert c.fetch_many([1, 2], self._batch) == ["x", 4]
+        assert self.batches == [[2], [2]]
+
+    def testExpiring(self):
+        ''' per entry ttls are kept by caches relying on the default
+            _store_many '''
+        c = SQLiteCache(join(self.cache_dir, "cache.db"))
+        assert c.fetch_many([1, 2], lambda keys: [Expiring("x", 0.2), "y"]) \
+            == ["x", "y"]
+        sleep(0.3)
+        assert c.fetch_many([1, 2], self._batch) == [2, "y"]
+        assert self.batches == [[1]]
+
+
+class TestWriteBehind(object):
+    ''' tests the DiskCache's write-behind mode '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testWriteBehind(self):
+        c = DiskCache(self.cache_dir, 1, write_behind=True)
+        assert c.fetch(str, 1) == "1"
+        # pending entries are served before the write has finished
+        assert c.fetch(lambda x: None, 1) == "1"
+        c.flush()
+        assert not c._pending
+
+        other = DiskCache(self.cache_dir, 1)
+        assert other.fetch(lambda x: None, 1) == "1"
+        assert c.getKey(1) in c
+
+        assert c.fetch_many(range(20), lambda keys: map(str, keys)) == \
+            [str(i) for i in range(20)]
+        c.flush()
+        assert other.fetch_many(range(20), lambda keys: [None] * 19) == \
+            [str(i) for i in range(20)]
+
+    def testBackpressure(self):
+        from threading import Event
+        for policy, written in (('block', 4), ('drop', 1), ('sync', 4)):
+            c = DiskCache(join(self.cache_dir, policy), write_behind=True,
+                          max_queue_size=1, backpressure=policy)
+            # stall the writer thread until all entries have been submitted
+            started, resume = Event(), Event()
+            c._writer.submit(lambda: (started.set(), resume.wait()))
+            started.wait()
+            for i in range(4):
+                if policy == 'block' and i == 1:
+                    resume.set()
+                assert c.fetch(str, i) == str(i)
+            resume.set()
+            c.flush()
+            assert not c._pending
+            assert len([i for i in range(4) if c.getKey(i) in c]) == written
+
+    def testDecorator(self):
+        cached = DiskCached(self.cache_dir, write_behind=True,
+                            max_queue_size=5)
+        assert cached.cache._writer._queue.maxsize == 5
+
+    def testGarbageCollection(self):
+        ''' the exit handler does not keep caches alive '''
+        import gc
+        from weakref import ref
+        c = DiskCache(self.cache_dir, write_behind=True)
+        c.fetch(str, 1)
+        c.flush()
+        c = ref(c)
+        gc.collect()
+        assert c() is None
+
+    def testPickle(self):
+        from pickle import dumps, loads
+        c = loads(dumps(DiskCache(self.cache_dir, write_behind=True)))
+        assert c.fetch(str, 1) == "1"
+        c.flush()
+        assert DiskCache(self.cache_dir).getKey(1) in c
+
+
+class TestIterableCache(object):
+    ''' tests the crash safe, resumable IterableCache '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.produced = []
+        self.fail_at = None
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def _crawl(self, n, offset=0):
+        for i in range(offset, n):
+            if i == self.fail_at:
+                raise IOError("connection lost")
+            self.produced.append(i)
+            yield i
+
+    def testCommit(self):
+        c = IterableCache(self.cache_dir)
+        assert list(c.fetch(self._crawl, 10)) == list(range(10))
+        assert list(c.fetch(self._crawl, 10)) == list(range(10))
+        assert len(self.produced) == 10
+        assert c.getKey(10) in c
+        assert c.getCacheStatistics() == {'cache_hits': 10,
+                                          'cache_misses': 10}
+
+    def testResume(self):
+        ''' failed iterators leave a partial cache which is resumed '''
+        for resume_argument in (None, 'offset'):
+            c = IterableCache(join(self.cache_dir, str(resume_argument)),
+                              checkpoint_interval=3,
+                              resume_argument=resume_argument)
+            self.produced = []
+            self.fail_at = 7
+            result = []
+            with pytest.raises(IOError):
+                for obj in c.fetch(self._crawl, 10):
+                    result.append(obj)
+            assert result == list(range(7))
+            assert c.getKey(10) not in c
+
+            self.fail_at = None
+            assert list(c.fetch(self._crawl, 10)) == list(range(10))
+            assert c.getKey(10) in c
+            if resume_argument:
+                assert self.produced == list(range(10))
+            else:
+                # the function is restarted and the cached prefix skipped
+                assert self.produced == list(range(7)) + list(range(10))
+
+    def testEarlyStop(self):
+        ''' consumers which stop early keep the consumed prefix '''
+        c = IterableCache(self.cache_dir, resume_argument='offset')
+        it = c.fetch(self._crawl, 10)
+        assert [next(it) for _ in range(4)] == list(range(4))
+        it.close()
+        assert list(c.fetch(self._crawl, 10)) == list(range(10))
+        assert self.produced == list(range(10))
+
+    def testConcurrentConsumers(self):
+        ''' only one consumer extends the partial file '''
+        c = IterableCache(self.cache_dir)
+        first, second = c.fetch(self._crawl, 5), c.fetch(self._crawl, 5)
+        assert next(first) == 0
+        assert list(second) == list(range(5))
+        assert c.getKey(5) not in c
+        assert list(first) == list(range(1, 5))
+        assert c.getKey(5) in c
+
+
+class TestPackedCache(object):
+    ''' tests packing DiskCaches into PackedCaches '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.pack_file = join(self.cache_dir, "cache.pack")
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testPack(self):
+        disk = DiskCache(join(self.cache_dir, "disk"), 2, codec="pickle")
+        for i in range(500):
+            disk.fetch(str, i)
+        disk.fetchObjectId("key", lambda: {"a": [1, 2]})
+
+        assert pack_disk_cache(join(self.cache_dir, "disk"),
+                               self.pack_file) == 501
+        c = PackedCache(self.pack_file)
+        assert len(c) == 501
+        assert all(c.fetch(lambda x: None, i) == str(i) for i in range(500))
+        assert c.fetchObjectId("key", lambda: None) == {"a": [1, 2]}
+        assert c.getKey(499) in c and c.getKey(500) not in c
+
+        # misses are computed but not stored
+        assert c.fetch(lambda x: "computed", 500) == "computed"
+        assert c.getKey(500) not in c
+        assert c.getCacheStatistics() == {'cache_hits': 501,
+                                          'cache_misses': 1}
+
+    def testCodecs(self):
+        ''' entries of all codecs are decoded from the mapped pack, which
+            may be closed afterwards '''
+        from eWRT.util.codec import available_codecs
+        for codec in available_codecs():
+            DiskCache(join(self.cache_dir, "disk"), codec=codec).fetch(
+                lambda x: codec, codec)
+        pack_disk_cache(join(self.cache_dir, "disk"), self.pack_file)
+
+        c = PackedCache(self.pack_file)
+        assert all(c.fetch(lambda x: None, codec) == codec
+                   for codec in available_codecs())
+        c.close()
+
+    def testEmptyPack(self):
+        assert pack_disk_cache(join(self.cache_dir, "missing"),
+                               self.pack_file) == 0
+        c = PackedCache(self.pack_file)
+        assert len(c) == 0
+        assert c.fetch(str, 1) == "1"
+
+    def testBottomTier(self):
+        DiskCache(join(self.cache_dir, "disk")).fetch(str, 1)
+        main(["pack", join(self.cache_dir, "disk"), self.pack_file])
+
+        disk = DiskCache(join(self.cache_dir, "worker"))
+        c = TieredCache([disk, PackedCache(self.pack_file)])
+        assert c.fetch(lambda x: None, 1) == "1"
+        assert disk.getKey(1) in disk
+        assert c.fetch(str, 2) == "2"
+        assert disk.getKey(2) in disk
+
+    def testPickle(self):
+        from pickle import dumps, loads
+        DiskCache(join(self.cache_dir, "disk")).fetch(str, 1)
+        pack_disk_cache(join(self.cache_dir, "disk"), self.pack_file)
+        c = loads(dumps(PackedCache(self.pack_file)))
+        assert c.fetch(lambda x: None, 1) == "1"
+
+
+class TestGenerations(object):
+    ''' tests namespaces and generation based invalidation '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+
+    def teardown_method(self, method):
+        for janitor in list(DiskCacheJanitor._instances.values()):
+            janitor.stop()
+        rmtree(self.cache_dir)
+
+    def testNamespaces(self):
+        a = DiskCache(self.cache_dir, 1, namespace="a")
+        b = DiskCache(self.cache_dir, 1, namespace="b")
+        assert a.fetch(lambda x: "a", 1) == "a"
+        assert b.fetch(lambda x: "b", 1) == "b"
+        assert a.fetch(str, 1) == "a"
+        assert exists(join(self.cache_dir, "a@0"))
+
+    def testExplicitGeneration(self):
+        v1 = DiskCache(self.cache_dir, 1, namespace="api", generation="v1")
+        for i in range(20):
+            v1.fetch(str, i)
+        assert v1.getKey(1) in v1
+
+        v2 = DiskCache(self.cache_dir, 1, namespace="api", generation="v2")
+        assert v2.getKey(1) not in v2
+        assert v2.fetch(lambda x: "new", 1) == "new"
+
+        # the janitor removes the previous generation
+        janitor = DiskCacheJanitor._instances[abspath(self.cache_dir)]
+        janitor.stop()
+        janitor.run_pass()
+        assert janitor.reclaimed == 20
+        assert not exists(join(self.cache_dir, "api@v1"))
+        assert exists(join(self.cache_dir, "api@v2"))
+
+    def testInvalidate(self):
+        c = DiskCache(self.cache_dir, namespace="conceptnet")
+        other = DiskCache(self.cache_dir, namespace="conceptnet")
+        unrelated = DiskCache(self.cache_dir, namespace="geonames")
+        assert c.fetch(str, 1) == "1"
+        assert unrelated.fetch(str, 1) == "1"
+
+        c.invalidate()
+        assert c.fetch(lambda x: "new", 1) == "new"
+        # other instances notice the new generation
+        other._generation_checked = 0
+        assert other.fetch(lambda x: None, 1) == "new"
+        assert unrelated.fetch(lambda x: None, 1) == "1"
+
+        janitor = DiskCacheJanitor._instances[abspath(self.cache_dir)]
+        janitor.stop()
+        janitor.run_pass()
+        assert sorted(listdir(self.cache_dir)) == \
+            ["_generation@conceptnet", "conceptnet@1", "geonames@0"]
+
+    def testSharedCacheDir(self):
+        ''' generations never retire the entries of other caches '''
+        plain = DiskCache(self.cache_dir, 1)
+        for i in range(20):
+            plain.fetch(str, i)
+        v1 = DiskCache(self.cache_dir, 1, generation="v1")
+        v1.fetch(str, 1)
+        v2 = DiskCache(self.cache_dir, 1, generation="v2")
+        v2.fetch(str, 1)
+        api = DiskCache(self.cache_dir, 1, namespace="api", generation="v2")
+        api.fetch(str, 1)
+
+        janitor = DiskCacheJanitor._instances.get(abspath(self.cache_dir))
+        if janitor is not None:
+            janitor.stop()
+            janitor.run_pass()
+        assert all(plain.getKey(i) in plain for i in range(20))
+        assert v1.getKey(1) in v1
+
+    def testDecorator(self):
+        @DiskCached(self.cache_dir, namespace="f", generation=1)
+        def f(x):
+            return x * 2
+        assert f(2) == 4
+        assert exists(join(self.cache_dir, "f@1"))
+
+
+class TestSnapshot(object):
+    ''' tests persisting and restoring MemoryCaches '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.snapshot_file = join(self.cache_dir, "snapshot.gz")
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testSnapshotRestore(self):
+        c = MemoryCache(10)
+        for x in range(5):
+            c.fetch(str, x)
+        c.fetch(str, 0)
+        assert c.snapshot(self.snapshot_file) == 5
+
+        r = MemoryCache(10)
+        assert r.restore(self.snapshot_file) == 5
+        assert len(r) == 5
+        # the LRU order has been preserved
+        assert list(r._segments[0].data.keys()) == \
+            list(c._segments[0].data.keys())
+        assert r.fetch(lambda x: "miss", 3) == "3"
+
+    def testHottestEntries(self):
+        c = MemoryCache()
+        for x in range(10):
+            c.fetch(str, x)
+        c.fetch(str, 2)
+        assert c.snapshot(self.snapshot_file, max_entries=3) == 3
+
+        r = MemoryCache()
+        r.restore(self.snapshot_file)
+        assert sorted(r.fetch(lambda x: None, x) for x in (2, 8, 9)) == \
+            ["2", "8", "9"]
+        assert r.fetch(lambda x: "miss", 0) == "miss"
+
+    def testExpiredEntries(self):
+        c = MemoryCache(ttl=1)
+        c.fetch(str, 1)
+        c.snapshot(self.snapshot_file)
+        sleep(1.1)
+        assert MemoryCache(ttl=1).restore(self.snapshot_file) == 0
+
+    def testExistingEntriesAreKept(self):
+        c = MemoryCache()
+        c.fetch(str, 1)
+        c.snapshot(self.snapshot_file)
+
+        r = MemoryCache()
+        r.fetch(lambda x: "new", 1)
+        assert r.restore(self.snapshot_file) == 0
+        assert r.fetch(str, 1) == "new"
+
+    def testMissingAndCorruptSnapshots(self):
+        assert MemoryCache().restore(self.snapshot_file) == 0
+        with open(self.snapshot_file, "wb") as f:
+            f.write(b"corrupt")
+        assert MemoryCache().restore(self.snapshot_file) == 0
+
+    def testSnapshotBeforeRestore(self):
+        ''' snapshots never overwrite files which have not been restored '''
+        c = MemoryCache()
+        c.fetch(str, 1)
+        c.snapshot(self.snapshot_file)
+
+        r = MemoryCache()
+        r.snapshot_file = self.snapshot_file
+        r.restored.clear()
+        r._try_snapshot()
+        assert MemoryCache().restore(self.snapshot_file) == 1
+
+        r.restored.set()
+        r._try_snapshot()
+        assert MemoryCache().restore(self.snapshot_file) == 0
+
+    def testBackgroundRestore(self):
+        c = MemoryCache(snapshot_file=self.snapshot_file)
+        c.fetch(str, 1)
+        c.snapshot()
+
+        cached = MemoryCached(snapshot_file=self.snapshot_file)
+        f = cached(lambda x: "miss")
+        assert cached.restored.wait(5)
+        assert f(1) == "1"
+
+    def testSnapshotAtExit(self):
+        import sys
+        from subprocess import check_call
+        script = """if True:
+            from eWRT.util.cache import MemoryCache
+            c = MemoryCache(snapshot_file=%r)
+            c.restored.wait()
+            c.fetch(str, 1)
+        """ % self.snapshot_file
+        check_call([sys.executable, "-c", script],
+                   env=dict(environ, PYTHONPATH=pathsep.join(sys.path)))
+        assert MemoryCache().restore(self.snapshot_file) == 1
+
+    def testGarbageCollection(self):
+        ''' the exit handler does not keep caches alive '''
+        import gc
+        from weakref import ref
+        c = MemoryCache(snapshot_file=self.snapshot_file)
+        assert c.restored.wait(5)
+        c = ref(c)
+        for _ in range(50):
+            gc.collect()
+            if c() is None:
+                break
+            # the restore thread has not terminated yet
+            sleep(0.01)
+        assert c() is None
+
+
+def square(args):
+    ''' Function for checking the SharedMemoryCache across processes.
+
+        @remarks
+        required for the TestSharedMemoryCache unittest.
+    '''
+    c, x = args
+    return c.fetch(lambda x: x * x, x), c.getCacheStatistics()['cache_hits']
+
+
+class TestSharedMemoryCache(object):
+    ''' tests the SharedMemoryCache '''
+
+    def setup_method(self, method):
+        from tempfile import mkdtemp
+        self.cache_dir = mkdtemp()
+        self.shm_file = join(self.cache_dir, "shared.cache")
+
+    def teardown_method(self, method):
+        rmtree(self.cache_dir)
+
+    def testFetch(self):
+        c = SharedMemoryCache(self.shm_file)
+        assert c.fetch(str, 1) == "1"
+        assert c.fetch(lambda x: "miss", 1) == "1"
+        assert c.fetch(lambda x: None, 2) is None
+        assert len(c) == 1
+        assert c.getKey(1) in c and c.getKey(2) not in c
+
+        del c[c.getKey(1)]
+        assert c.getKey(1) not in c
+        assert len(c) == 0
+        assert c.fetch(lambda x: "new", 1) == "new"
+        assert c.getCacheStatistics() == {'cache_hits': 1, 'cache_misses': 3}
+
+    def testSharedFile(self):
+        ''' caches opened with the same file share their entries '''
+        a = SharedMemoryCache(self.shm_file, slots=128)
+        b = SharedMemoryCache(self.shm_file, slots=16)
+        a.fetch(str, 1)
+        assert b.fetch(lambda x: "miss", 1) == "1"
+        assert b._slots == 128
+        assert loads(dumps(a)).fetch(lambda x: "miss", 1) == "1"
+
+    def testClearWhenFull(self):
+        c = SharedMemoryCache(self.shm_file, max_bytes=2048, slots=16)
+        for x in range(11):
+            c.fetch(str, x)
+        assert len(c) == 11
+        c.fetch(str, 11)
+        assert len(c) == 1
+        assert c._get_metrics_gauges()['evictions'] == 11
+
+        c.fetch(lambda x: 5000 * "x", 12)
+        assert c.getKey(12) not in c
+        for x in range(100):
+            assert c.fetch(str, x) == str(x)
+        assert c.getCacheSize() <= 2048
+
+    def testCorruptRecord(self):
+        c = SharedMemoryCache(self.shm_file)
+        c.fetch(str, 1)
+        # flip a byte of the stored value
+        end = c._get_header()[2]
+        c._data[end - 1:end] = b"\xff"
+        assert c.getKey(1) not in c
+        assert c.fetch(lambda x: "recomputed", 1) == "recomputed"
+
+    def testTemporaryFile(self):
+        c = SharedMemoryCache()
+        assert exists(c.shm_file)
+        c._remove()
+        assert not exists(c.shm_file)
+
+    def testProcesses(self):
+        c = SharedMemoryCache(self.shm_file)
+        c.fetch(lambda x: x * x, 1)
+        p = Pool(4)
+        result = p.map(square, [(c, x) for x in (1, 2, 3)])
+        p.close()
+        p.join()
+        assert [r[0] for r in result] == [1, 4, 9]
+        assert result[0][1] == 1
+        for x in (2, 3):
+            assert c.fetch(lambda x: None, x) == x * x
+
+    def testForkedWriters(self):
+        ''' writes of forked processes (which inherit the cache rather than
+            unpickling it) are serialized '''
+        from os import fork, waitpid, _exit
+        c = SharedMemoryCache(self.shm_file, slots=4096)
+        children = []
+        for worker in range(4):
+            pid = fork()
+            if not pid:
+                try:
+                    for x in range(worker * 500, (worker + 1) * 500):
+                        c.fetch(str, x)
+                finally:
+                    _exit(0)
+            children.append(pid)
+        for pid in children:
+            waitpid(pid, 0)
+
+        assert len(c) == 2000
+        assert all(c.getKey(x) in c for x in range(2000))
+        assert c._get_header()[4] == 2000
+
+    def testDecorator(self):
+        @SharedMemoryCached(self.shm_file, ttl=1)
+        def double(x):
+            return 2 * x
+        assert double(2) == 4
+        assert double.fetch(lambda x: "miss", 2) == 4
+        sleep(1.1)
+        assert double.fetch(lambda x: "miss", 2) == "miss"
+
+
+class Counter(object):
+    ''' class with cached methods used by TestCachedMethod '''
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.calls = 0
+
+    def __eq__(self, other):
+        return False
+
+    __hash__ = None
+
+    @cached_method
+    def add(self, x):
+        ''' adds the offset '''
+        self.calls += 1
+        return x + self.offset
+
+    @cached_method(max_cache_size=2, shared=True)
+    def double(self, x):
+        self.calls += 1
+        return 2 * x
+
+
+class TestCachedMethod(object):
+    ''' tests the cached_method decorator '''
+
+    def testPerInstanceCache(self):
+        a, b = Counter(1), Counter(10)
+        assert a.add(1) == 2 and a.add(1) == 2
+        assert b.add(1) == 11
+        assert a.calls == 1 and b.calls == 1
+        assert Counter.add(a, 1) == 2
+        assert a.calls == 1
+        assert Counter.add.__doc__ == ''' adds the offset '''
+
+    def testKeyWithoutSelf(self):
+        a = Counter(1)
+        a.add(5)
+        cache = Counter.add.get_cache(a)
+        assert cache.getKey(5) in cache
+
+    def testWeakReferences(self):
+        import gc
+        gc.collect()
+        instances = len(Counter.add._caches)
+        a = Counter(1)
+        a.add(1)
+        assert len(Counter.add._caches) == instances + 1
+        del a
+        gc.collect()
+        assert len(Counter.add._caches) == instances
+
+    def testBounded(self):
+        a = Counter(0)
+        for x in range(DEFAULT_METHOD_CACHE_SIZE + 10):
+            a.add(x)
+        assert len(Counter.add.get_cache(a)) == DEFAULT_METHOD_CACHE_SIZE
+
+    def testSharedCache(self):
+        a, b = Counter(1), Counter(2)
+        assert a.double(3) == 6
+        assert b.double(3) == 6
+        assert a.calls == 1 and b.calls == 0
+        assert Counter.double.get_cache(a) is Counter.double.get_cache(b)
+        assert len(Counter.double.cache) == 1
+
+    def testExplicitCache(self):
+        cache = MemoryCache()
+
+        class Squares(object):
+            @cached_method(cache=cache)
+            def square(self, x):
+                return x * x
+
+        assert Squares().square(3) == 9
+        assert cache.fetch(lambda x: None, 3) == 9
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from eWRT.util.codec import *
+
+from gzip import GzipFile
+from io import BytesIO
+from unittest import main, TestCase
+try:
+    from cPickle import dump
+except ImportError:
+    from pickle import dump
+
+
+class TestCodec(TestCase):
+
+    TEST_OBJECTS = ('{"term": "climate change", "count": 12}',
+                    {'a': list(range(100)), 'b': u'über'},
+                    12)
+
+    def testRoundTrip(self):
+        """ all available codecs decode their own output """
+        for name in available_codecs():
+            codec = get_codec(name)
+            for obj in self.TEST_OBJECTS:
+                self.assertEqual(codec.loads(codec.dumps(obj)), obj)
+                self.assertEqual(decode(codec.dumps(obj)), obj)
+                if bytes is not str:
+                    # python 3 decodes memoryviews without copying them
+                    self.assertEqual(decode(memoryview(codec.dumps(obj))),
+                                     obj)
+
+    def testCompressionLevel(self):
+        """ the compression level is passed to the codec """
+        self.assertEqual(get_codec("zlib", 1).level, 1)
+        obj = 1000 * "eWRT"
+        self.assertTrue(len(get_codec("zlib", 9).dumps(obj)) <
+                        len(get_codec("pickle").dumps(obj)))
+
+    def testLegacyFormat(self):
+        """ gzip files created by previous versions remain readable """
+        buf = BytesIO()
+        with GzipFile(fileobj=buf, mode="w") as f:
+            dump(self.TEST_OBJECTS, f)
+        self.assertEqual(decode(buf.getvalue()), self.TEST_OBJECTS)
+
+    def testGzipProtocol(self):
+        """ gzip entries remain readable by python 2 """
+        from pickletools import genops
+        from zlib import decompress
+        data = decompress(get_codec("gzip").dumps(self.TEST_OBJECTS), 31)
+        self.assertTrue(all(op.proto <= 2 for op, _, _ in genops(data)))
+
+    def testCodecNames(self):
+        """ codecs may be passed by (unicode) name """
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from eWRT.util.cache import DiskCache
+        cache_dir = mkdtemp()
+        try:
+            self.assertTrue(isinstance(DiskCache(cache_dir, codec=u"zlib").codec,
+                                       ZlibCodec))
+        finally:
+            rmtree(cache_dir)
+
+    def testUnknownFormat(self):
+        self.assertRaises(ValueError, decode, b"no cache entry")
+
+
+if __name__ == '__main__':
+    main()
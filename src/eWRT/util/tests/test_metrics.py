@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+from eWRT.util.metrics import *
+from eWRT.util.cache import MemoryCache, DiskCache, DiskCacheJanitor
+
+from os.path import abspath
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+
+def double(x):
+    return 2 * x
+
+
+def triple(keys):
+    return [3 * key for key in keys]
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.cache_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    def _get_cache(self, cache):
+        cache.metrics_registry = self.registry
+        return cache
+
+    def testHistogram(self):
+        h = Histogram((1, 2, float("inf")))
+        for value in (0.5, 1, 1.5, 7):
+            h.observe(value)
+        self.assertEqual(h.as_dict(), {'buckets': [(1, 2), (2, 1),
+                                                   (float("inf"), 1)],
+                                       'sum': 10., 'count': 4})
+
+    def testFunctionName(self):
+        self.assertEqual(get_function_name(double), __name__ + ".double")
+
+    def testMemoryCache(self):
+        c = self._get_cache(MemoryCache(2))
+        for x in (1, 2, 1, 3, 1):
+            c.fetch(double, x)
+
+        metrics = self.registry.as_dict()[__name__ + ".double"]
+        self.assertEqual(metrics['hits'], 2)
+        self.assertEqual(metrics['misses'], 3)
+        self.assertEqual(metrics['hit_ratio'], 0.4)
+        self.assertEqual(metrics['lookup_latency']['count'], 5)
+        self.assertEqual(metrics['compute_latency']['count'], 3)
+        self.assertEqual(metrics['entries'], 2)
+        self.assertEqual(metrics['evictions'], 1)
+        self.assertEqual(metrics['bytes_read'], 0)
+
+    def testDecoratedFunction(self):
+        ''' decorated functions are recorded under their own name '''
+        c = self._get_cache(MemoryCache(fn=double))
+        c(1)
+        c.fetch(triple, [1])
+        self.assertEqual(list(self.registry.as_dict().keys()),
+                         [__name__ + ".double"])
+
+    def testDiskCache(self):
+        c = self._get_cache(DiskCache(self.cache_dir))
+        self.assertEqual(c.fetch_many([1, 2], triple), [3, 6])
+        self.assertEqual(c.fetch_many([1, 2, 3], triple), [3, 6, 9])
+
+        metrics = self.registry.as_dict()[__name__ + ".triple"]
+        self.assertEqual((metrics['hits'], metrics['misses']), (2, 3))
+        self.assertTrue(metrics['bytes_read'] > 0)
+        self.assertTrue(metrics['bytes_written'] > metrics['bytes_read'])
+        self.assertEqual(metrics['entries'], None)
+
+    def testDirectoryGauges(self):
+        ''' the counts of a shared cache directory are reported once '''
+        a = self._get_cache(DiskCache(self.cache_dir))
+        b = self._get_cache(DiskCache(self.cache_dir))
+        # a janitor without background thread
+        janitor = DiskCacheJanitor(self.cache_dir, max_bytes=2 ** 20)
+        DiskCacheJanitor._instances[abspath(self.cache_dir)] = janitor
+        try:
+            a.fetch(double, 1)
+            b.fetch(double, 2)
+            b.fetch(triple, [3])
+            janitor.run_pass()
+
+            metrics = self.registry.as_dict()
+            self.assertEqual(metrics[__name__ + ".double"]['entries'], None)
+            self.assertEqual(self.registry.get_directory_gauges(),
+                             {abspath(self.cache_dir): {'entries': 3,
+                                                        'evictions': 0}})
+            self.assertTrue('ewrt_cache_directory_entries{cache_dir="%s"} 3\n'
+                            % abspath(self.cache_dir)
+                            in self.registry.to_prometheus())
+        finally:
+            janitor.stop()
+
+    def testThreads(self):
+        ''' the counters of all threads (including terminated ones) are
+            aggregated '''
+        from threading import Thread
+        metrics = self.registry.get("f")
+        threads = [Thread(target=lambda: [metrics.record(0.1)
+                                          for _ in range(100)])
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        metrics.record(0.2, 0.1, hits=0, misses=1)
+
+        self.assertEqual((metrics.hits, metrics.misses), (400, 1))
+        self.assertEqual(metrics.as_dict()['lookup_latency']['count'], 401)
+        self.assertEqual(len(metrics._counters), 1)
+
+    def testDisabled(self):
+        ''' recording is disabled unless a registry is set '''
+        c = MemoryCache()
+        c.fetch(double, 1)
+        self.assertFalse(__name__ + ".double" in REGISTRY.as_dict())
+
+        c.metrics_registry = self.registry
+        c.fetch(double, 1)
+        other = MetricsRegistry()
+        c.metrics_registry = other
+        c.fetch(double, 1)
+        c.metrics_registry = None
+        c.fetch(double, 1)
+        for registry in (self.registry, other):
+            self.assertEqual(registry.as_dict()[__name__ + ".double"]['hits'],
+                             1)
+
+    def testPrometheus(self):
+        c = self._get_cache(MemoryCache())
+        c.fetch(double, 1)
+        c.fetch(double, 1)
+        text = self.registry.to_prometheus()
+        label = '{function="%s.double"}' % __name__
+        self.assertTrue('ewrt_cache_hits_total%s 1\n' % label in text)
+        self.assertTrue('ewrt_cache_misses_total%s 1\n' % label in text)
+        self.assertTrue('ewrt_cache_entries%s 1\n' % label in text)
+        self.assertTrue('ewrt_cache_lookup_seconds_count%s 2\n' % label
+                        in text)
+        self.assertTrue('ewrt_cache_lookup_seconds_bucket{function="%s.double",'
+                        'le="+Inf"} 2\n' % __name__ in text)
+        self.assertTrue('# TYPE ewrt_cache_compute_seconds histogram\n'
+                        in text)
+
+    def testPerformance(self):
+        c = self._get_cache(MemoryCache())
+        c.fetch(double, 1)
+        c.fetch(double, 1)
+        messages = [p.message for p in self.registry.to_performance()]
+        self.assertTrue("'%s.double hit ratio'=50.0%%;;;0;100" % __name__
+                        in messages)
+        self.assertTrue("'%s.double misses'=1c;;;;" % __name__ in messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,11 @@ from eWRT.util.pickleIterator import *
 from tempfile import mkdtemp
 from unittest import main, TestCase
 from random import randint
+from os import remove
 from os.path import join
+from shutil import rmtree
+from binascii import b2a_base64
+import gzip
 
 class TestPickle(TestCase):
 
@@ -15,6 +19,9 @@ class TestPickle(TestCase):
         self.test_dict = [ self._get_test_dictionary(10) for x in range(10) ]
         self.fdir = mkdtemp()
 
+    def tearDown(self):
+        rmtree(self.fdir)
+
 
     def _get_test_dictionary(self, num_elements):
         """ returns a test dictionary with the given number
@@ -39,6 +46,82 @@ class TestPickle(TestCase):
         pw = WritePickleIterator( join( self.fdir, self.TESTFILE_NAME ) )
         for element in self.test_dict:
             pw.dump(element)
+        pw.close()
+
+    def _write(self, elements, block_size=100):
+        fname = join(self.fdir, self.TESTFILE_NAME)
+        with WritePickleIterator(fname, block_size=block_size) as pw:
+            for element in elements:
+                pw.dump(element)
+        return fname
+
+    def testRandomAccess(self):
+        """ tests len(), seek() and slicing """
+        elements = [ str(x) * (x % 30) for x in range(500) ]
+        fname = self._write(elements)
+
+        for threads in (1, 4):
+            with ReadPickleIterator(fname, threads=threads) as pr:
+                self.assertEqual(len(pr), 500)
+                self.assertEqual(pr[0], elements[0])
+                self.assertEqual(pr[-1], elements[-1])
+                self.assertEqual(pr[123], elements[123])
+                self.assertEqual(pr[10:400:7], elements[10:400:7])
+                self.assertEqual(pr[490:600], elements[490:])
+                self.assertRaises(IndexError, lambda: pr[500])
+
+                pr.seek(250)
+                self.assertEqual(list(pr), elements[250:])
+                pr.seek(500)
+                self.assertEqual(list(pr), [])
+                pr.seek(0)
+                self.assertEqual(list(pr), elements)
+
+    def testMissingIndex(self):
+        """ files without (or with an outdated) index remain readable """
+        elements = list(range(100))
+        fname = self._write(elements, block_size=64)
+        remove(fname + '.gz' + INDEX_SUFFIX)
+        self.assertEqual(list(ReadPickleIterator(fname)), elements)
+
+        # truncated files (e.g. after a crash) yield all complete blocks
+        with open(fname + '.gz', 'rb') as f:
+            data = f.read()
+        with open(fname + '.gz', 'wb') as f:
+            f.write(data[:-5])
+        pr = ReadPickleIterator(fname)
+        self.assertEqual(list(pr), elements[:len(pr)])
+        self.assertTrue(0 < len(pr) < 100)
+
+    def testRebuiltIndex(self):
+        """ the rebuilt index equals the written one, regardless of how
+            the blocks are split into read chunks """
+        import eWRT.util.pickleIterator as pickle_iterator
+        fname = self._write([str(x) * (x % 30) for x in range(500)])
+        with ReadPickleIterator(fname) as pr:
+            index = pr._load_index()
+            read_size = pickle_iterator.INDEX_READ_SIZE
+            try:
+                for pickle_iterator.INDEX_READ_SIZE in (1, 7, 100, 1 << 16):
+                    self.assertEqual(pr._build_index(), index)
+            finally:
+                pickle_iterator.INDEX_READ_SIZE = read_size
+
+    def testEmpty(self):
+        fname = self._write([])
+        self.assertEqual(list(ReadPickleIterator(fname)), [])
+        self.assertEqual(len(ReadPickleIterator(fname)), 0)
+
+    def testLegacyFormat(self):
+        """ files using the base64 format remain readable """
+        fname = join(self.fdir, self.TESTFILE_NAME + '.gz')
+        with gzip.open(fname, 'wb') as f:
+            for element in self.test_dict:
+                f.write(b2a_base64(dumps(element)))
+
+        pr = ReadPickleIterator(fname)
+        self.assertEqual(list(pr), self.test_dict)
+        self.assertRaises(TypeError, len, pr)
 
 
 if __name__ == '__main__':
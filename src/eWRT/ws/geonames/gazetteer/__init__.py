@@ -22,7 +22,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from eWRT.access.db import PostgresqlDb
-from eWRT.util.cache import MemoryCached
+from eWRT.util.cache import cached_method
 from eWRT.config import DATABASE_CONNECTION, GEO_ENTITY_SEPARATOR
 from eWRT.ws.geonames.gazetteer.exception import GazetteerEntryNotFound
 
@@ -55,14 +55,14 @@ class Gazetteer(object):
         """
         geoId = []
         if name:
-            geoId.extend( self.getIdFromName(self, name) )
+            geoId.extend( self.getIdFromName(name) )
         if id:
             geoId.append( id )
         if geoUrl:
             geoId.extend( self.getIdFromGeoUrl( geoUrl ) )
         return self.getGeoEntityDictFromId( geoId )
 
-    @MemoryCached
+    @cached_method
     def getIdFromName(self, name):
         """ returns the possible GeoNames ids for the given name 
             @param[in] name
@@ -84,7 +84,7 @@ class Gazetteer(object):
         where = []
         for nr, name in enumerate( geoUrl ):
             join.append("JOIN locatedin L%d ON (A%d.id = L%d.parent_id) JOIN gazetteerentity A%d ON (A%d.id = L%d.child_id)" % (nr, nr, nr, nr+1, nr+1, nr) )
-            where.append( "A%d.id IN (%s)" % (nr, ", ".join( map(str, self.getIdFromName(self, name))) ))
+            where.append( "A%d.id IN (%s)" % (nr, ", ".join( map(str, self.getIdFromName(name))) ))
 
         query = "SELECT A%d.id AS id FROM gazetteerentity A0 %s WHERE %s;" % ( nr, " ".join(join[:-1]), " AND ".join(where) )
         return [ int(r['id']) for r in self.db.query( query ) ]
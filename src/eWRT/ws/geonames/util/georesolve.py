@@ -24,7 +24,7 @@
 
 import sys
 from eWRT.access.db import PostgresqlDb
-from eWRT.util.cache import MemoryCached
+from eWRT.util.cache import cached_method
 from eWRT.config import DATABASE_CONNECTION
 # from warnings import warn
 
@@ -84,7 +84,7 @@ class Gazetteer(object):
         self.db2 = PostgresqlDb( **DATABASE_CONNECTION['geo_mapping'] )
         self.db2.connect()
 
-    @MemoryCached
+    @cached_method
     def getGeoNameFromContentID(self, content_id):
         """ returns the location of the content ID
             @param content_id
@@ -98,12 +98,12 @@ class Gazetteer(object):
             return 'ContentID not found!'
         else:
             gaz_id = result[0]['gazetteer_id']
-            return Gazetteer.getGeoNameFromGeoId(self, gaz_id)
+            return self.getGeoNameFromGeoId(gaz_id)
 
     ## returns the location of the GazetteerEntry ID  
     # @param gazetteer-entry ID  
     # @return list of locations, e.g. ['Europa', 'France', 'Centre']
-    @MemoryCached
+    @cached_method
     def getGeoNameFromGeoId(self, gazetteer_id):
         result = self.__getLocationTree(gazetteer_id)
         result.reverse()
@@ -113,7 +113,7 @@ class Gazetteer(object):
         else:
             return result
 
-    @MemoryCached
+    @cached_method
     def getGeoNameFromString(self, name):
         """ returns the geoname for the given string
             @param string
@@ -124,7 +124,7 @@ class Gazetteer(object):
                   JOIN gazetteerentity ON (gazetteerentity.id=hasname.entity_id) WHERE name = '%%s' AND (population > %d or feature_code in ('ADM1', 'ADM2', 'ADM3')) ''' % ( MIN_POPULATION)
         for result in self.db.query(query % name.replace("'", "''")):
             try:
-                tmp = Gazetteer.getGeoNameFromGeoId(self, result['entity_id'])
+                tmp = self.getGeoNameFromGeoId(result['entity_id'])
                 res.add( (result['population'], tuple(tmp)) )
             except GazetteerEntryNotFound:
                 pass
@@ -197,7 +197,7 @@ class Gazetteer(object):
         else:
             return result[0]['parent_id']
 
-    @MemoryCached
+    @cached_method
     def __getNameGeoId(self, name):
         """ returns the possible geoids for the given name 
             @param[in] name
@@ -219,7 +219,7 @@ class Gazetteer(object):
         where = []
         for nr, name in enumerate( geoUrl ):
             join.append("JOIN locatedin L%d ON (A%d.id = L%d.parent_id) JOIN gazetteerentity A%d ON (A%d.id = L%d.child_id)" % (nr, nr, nr, nr+1, nr+1, nr) )
-            where.append( "A%d.id IN (%s)" % (nr, ", ".join( map(str, self.__getNameGeoId(self, name))) ))
+            where.append( "A%d.id IN (%s)" % (nr, ", ".join( map(str, self.__getNameGeoId(name))) ))
 
         query = "SELECT A%d.id AS id FROM gazetteerentity A0 %s WHERE %s;" % ( nr, " ".join(join[:-1]), " AND ".join(where) )
         return [ int(r['id']) for r in self.db.query( query ) ]
@@ -257,7 +257,7 @@ class TestGazeteer(object):
                        6470560,  # New York
                        2772400): # Linz
 
-            geoUrl    = self.gazetteer.getGeoNameFromGeoId( self.gazetteer, geoId )
+            geoUrl    = self.gazetteer.getGeoNameFromGeoId( geoId )
             geoIdList = self.gazetteer.getGeoIdFromGeoUrl( geoUrl )
             assert len(geoIdList) == 1
             assert geoId == geoIdList[0]
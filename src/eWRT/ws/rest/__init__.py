@@ -27,11 +27,10 @@ except:
 
 from json import dumps, loads
 from functools import partial
-from socket import setdefaulttimeout
 
 from eWRT.access.http import Retrieve
 
-# set higher timeout values
+# set higher timeout values (read timeout of the requests)
 WS_DEFAULT_TIMEOUT = 900
 
 logger = logging.getLogger('eWRT.ws.rest')
@@ -52,6 +51,7 @@ class RESTClient(object):
             :param password: password
             :param authentification_method: authentification method to use
                                             ('basic'*, 'digest').
+            :param default_timeout: the read timeout of the requests
         '''
         # remove superfluous slashes, if required
         self.service_url = service_url[:-1] if service_url.endswith("/") \
@@ -72,7 +72,7 @@ class RESTClient(object):
 
     def _json_request(self, url, parameters=None, return_plain=False,
                       json_encode_arguments=True,
-                      content_type='application/json'):
+                      content_type='application/json', deadline=None):
         ''' performs the given json request
         :param url: the url to query
         :param parameters: optional paramters
@@ -81,14 +81,16 @@ class RESTClient(object):
         :param json_encode_arguments: whether to json encode the parameters
                                       (True*)
         :param content_type: one of 'application/json', 'application/xml'
+        :param deadline: optional time (as returned by time.time()) by which
+                         the request has to be completed
         '''
         if parameters:
             handle = self.retrieve(
                 url,
                 dumps(parameters) if json_encode_arguments else parameters,
-                {'Content-Type': content_type})
+                {'Content-Type': content_type}, deadline=deadline)
         else:
-            handle = self.retrieve(url)
+            handle = self.retrieve(url, deadline=deadline)
 
         response = handle.read()
         if response:
@@ -129,7 +131,8 @@ class RESTClient(object):
 
     def execute(self, command, identifier=None, parameters=None,
                 return_plain=False, json_encode_arguments=True,
-                query_parameters=None, content_type='application/json'):
+                query_parameters=None, content_type='application/json',
+                deadline=None):
         ''' executes a json command on the given web service
         :param command: the command to execute
         :param identifier: an optional identifier (e.g. batch_id, ...)
@@ -138,6 +141,8 @@ class RESTClient(object):
                              using json.load (False*)
         :param json_encode_arguments: whether to json encode the parameters
         :param query_parameters: optional query parameters
+        :param deadline: optional time (as returned by time.time()) by which
+                         the request has to be completed
         :rtype: the query result
         '''
         url = self.get_request_url(self.service_url, command, identifier,
@@ -146,7 +151,8 @@ class RESTClient(object):
         logger.debug('requesting url %s' % url)
 
         return self._json_request(url, parameters, return_plain,
-                                  json_encode_arguments, content_type)
+                                  json_encode_arguments, content_type,
+                                  deadline)
 
 class MultiRESTClient(object):
     ''' allows multiple URLs for access REST services '''
@@ -230,7 +236,7 @@ class MultiRESTClient(object):
     def request(self, path, parameters=None, return_plain=False,
                 execute_all_services=False, json_encode_arguments=True,
                 query_parameters=None, content_type='application/json',
-                pass_through_exceptions=()):
+                pass_through_exceptions=(), deadline=None):
         ''' performs the given json request
         @param url: the url to query
         @param parameters: optional paramters
@@ -238,6 +244,10 @@ class MultiRESTClient(object):
             set to True, if the client shall pass through all exceptions
         @param return_plain: whether to return the result without prior
                              deserialization using json.load (False*)
+        @param deadline: optional time (as returned by time.time()) by which
+                         the request has to be completed; it is shared by
+                         all servers, i.e. failing over to another server
+                         does not extend the caller's time budget
         '''
         response = None
         errors = []
@@ -249,7 +259,8 @@ class MultiRESTClient(object):
                     return_plain=return_plain,
                     json_encode_arguments=json_encode_arguments,
                     query_parameters=query_parameters,
-                    content_type=content_type)
+                    content_type=content_type,
+                    deadline=deadline)
 
                 if not execute_all_services:
                     break
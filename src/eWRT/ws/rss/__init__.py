@@ -28,12 +28,16 @@ def parse(url, last_modified=None):
     feed = feedparser.parse(url, modified=last_modified)
     retrieve = Retrieve("rss", HTTP_FETCH_DELAY)
     
-    result = []
-    for item in feed['items']:
-        if datetime.fromtimestamp(
-                mktime(item['updated_parsed'])) > last_modified:
-            item['content'] = retrieve.open(item['link']).read()
-            result.append(item)
+    result = [item for item in feed['items']
+              if datetime.fromtimestamp(
+                  mktime(item['updated_parsed'])) > last_modified]
+
+    # retrieve the referenced pages concurrently
+    for item, (_, content) in zip(result, retrieve.fetch_many(
+            [item['link'] for item in result])):
+        if isinstance(content, Exception):
+            raise content
+        item['content'] = content
 
     return result
 